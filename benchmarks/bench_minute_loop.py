@@ -0,0 +1,245 @@
+import argparse, json, os, resource, subprocess, sys, tempfile, time, tracemalloc
+import datetime as dt
+
+
+# Runs Node-Watcher's minute loop over made-up meshes (see fake_services.py), with local stand-ins for the BIRD API,
+# Slack and Node Explorer, and reports for each cycle how long it took, what got asked of each service and of sqlite,
+# and how much memory it took:
+#   python3 benchmarks/bench_minute_loop.py --routers 1000 10000 50000 --minutes 30 --json bench.json
+# and later, after a change:
+#   python3 benchmarks/bench_minute_loop.py --routers 1000 10000 50000 --minutes 30 --compare bench.json
+# which exits non-zero if anything got more than --tolerance worse. Each mesh size runs in a process of its own,
+# so one's memory use doesn't count against the next
+
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(benchmarks_dir)
+
+# the same minutes every run, so the daily report never lands in the middle of one
+start_minute = dt.datetime(2024, 1, 31, 0, 0, tzinfo=dt.timezone.utc)
+
+# what --compare looks at - for all of them, bigger is worse
+compared_metrics = ["process_ms_p95", "fetch_ms_p95", "api_calls_per_cycle", "sqlite_statements_per_cycle", "peak_memory_mb", "max_rss_mb"]
+
+
+arg_parser = argparse.ArgumentParser(description="Benchmark Node-Watcher's minute loop against synthetic meshes")
+arg_parser.add_argument("--routers", type=int, nargs="+", default=[1000, 10000, 50000], help="mesh sizes to run, at least 100 each")
+arg_parser.add_argument("--minutes", type=int, default=30, help="cycles to run per mesh")
+arg_parser.add_argument("--seed", type=int, default=0)
+arg_parser.add_argument("--churn", type=int, default=2, help="spokes that drop out each minute - hub_down_node_qty or more at once looks like a hub outage")
+arg_parser.add_argument("--churn-max-minutes", type=int, default=30, help="longest a dropped spoke stays down")
+arg_parser.add_argument("--flappers", type=int, default=10, help="spokes that go down every other minute")
+arg_parser.add_argument("--hub-outage", type=int, default=40, help="routers taken down by the hub outage, 0 for none")
+arg_parser.add_argument("--hub-outage-at", type=int, default=10, help="minute the hub outage starts")
+arg_parser.add_argument("--hub-outage-minutes", type=int, default=10, help="how long the hub outage lasts")
+arg_parser.add_argument("--api-latency-ms", type=float, default=0, help="added to every fake API request")
+arg_parser.add_argument("--memory", action="store_true", help="track peak Python memory per cycle with tracemalloc (slows everything down)")
+arg_parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="override a tuneable from nodewatcher/config.py (VALUE is JSON)")
+arg_parser.add_argument("--json", metavar="FILE", help="save the results, every cycle included")
+arg_parser.add_argument("--compare", metavar="FILE", help="results saved by an earlier --json to check against")
+arg_parser.add_argument("--tolerance", type=float, default=0.25, help="how much worse than --compare a metric can get, as a fraction")
+arg_parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+arg_parser.add_argument("--result", help=argparse.SUPPRESS)
+
+
+def percentile( values, fraction ):
+	values = sorted(values)
+	return( values[min(len(values) - 1, int(len(values) * fraction))] )
+
+
+####  ONE MESH, IN ITS OWN PROCESS  ####
+
+def run_mesh( args ):
+	sys.path.insert(0, repo_dir)
+	from fake_services import FakeServices, SyntheticMesh
+
+	router_qty = args.routers[-1]
+	mesh = SyntheticMesh(router_qty, args.seed, args.churn, args.churn_max_minutes, args.flappers,
+	                     args.hub_outage, args.hub_outage_at, args.hub_outage_minutes)
+	services = FakeServices(mesh, start_minute, args.api_latency_ms / 1000)
+	services.start()
+
+	from nodewatcher.app import NodeWatcher
+	from nodewatcher.cli import setup_logger
+	from nodewatcher.config import make_config
+
+	overrides = {
+		"channel":                  "CBENCH",
+		"escalation_channel":       "CBENCHESCALATION",
+		"token":                    "bench",
+		"thread_URI_prefix":        services.prefix + "archives/",
+		"slack_API_prefix":         services.prefix + "slack/",
+		"BIRD_API_prefix":          services.prefix + "bird/",
+		"Node_Explorer_API_prefix": services.prefix + "node-explorer/",
+		"slack_rate_limits_s":      {}, # the rate limits would only make the outbox drain slower, which is Slack's time and not ours
+	}
+	for override in args.set:
+		name, value = override.split("=", 1)
+		overrides[name] = json.loads(value)
+	try:
+		config = make_config( "prod", overrides )
+	except ValueError as e:
+		sys.exit(f"--set: {e}")
+
+	setup_logger('application_log', config.application_log_file, config.log_level)
+	setup_logger('node_changes_log', config.node_changes_log_file, config.log_level)
+	node_watcher = NodeWatcher( config )
+	node_watcher.start()
+
+	sqlite_statements = [0]
+	node_watcher.storage.conn.set_trace_callback(lambda statement: sqlite_statements.__setitem__(0, sqlite_statements[0] + 1))
+	if args.memory:
+		tracemalloc.start()
+
+	one_minute = dt.timedelta(minutes=1)
+	previous = node_watcher.source.fetch( start_minute - one_minute )
+	services.take_counts()
+	cycles = []
+	for i in range(args.minutes):
+		sqlite_statements[0] = 0
+		if args.memory:
+			tracemalloc.reset_peak()
+
+		started_s = time.perf_counter()
+		current = node_watcher.source.fetch( start_minute + one_minute * i )
+		fetched_s = time.perf_counter()
+		snapshot = node_watcher.make_snapshot_item( previous, current )
+		node_watcher.process_snapshot( snapshot )
+		processed_s = time.perf_counter()
+		node_watcher.outbox.join( 60 )
+		drained_s = time.perf_counter()
+
+		cycle = {
+			"minute":            i,
+			"added":             len(snapshot["added"]),
+			"removed":           len(snapshot["removed"]),
+			"fetch_ms":          (fetched_s - started_s) * 1000,
+			"process_ms":        (processed_s - fetched_s) * 1000,
+			"drain_ms":          (drained_s - processed_s) * 1000, # waiting on the Slack outbox, off the main loop
+			"sqlite_statements": sqlite_statements[0],
+			"api_calls":         dict(services.take_counts()),
+		}
+		if args.memory:
+			cycle["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+		cycles.append(cycle)
+		previous = current
+
+	services.stop()
+	result = {"routers": router_qty, "cycles": cycles, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+	with open(args.result, "w") as result_file:
+		json.dump(result, result_file)
+
+
+####  EVERY MESH, AND THE REPORT  ####
+
+def summarize( result ):
+	cycles = result["cycles"]
+	api_calls = {}
+	for cycle in cycles:
+		for name, qty in cycle["api_calls"].items():
+			api_calls[name] = api_calls.get(name, 0) + qty
+	summary = {
+		"routers":                     result["routers"],
+		"cycles":                      len(cycles),
+		"process_ms_p50":              percentile([cycle["process_ms"] for cycle in cycles], 0.5),
+		"process_ms_p95":              percentile([cycle["process_ms"] for cycle in cycles], 0.95),
+		"process_ms_max":              max(cycle["process_ms"] for cycle in cycles),
+		"fetch_ms_p50":                percentile([cycle["fetch_ms"] for cycle in cycles], 0.5),
+		"fetch_ms_p95":                percentile([cycle["fetch_ms"] for cycle in cycles], 0.95),
+		"drain_ms_max":                max(cycle["drain_ms"] for cycle in cycles),
+		"api_calls_per_cycle":         sum(api_calls.values()) / len(cycles),
+		"api_calls_max":               max(sum(cycle["api_calls"].values()) for cycle in cycles),
+		"api_calls":                   api_calls,
+		"sqlite_statements_per_cycle": sum(cycle["sqlite_statements"] for cycle in cycles) / len(cycles),
+		"sqlite_statements_max":       max(cycle["sqlite_statements"] for cycle in cycles),
+		"max_rss_mb":                  result["max_rss_mb"],
+	}
+	if "peak_memory_mb" in cycles[0]:
+		summary["peak_memory_mb"] = max(cycle["peak_memory_mb"] for cycle in cycles)
+	return( summary )
+
+
+def print_report( summaries ):
+	rows = [
+		("cycles",                    "cycles",                      "{:.0f}"),
+		("process ms p50",            "process_ms_p50",              "{:.1f}"),
+		("process ms p95",            "process_ms_p95",              "{:.1f}"),
+		("process ms max",            "process_ms_max",              "{:.1f}"),
+		("fetch ms p50",              "fetch_ms_p50",                "{:.1f}"),
+		("fetch ms p95",              "fetch_ms_p95",                "{:.1f}"),
+		("outbox drain ms max",       "drain_ms_max",                "{:.1f}"),
+		("API calls / cycle",         "api_calls_per_cycle",         "{:.2f}"),
+		("API calls max",             "api_calls_max",               "{:.0f}"),
+		("sqlite statements / cycle", "sqlite_statements_per_cycle", "{:.1f}"),
+		("sqlite statements max",     "sqlite_statements_max",       "{:.0f}"),
+		("tracemalloc peak MB",       "peak_memory_mb",              "{:.1f}"),
+		("max RSS MB",                "max_rss_mb",                  "{:.1f}"),
+	]
+	print(f"{'routers':<28}" + "".join(f"{summary['routers']:>12}" for summary in summaries))
+	for label, key, number_format in rows:
+		if all(key in summary for summary in summaries):
+			print(f"{label:<28}" + "".join(f"{number_format.format(summary[key]):>12}" for summary in summaries))
+
+	names = sorted({name for summary in summaries for name in summary["api_calls"]})
+	for name in names:
+		print(f"{'  ' + name:<28}" + "".join(f"{summary['api_calls'].get(name, 0):>12}" for summary in summaries))
+
+
+# metrics more than `tolerance` worse than the baseline's, for the mesh sizes both have. differences under 1 (ms, call,
+# statement, MB) are never counted, so tiny numbers don't trip it on noise
+def find_regressions( summaries, baseline, tolerance ):
+	baseline_summaries = {summary["routers"]: summary for summary in baseline["summaries"]}
+	regressions = []
+	for summary in summaries:
+		baseline_summary = baseline_summaries.get(summary["routers"])
+		if baseline_summary is None:
+			continue
+		for metric in compared_metrics:
+			if metric not in summary or metric not in baseline_summary:
+				continue
+			old, new = baseline_summary[metric], summary[metric]
+			if new > old * (1 + tolerance) and new - old >= 1:
+				regressions.append(f"{summary['routers']} routers: {metric} went from {old:.1f} to {new:.1f}")
+	return( regressions )
+
+
+def main():
+	args = arg_parser.parse_args()
+	if min(args.routers) < 100:
+		arg_parser.error("--routers: meshes need at least 100 routers")
+	if args.child:
+		# the db and logs are relative paths, so they end up in here, and get cleaned up with it
+		with tempfile.TemporaryDirectory(prefix="node-watcher-bench-") as work_dir:
+			os.chdir(work_dir)
+			run_mesh( args )
+			os.chdir(benchmarks_dir)
+		return
+
+	summaries = []
+	results = []
+	for router_qty in args.routers:
+		print(f"running {router_qty} routers for {args.minutes} minutes...", file=sys.stderr)
+		with tempfile.NamedTemporaryFile(suffix=".json") as result_file:
+			command = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ["--routers", str(router_qty), "--child", "--result", result_file.name]
+			subprocess.run(command, check=True)
+			result = json.load(result_file)
+		results.append(result)
+		summaries.append(summarize( result ))
+
+	print_report( summaries )
+
+	if args.json:
+		with open(args.json, "w") as json_file:
+			json.dump({"args": vars(args), "summaries": summaries, "results": results}, json_file, indent=1)
+
+	if args.compare:
+		with open(args.compare) as baseline_file:
+			regressions = find_regressions( summaries, json.load(baseline_file), args.tolerance )
+		for regression in regressions:
+			print("REGRESSION " + regression)
+		if regressions:
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
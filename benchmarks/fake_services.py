@@ -0,0 +1,266 @@
+import json, random, threading, time
+import datetime as dt
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+# Local stand-ins for the BIRD API, Slack and Node Explorer, for driving Node-Watcher's minute loop without the real
+# ones (see bench_minute_loop.py). They all sit behind one HTTP server on localhost:
+#   <prefix>bird/<snapshot suffix>         LSDB snapshots of a SyntheticMesh, minute 0 being `start_minute`
+#   <prefix>slack/<method>                 chat.postMessage, chat.delete, reactions.get, conversations.history
+#   <prefix>node-explorer/neighbors/<id>   exit paths, straight out of the mesh's layout
+# and every request gets counted by service and method
+
+
+# router IDs in the order they're handed out - the first 20k or so look like monitored NYC Mesh nodes
+# (10.69.x.y, x < 80), anything past that is in the LSDB but gets filtered out, like the real thing
+def make_router_id( i ):
+	block, host = divmod(i, 254)
+	if block < 80:
+		return( f"10.69.{block}.{host + 1}" )
+	block -= 80
+	return( f"10.{70 + block // 256}.{block % 256}.{host + 1}" )
+
+
+# A made-up mesh: a few core routers that are the way out to the internet, hubs hanging off the cores, and spokes
+# hanging off the hubs. Minute by minute, some spokes drop out for a while (churn), some go up and down every
+# minute (flappers), and once, a handful of hubs go down taking their spokes with them (the hub outage).
+# Everything's seeded, so the same arguments always make the same minutes
+class SyntheticMesh:
+
+	def __init__(self, router_qty, seed=0, churn_qty=2, churn_max_minutes=30, flapper_qty=10,
+	             hub_outage_qty=40, hub_outage_at=10, hub_outage_minutes=10):
+		self.rng                = random.Random(seed)
+		self.churn_qty          = churn_qty
+		self.churn_max_minutes  = churn_max_minutes
+		self.hub_outage_at      = hub_outage_at
+		self.hub_outage_minutes = hub_outage_minutes
+
+		self.router_ids = [make_router_id(i) for i in range(router_qty)]
+		core_qty = max(1, router_qty // 1000)
+		hub_qty = max(1, router_qty // 20)
+		self.cores  = self.router_ids[:core_qty]
+		self.hubs   = self.router_ids[core_qty:core_qty + hub_qty]
+		self.spokes = self.router_ids[core_qty + hub_qty:]
+
+		self.neighbors = {router_id: [] for router_id in self.router_ids}
+		self.exit_paths = {core: [] for core in self.cores}
+		for core in self.cores[1:]:
+			self.link(self.cores[0], core)
+		for i, hub in enumerate(self.hubs):
+			self.link(hub, self.cores[i % core_qty])
+			self.exit_paths[hub] = [self.cores[i % core_qty]]
+		hub_spokes = {hub: [] for hub in self.hubs}
+		for i, spoke in enumerate(self.spokes):
+			hub = self.hubs[i % hub_qty]
+			self.link(spoke, hub)
+			self.exit_paths[spoke] = [hub] + self.exit_paths[hub]
+			hub_spokes[hub].append(spoke)
+
+		# whole hubs go down, until there's at least hub_outage_qty routers in it
+		self.hub_outage = set()
+		for hub in self.hubs:
+			if len(self.hub_outage) >= hub_outage_qty:
+				break
+			self.hub_outage.add(hub)
+			self.hub_outage.update(hub_spokes[hub])
+
+		others = [spoke for spoke in self.spokes if spoke not in self.hub_outage]
+		self.flappers = set(self.rng.sample(others, min(flapper_qty, len(others))))
+		self.churnable = [spoke for spoke in others if spoke not in self.flappers]
+
+		self.churned_until = {} # router_id -> first minute it's back up
+		self.down = {}          # minute -> frozenset of router IDs that are down
+		self.generated_qty = 0  # minutes of churn generated so far, they have to be generated in order
+		self.lock = threading.Lock()
+
+		# each router's bit of the snapshot with all of its links, which is most of them in any minute
+		self.fragments = {router_id: self.make_fragment(router_id, ()) for router_id in self.router_ids}
+		self.snapshots = {} # minute -> encoded snapshot, the last few only
+
+	def link(self, router_id, neighbor_id):
+		self.neighbors[router_id].append(neighbor_id)
+		self.neighbors[neighbor_id].append(router_id)
+
+	def make_fragment(self, router_id, down):
+		links = {"router": [{"id": neighbor_id, "metric": 10} for neighbor_id in self.neighbors[router_id] if neighbor_id not in down]}
+		if router_id in self.cores:
+			links["external"] = [{"id": "0.0.0.0/0", "metric": 0}]
+		return( json.dumps(router_id) + ":" + json.dumps({"links": links}) )
+
+	# routers that are down in `minute`. anything before minute 0 has everything up
+	def get_down(self, minute):
+		if minute < 0:
+			return( frozenset() )
+		with self.lock:
+			while self.generated_qty <= minute:
+				generated = self.generated_qty
+				for router_id in self.rng.sample(self.churnable, min(self.churn_qty, len(self.churnable))):
+					if router_id not in self.churned_until:
+						self.churned_until[router_id] = generated + self.rng.randint(1, self.churn_max_minutes)
+				for router_id, until in list(self.churned_until.items()):
+					if until <= generated:
+						self.churned_until.pop(router_id)
+				down = set(self.churned_until)
+				if generated % 2:
+					down |= self.flappers
+				if self.hub_outage_at <= generated < self.hub_outage_at + self.hub_outage_minutes:
+					down |= self.hub_outage
+				self.down[generated] = frozenset(down)
+				self.generated_qty += 1
+			return( self.down[minute] )
+
+	def get_snapshot(self, minute):
+		with self.lock:
+			snapshot = self.snapshots.get(minute)
+		if snapshot is not None:
+			return( snapshot )
+
+		down = self.get_down(minute)
+		# only routers next to one that's down need their links redone
+		touched = set()
+		for router_id in down:
+			touched.update(self.neighbors[router_id])
+		fragments = []
+		for router_id in self.router_ids:
+			if router_id in down:
+				continue
+			if router_id in touched:
+				fragments.append(self.make_fragment(router_id, down))
+			else:
+				fragments.append(self.fragments[router_id])
+		snapshot = ('{"areas": {"0.0.0.0": {"routers": {' + ", ".join(fragments) + '}, "networks": {}}}}').encode()
+
+		with self.lock:
+			self.snapshots[minute] = snapshot
+			for old_minute in sorted(self.snapshots)[:-4]:
+				self.snapshots.pop(old_minute)
+		return( snapshot )
+
+
+class FakeServices:
+
+	def __init__(self, mesh, start_minute, latency_s=0):
+		self.mesh         = mesh
+		self.start_minute = start_minute # UTC datetime of the mesh's minute 0
+		self.latency_s    = latency_s    # added to every request, to stand in for the network
+		self.counts       = Counter()    # "<service> <method>" -> requests, since the last take_counts()
+		self.history      = []           # Slack channel messages (not thread replies) that are still there, oldest first
+		self.posted_qty   = 0
+		self.lock         = threading.Lock()
+
+		handler = type("FakeServicesHandler", (FakeServicesHandler,), {"services": self})
+		self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+		self.server.daemon_threads = True
+		self.prefix = f"http://127.0.0.1:{self.server.server_address[1]}/"
+		self.thread = threading.Thread(target=self.server.serve_forever, name="fake-services", daemon=True)
+
+	def start(self):
+		self.thread.start()
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def count(self, name):
+		with self.lock:
+			self.counts[name] += 1
+
+	def take_counts(self):
+		with self.lock:
+			counts = self.counts
+			self.counts = Counter()
+		return( counts )
+
+
+	####  SERVICES - each returns (status, response object)  ####
+
+	def bird(self, suffix):
+		try:
+			snapshot_minute = dt.datetime.strptime(suffix, "%Y/%m/%d/%H/%M.json").replace(tzinfo=dt.timezone.utc)
+		except ValueError:
+			return( 404, {"error": "not a snapshot"} )
+		minute = int((snapshot_minute - self.start_minute).total_seconds() // 60)
+		return( 200, self.mesh.get_snapshot(minute) )
+
+	def slack(self, method, params):
+		with self.lock:
+			if method == "chat.postMessage":
+				self.posted_qty += 1
+				ts = f"{int(time.time())}.{self.posted_qty:06d}"
+				thread_ts = params.get("thread_ts", ts)
+				if thread_ts == ts:
+					self.history.append({"ts": ts, "text": params.get("text", "")})
+				return( 200, {"ok": True, "channel": params.get("channel"), "ts": ts, "message": {"ts": ts, "thread_ts": thread_ts}} )
+
+			if method == "chat.delete":
+				self.history = [message for message in self.history if message["ts"] != params.get("ts")]
+				return( 200, {"ok": True} )
+
+			if method == "reactions.get":
+				return( 200, {"ok": True, "message": {"ts": params.get("timestamp")}} )
+
+			if method == "conversations.history":
+				# newest first, paged with the offset as the cursor
+				oldest = float(params.get("oldest", 0))
+				messages = [message for message in reversed(self.history) if float(message["ts"]) >= oldest]
+				offset = int(params.get("cursor") or 0)
+				limit = int(params.get("limit", 100))
+				page = {"ok": True, "messages": messages[offset:offset + limit], "response_metadata": {}}
+				if offset + limit < len(messages):
+					page["response_metadata"]["next_cursor"] = str(offset + limit)
+				return( 200, page )
+
+		return( 200, {"ok": False, "error": "unknown_method"} )
+
+	def node_explorer(self, router_id):
+		if router_id not in self.mesh.exit_paths:
+			return( 200, {"nodes": []} )
+		outbound = [[node_id, 10] for node_id in self.mesh.exit_paths[router_id]]
+		return( 200, {"nodes": [{"id": router_id, "exit_paths": {"outbound": outbound}}]} )
+
+
+class FakeServicesHandler(BaseHTTPRequestHandler):
+
+	protocol_version = "HTTP/1.1" # keep-alive, like the real APIs
+	disable_nagle_algorithm = True # or every small response sits out a delayed ACK
+	services = None
+
+	def log_message(self, format, *args):
+		pass
+
+	def do_GET(self):
+		url = urlsplit(self.path)
+		params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+		self.route(url.path, params)
+
+	def do_POST(self):
+		body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+		params = json.loads(body) if body else {}
+		self.route(urlsplit(self.path).path, params)
+
+	def route(self, path, params):
+		services = self.services
+		if services.latency_s:
+			time.sleep(services.latency_s)
+
+		service, _, rest = path.lstrip("/").partition("/")
+		if service == "bird":
+			services.count("bird snapshot")
+			status, response = services.bird(rest)
+		elif service == "slack":
+			services.count("slack " + rest)
+			status, response = services.slack(rest, params)
+		elif service == "node-explorer" and rest.startswith("neighbors/"):
+			services.count("node-explorer neighbors")
+			status, response = services.node_explorer(rest[len("neighbors/"):])
+		else:
+			status, response = 404, {"error": "not found"}
+
+		data = response if isinstance(response, bytes) else json.dumps(response).encode()
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
@@ -0,0 +1,5 @@
+# Node-Watcher as a package. engine.py has the detection logic on its own, bird.py / slack.py / storage.py connect it to
+# the BIRD API, Slack and sqlite, app.py puts them together and cli.py is what node_watcher.py runs
+from .app import NodeWatcher
+from .config import Config, make_config
+from .engine import Engine
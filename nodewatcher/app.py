@@ -0,0 +1,370 @@
+import json, logging, queue, threading, time
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+from .bird import SnapshotSource, get_snapshot_minute, get_snapshot_suffix, make_snapshot_item
+from .engine import Engine
+from .http_sessions import make_session
+from .metrics import Metrics, MetricsServer
+from .slack import Alerter, Reactions
+from .slack_outbox import ReplayOutbox, SlackOutbox
+from .snapshot_archive import SnapshotArchive
+from .storage import Storage
+from .trackers import FlappyNode, RemovedNode
+
+
+# Node-Watcher put together: the engine, fed by the BIRD API, saying things in Slack, keeping its state in sqlite.
+# Nothing happens until it's told to - start() starts the Slack outbox, then run() polls and processes snapshots
+# forever, or replay() goes through past ones
+
+
+class NodeWatcher:
+
+	# `replay_output` is a file for a replay's would-be Slack calls (see ReplayOutbox), None to talk to Slack
+	def __init__(self, config, replay_output=None, log=None, node_changes_log=None):
+		self.config = config
+		self.log = log = log or logging.getLogger("application_log")
+		self.metrics = metrics = Metrics()
+		self.metrics_server = None
+
+		http_headers = {"Content-Type": "application/json; charset=utf-8", "Authorization": "Bearer " + config.token}
+		http_timeout = (config.http_connect_timeout_s, config.http_read_timeout_s)
+		self.slack_session         = make_session( http_headers, http_timeout, config.http_retries, config.http_retry_backoff_s, metrics=metrics, service="slack" )
+		self.slack_outbox_session  = make_session( http_headers, http_timeout, config.http_retries, config.http_retry_backoff_s, metrics=metrics, service="slack" ) # used by the outbox's thread only
+		self.bird_session          = make_session( None, http_timeout, config.http_retries, config.http_retry_backoff_s, metrics=metrics, service="bird" )
+		self.node_explorer_session = make_session( None, (config.http_connect_timeout_s, config.root_cause_guesser_request_timeout_s), config.http_retries,
+		                                           config.http_retry_backoff_s, config.root_cause_guesser_workers, metrics=metrics, service="node_explorer" )
+
+		self.archive = None
+		if config.use_snapshot_archive:
+			self.archive = SnapshotArchive( config.snapshot_archive_dir, config.snapshot_archive_keyframe_minutes, config.snapshot_archive_days )
+
+		self.storage   = Storage( config, log )
+		self.reactions = Reactions( config, self.slack_session, self.storage, log, metrics )
+		self.engine    = Engine( config, self.reactions, log, node_changes_log, metrics )
+		self.source    = SnapshotSource( config, self.bird_session, log, self.archive, metrics )
+
+		self.replay_output = replay_output
+		if replay_output is not None:
+			self.outbox = ReplayOutbox( replay_output, lambda: self.engine.current_timestamp_ms, config.channel, config.escalation_channel,
+			                            config.thread_URI_prefix, self.storage.slack_threads, self.storage.alert_messages, log )
+		else:
+			self.outbox = SlackOutbox( self.slack_outbox_session, config.channel, config.escalation_channel, config.thread_URI_prefix,
+			                           self.storage.slack_threads, self.storage.alert_messages, log, config.slack_rate_limits_s, config.slack_max_attempts,
+			                           config.slack_API_prefix, metrics )
+
+		self.alerter = Alerter( config, self.outbox, self.reactions, self.node_explorer_session, log )
+
+		# The poller fetches every minute's snapshot on schedule and queues up what changed since the one before it, and the
+		# main loop works through the queue. If alerting falls behind (say Slack is slow during a big outage) the poller
+		# keeps going, and the main loop works through the backlog minute by minute once it catches up.
+		# items are made by make_snapshot_item()
+		self.snapshot_queue = queue.Queue()
+
+		# the last snapshot that was fully processed, so a restart knows where to catch up from
+		self.last_snapshot_suffix = None
+
+		if config.use_database_persistence == True:
+			self.load_state()
+		self.storage.load_flap_counter( self.engine.flap_counter )
+
+		# the trackers as they were last time take_tracker_changes() looked, starting from what was just loaded
+		self.tracker_copies = {}
+		self.take_tracker_changes()
+
+	def start(self):
+		self.outbox.start()
+		if self.config.metrics_port is not None:
+			self.metrics_server = MetricsServer( self.metrics, self.config.metrics_address, self.config.metrics_port )
+			self.metrics_server.start()
+
+
+	####  PERSISTENCE  ####
+
+	def load_state(self):
+		storage = self.storage
+		trackers = self.get_trackers()
+		for tracker_name, saved_tracker in storage.load_trackers().items():
+			trackers[tracker_name].update(saved_tracker)
+
+		# the trackers used to be saved whole, as JSON in the persistence table. they get moved to their own tables once
+		for tracker_name, tracker in trackers.items():
+			value = storage.load_variable(tracker_name)
+			if value is None:
+				continue
+			value = json.loads( value )
+			# JSON keys are always strings, and hub-down groups are ms timestamps
+			if tracker_name == "hub_down_tracker":
+				value = {int(hub_down_group): entry for hub_down_group, entry in value.items()}
+			elif tracker_name == "removed_nodes_tracker":
+				value = {router_id: RemovedNode.from_dict( entry ) for router_id, entry in value.items()}
+			elif tracker_name == "flappy_nodes_tracker":
+				value = {router_id: FlappyNode.from_dict( entry ) for router_id, entry in value.items()}
+			tracker.update(value)
+			storage.save_tracker_changes([(tracker_name, key, entry) for key, entry in value.items()])
+			storage.delete_variable(tracker_name)
+			self.log.info(f"moved {len(value)} {tracker_name} entries out of the persistence table")
+
+		# silence_cache used to be silenced_nodes_cache, a plain list of nodes with an :x: on them
+		silenced_nodes_cache = storage.load_variable("silenced_nodes_cache")
+		if silenced_nodes_cache is not None:
+			for router_id in json.loads( silenced_nodes_cache ):
+				if router_id not in self.reactions.silence_cache:
+					self.reactions.silence_cache[router_id] = {"kind": "x", "expires_s": None}
+					storage.save_tracker_changes([("silence_cache", router_id, self.reactions.silence_cache[router_id])])
+			storage.delete_variable("silenced_nodes_cache")
+		storage.commit()
+
+		# the snapshot cache used to be saved whole, every cycle. the newest snapshot in it is all a restart needs
+		lsdb_snapshot_cache = storage.load_variable("lsdb_snapshot_cache")
+		if lsdb_snapshot_cache is not None:
+			if self.config.persist_snapshot_cache:
+				self.source.lsdb_snapshot_cache.update(json.loads( lsdb_snapshot_cache ))
+			storage.delete_variable("lsdb_snapshot_cache")
+			storage.commit()
+		lsdb_snapshot = storage.load_lsdb_snapshot()
+		if self.config.persist_snapshot_cache and lsdb_snapshot is not None:
+			snapshot_suffix, router_ids = lsdb_snapshot
+			self.source.lsdb_snapshot_cache[snapshot_suffix] = router_ids
+
+		self.engine.index_removed_nodes()
+		self.last_snapshot_suffix = storage.load_variable("last_snapshot_suffix")
+
+	# `tracker_changes` is this cycle's take_tracker_changes()
+	def save_state(self, snapshot, tracker_changes):
+		storage = self.storage
+		storage.save_tracker_changes(tracker_changes)
+		# with the archive on, a restart finds the snapshot there
+		if self.config.persist_snapshot_cache and self.archive is None:
+			storage.save_lsdb_snapshot( snapshot, self.source.get_cached( snapshot["suffix"] ) )
+		storage.save_variable("current_timestamp_ms", self.engine.current_timestamp_ms)
+		storage.save_variable("last_snapshot_suffix", snapshot["suffix"])
+
+	def get_trackers(self):
+		return( {
+			"removed_nodes_tracker": self.engine.removed_nodes_tracker,
+			"flappy_nodes_tracker":  self.engine.flappy_nodes_tracker,
+			"hub_down_tracker":      self.engine.hub_down_tracker,
+			"silence_cache":         self.reactions.silence_cache,
+		} )
+
+	# what's changed in the trackers since last time, as [(tracker, key, entry or None if it's gone), ...]. entries
+	# are flat dicts or records from trackers.py, which compare by value (their __eq__), so a copy of each one that
+	# changed is enough to tell next time
+	def take_tracker_changes(self):
+		changes = []
+		for tracker_name, tracker in self.get_trackers().items():
+			copies = self.tracker_copies.setdefault(tracker_name, {})
+			for key, entry in tracker.items():
+				if copies.get(key) != entry:
+					copies[key] = entry.copy()
+					changes.append((tracker_name, key, copies[key]))
+			# every key in the tracker is in copies by now, so anything extra is gone
+			if len(copies) > len(tracker):
+				for key in [key for key in copies if key not in tracker]:
+					copies.pop(key)
+					changes.append((tracker_name, key, None))
+		return( changes )
+
+
+	####  ONE MINUTE  ####
+
+	def process_snapshot(self, snapshot):
+		config = self.config
+		storage = self.storage
+		engine = self.engine
+		metrics = self.metrics
+		cycle_started_s = time.perf_counter()
+
+		# the threads and alert messages the outbox has posted since last cycle
+		with metrics.timer("outbox_results"):
+			storage.apply_slack_outbox_results( self.outbox.take_results() )
+		if len(self.outbox):
+			self.log.info(f"Slack outbox backlog: {len(self.outbox)} jobs")
+
+		with metrics.timer("engine"):
+			storage.record_state_changes( snapshot["timestamp_ms"], snapshot["added"], snapshot["removed"] )
+			events = engine.process_snapshot( snapshot )
+		with metrics.timer("alerts"):
+			self.alerter.handle( events )
+		for event in events:
+			metrics.inc("events_total", kind=event["kind"])
+
+		with metrics.timer("persistence"):
+			tracker_changes = self.take_tracker_changes()
+			if config.use_database_persistence == True:
+				self.save_state( snapshot, tracker_changes )
+			storage.apply_slack_outbox_results( self.outbox.take_results() )
+			storage.save_flap_counter( engine.flap_counter )
+		# commit changes to db ;)
+		with metrics.timer("db_commit"):
+			storage.commit()
+		if storage.maintenance_due( engine.current_timestamp_ms ):
+			with metrics.timer("db_maintenance"):
+				storage.run_maintenance( engine.current_timestamp_ms )
+
+		metrics.add_stage_time("cycle", time.perf_counter() - cycle_started_s)
+		metrics.inc("cycles_total")
+		self.update_gauges()
+		if config.log_cycle_stats:
+			stages_ms, counts = metrics.take_cycle()
+			self.log.info(f"cycle {snapshot['suffix']}: " + json.dumps({"ms": stages_ms, "counts": counts, "sizes": metrics.get_gauges()}))
+
+		current_timestamp_ms = engine.current_timestamp_ms
+		if config.time_rollback_s != 0:
+			self.log.info(config.BIRD_API_prefix + snapshot["suffix"])
+		if config.log_tracker_changes:
+			for tracker_name, key, entry in tracker_changes:
+				self.log.info("tracker " + json.dumps({"timestamp_ms": current_timestamp_ms, "tracker": tracker_name, "key": key, "entry": entry}, default=lambda record: record.to_dict()))
+		else:
+			print(f"{current_timestamp_ms}\nremoved_nodes_tracker: {engine.removed_nodes_tracker}\n\nflappy_nodes_tracker: {engine.flappy_nodes_tracker}\nhub_down_tracker: {engine.hub_down_tracker}\nsilence_cache: {self.reactions.silence_cache} \n")
+			print(str(current_timestamp_ms))
+			self.log.info(f"{current_timestamp_ms}\nremoved_nodes_tracker: {engine.removed_nodes_tracker}\n\nflappy_nodes_tracker: {engine.flappy_nodes_tracker}\n\nhub_down_tracker: {engine.hub_down_tracker}\nsilence_cache: {self.reactions.silence_cache} \n")
+
+
+	def update_gauges(self):
+		engine = self.engine
+		metrics = self.metrics
+		metrics.set("removed_nodes", len(engine.removed_nodes_tracker))
+		metrics.set("alerting_nodes", sum(1 for tracker in engine.removed_nodes_tracker.values() if tracker.alerting))
+		metrics.set("flappy_nodes", len(engine.flappy_nodes_tracker))
+		metrics.set("hub_down_groups", len(engine.hub_down_tracker))
+		metrics.set("silence_cache", len(self.reactions.silence_cache))
+		metrics.set("flap_counter_routers", len(engine.flap_counter.rings))
+		metrics.set("snapshot_queue", self.snapshot_queue.qsize())
+		metrics.set("outbox_backlog", len(self.outbox))
+
+
+	####  POLLER  ####
+
+	# bird.make_snapshot_item(), keeping the previous minute's graph only if the engine could use it
+	def make_snapshot_item(self, previous, current, catching_up=False):
+		config = self.config
+		graph_min_removed = config.hub_down_node_qty if config.hub_watcher_mode else None
+		return( make_snapshot_item( previous, current, catching_up, graph_min_removed ) )
+
+	# the newest snapshot that's due to be fetched - the old loop's "a minute ago"
+	def get_due_snapshot_minute(self):
+		due = dt.datetime.now(dt.timezone.utc) - dt.timedelta(seconds = 60 + self.config.time_rollback_s + self.config.snapshot_poll_delay_s)
+		return( due.replace(second=0, microsecond=0) )
+
+	def poll_snapshots(self):
+		config = self.config
+		one_minute = dt.timedelta(minutes=1)
+		snapshot_minute = self.get_due_snapshot_minute()
+		if self.last_snapshot_suffix is not None:
+			last_minute = get_snapshot_minute( self.last_snapshot_suffix )
+			missed_qty = int((snapshot_minute - last_minute) / one_minute) - 1
+			if missed_qty <= config.catch_up_max_minutes:
+				snapshot_minute = last_minute + one_minute
+			elif missed_qty > config.catch_up_max_minutes:
+				self.log.warning(f"{missed_qty} LSDB snapshots were missed since {self.last_snapshot_suffix}, which is more than catch_up_max_minutes - skipping them")
+
+		previous = None # (suffix, router IDs, graph) of the snapshot before snapshot_minute
+		attempts = 0
+		executor = ThreadPoolExecutor(max_workers=config.catch_up_workers)
+
+		while True:
+			wait_s = snapshot_minute.timestamp() + 60 + config.time_rollback_s + config.snapshot_poll_delay_s - time.time()
+			if wait_s > 0:
+				sleep(wait_s)
+
+			# normally just the one, more after a restart or after snapshots couldn't be fetched for a while
+			due_qty = max(1, int((self.get_due_snapshot_minute() - snapshot_minute) / one_minute) + 1)
+			if due_qty - 1 > config.catch_up_max_minutes:
+				self.log.warning(f"{due_qty - 1} LSDB snapshots behind, which is more than catch_up_max_minutes - skipping them")
+				snapshot_minute += one_minute * (due_qty - 1)
+				previous = None
+				due_qty = 1
+			elif due_qty > config.catch_up_after_minutes:
+				self.log.info(f"Catching up on {due_qty - 1} missed LSDB snapshots starting at {get_snapshot_suffix( snapshot_minute )}")
+
+			try:
+				if previous is None:
+					previous = self.source.fetch( snapshot_minute - one_minute )
+				# fetched all at once, but map() hands them back in order so they're diffed and queued in order
+				for i, current in enumerate(executor.map( self.source.fetch, [snapshot_minute + one_minute * i for i in range(due_qty)] )):
+					with self.metrics.timer("diff"):
+						snapshot = self.make_snapshot_item( previous, current, due_qty > config.catch_up_after_minutes and i < due_qty - 1 )
+					self.snapshot_queue.put( snapshot )
+					previous = current
+					snapshot_minute += one_minute
+					attempts = 0
+			except Exception as e:
+				# snapshot_minute is the one that failed, anything before it has been queued
+				snapshot_suffix = get_snapshot_suffix( snapshot_minute )
+				attempts += 1
+				self.metrics.inc("snapshot_errors_total")
+				self.log.error(f"Couldn't get LSDB snapshot {config.BIRD_API_prefix + snapshot_suffix}, attempt {attempts} of {config.snapshot_max_attempts}", exc_info=e)
+				if attempts < config.snapshot_max_attempts:
+					# a potential cause of errors is doing something at the same time that BIRD is, so nudging the time here
+					sleep(config.error_sleep_time_s)
+					continue
+				self.log.error(f"Giving up on LSDB snapshot {snapshot_suffix}, the next one gets compared to {previous[0] if previous else None}")
+				attempts = 0
+				snapshot_minute += one_minute
+
+
+	####  MAIN LOOP  ####
+
+	def run(self):
+		threading.Thread(target=self.poll_snapshots, name="lsdb-poller", daemon=True).start()
+
+		while True:
+			snapshot = self.snapshot_queue.get()
+			backlog = self.snapshot_queue.qsize()
+			if backlog:
+				self.log.warning(f"{backlog} more LSDB snapshots are waiting to be processed after {snapshot['suffix']}")
+			try:
+				self.process_snapshot( snapshot )
+			except Exception as e:
+				# what's left of this minute is lost, but the poller has kept going so the next minute is already queued up
+				self.log.error('Error', exc_info=e)
+				self.log.info(self.config.BIRD_API_prefix + snapshot["suffix"])
+
+	# Runs every snapshot from `start_minute` to `end_minute` through process_snapshot() as fast as they can be fetched,
+	# against the replay's own db and with alerts going to replay_output (see ReplayOutbox). The clock is the snapshots' own
+	# timestamps, so thresholds, hub-down grouping, flap windows and the daily report all play out like they did live.
+	# The first snapshot is only the starting point - nodes already down by then aren't known about
+	def replay(self, start_minute, end_minute):
+		config = self.config
+		one_minute = dt.timedelta(minutes=1)
+		previous = None
+		processed_qty = 0
+		skipped_qty = 0
+		started_s = time.time()
+
+		def fetch_snapshot_or_none( snapshot_minute ):
+			try:
+				return( self.source.fetch( snapshot_minute ) )
+			except Exception as e:
+				self.log.warning(f"Replay: no usable LSDB snapshot {get_snapshot_suffix( snapshot_minute )}: {e!r}")
+				return( None )
+
+		with ThreadPoolExecutor(max_workers=config.catch_up_workers) as executor:
+			batch_start = start_minute
+			while batch_start <= end_minute:
+				# fetched a few hours at a time, so a long replay doesn't sit in memory all at once
+				batch_qty = min(config.replay_batch_minutes, int((end_minute - batch_start) / one_minute) + 1)
+				for current in executor.map( fetch_snapshot_or_none, [batch_start + one_minute * i for i in range(batch_qty)] ):
+					if current is None:
+						skipped_qty += 1
+						continue
+					if previous is not None:
+						try:
+							with self.metrics.timer("diff"):
+								snapshot = self.make_snapshot_item( previous, current )
+							self.process_snapshot( snapshot )
+						except Exception as e:
+							self.log.error('Error', exc_info=e)
+							self.log.info(current[0])
+						processed_qty += 1
+					previous = current
+				batch_start += one_minute * batch_qty
+
+		self.storage.commit()
+		self.replay_output.close()
+		summary = (f"Replayed {processed_qty} snapshots ({skipped_qty} missing) from {get_snapshot_suffix( start_minute )} to {get_snapshot_suffix( end_minute )}"
+		           f" in {time.time() - started_s:.1f}s, {self.outbox.call_count} Slack calls written to {self.replay_output.name}")
+		self.log.info(summary)
+		print(summary)
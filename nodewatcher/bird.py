@@ -0,0 +1,176 @@
+import os, threading, time
+import datetime as dt
+from .lsdb_parser import iter_object_members, iter_router_ids
+from .metrics import Metrics
+from .topology import build_topology_graph
+
+
+# Getting LSDB snapshots out of the BIRD API (or a directory laid out like it, or the snapshot archive), and turning
+# two of them into what the engine is given to process
+
+
+def get_snapshot_suffix( snapshot_minute ):
+	return( snapshot_minute.strftime("%Y/%m/%d/%H/%M") + ".json" )
+
+
+def get_snapshot_minute( snapshot_suffix ):
+	return( dt.datetime.strptime(snapshot_suffix, "%Y/%m/%d/%H/%M.json").replace(tzinfo=dt.timezone.utc) )
+
+
+# what goes on the snapshot queue, from two (suffix, router IDs, graph) as returned by SnapshotSource.fetch()
+# structure: {"suffix": <snapshot suffix>, "previous_suffix": <...>, "timestamp_ms": <when it'd have been processed in real time>,
+#             "added": [<router_id>, ...], "removed": [<router_id>, ...], "previous_graph": <topology graph of previous_suffix, or None>,
+#             "catching_up": <True for minutes that were missed and are being caught up on>}
+# The engine only looks at previous_graph when enough nodes went down at once to be a hub down event, so it's only
+# kept when at least `graph_min_removed` did (never if that's None). Otherwise a long catch-up would have the queue
+# holding a whole topology graph for every minute of it
+def make_snapshot_item( previous, current, catching_up=False, graph_min_removed=0 ):
+	previous_suffix, previous_nodes, previous_graph = previous
+	snapshot_suffix, current_nodes, graph = current
+	removed = list(set(previous_nodes) - set(current_nodes))
+	if graph_min_removed is None or len(removed) < graph_min_removed:
+		previous_graph = None
+	return( {
+		"suffix":          snapshot_suffix,
+		"previous_suffix": previous_suffix,
+		"timestamp_ms":    int(get_snapshot_minute( snapshot_suffix ).timestamp() * 1000) + 60000,
+		"added":           list(set(current_nodes) - set(previous_nodes)),
+		"removed":         removed,
+		"previous_graph":  previous_graph,
+		"catching_up":     catching_up,
+	} )
+
+
+class SnapshotSource:
+
+	def __init__(self, config, session, log, archive=None, metrics=None):
+		self.config  = config
+		self.session = session
+		self.log     = log
+		self.archive = archive # a SnapshotArchive, or None
+		self.metrics = metrics or Metrics()
+
+		# router IDs of the most recently fetched LSDB snapshots, keyed by snapshot suffix e.g. "2024/01/31/23/59.json"
+		self.lsdb_snapshot_cache = {}
+
+		# topology graphs (see topology.py) of the same snapshots. memory only - after a restart the root cause
+		# guesser uses Node Explorer until new graphs are built
+		self.topology_graphs = {}
+
+		# snapshots get fetched several at a time while catching up
+		self.lock = threading.Lock()
+
+	# a cached snapshot's router IDs, or None. the poller adds to the cache from its own thread
+	def get_cached(self, snapshot_suffix):
+		with self.lock:
+			return( self.lsdb_snapshot_cache.get(snapshot_suffix) )
+
+	# a snapshot's raw bytes a chunk at a time, out of snapshot_dir when replaying from a directory, otherwise off the BIRD API
+	def iter_snapshot_chunks(self, snapshot_suffix):
+		config = self.config
+		if config.snapshot_dir is not None:
+			with open(os.path.join(config.snapshot_dir, snapshot_suffix), "rb") as snapshot_file:
+				yield from iter(lambda: snapshot_file.read(config.lsdb_stream_chunk_size), b"")
+		else:
+			with self.session.get(config.BIRD_API_prefix + snapshot_suffix, stream=True) as response:
+				yield from response.iter_content(chunk_size=config.lsdb_stream_chunk_size)
+
+	# the time spent waiting on each chunk is the download, so whatever's left is parsing. adds it up in waited_s[0]
+	def timed_chunks(self, chunks, waited_s):
+		chunks = iter(chunks)
+		while True:
+			started_s = time.perf_counter()
+			try:
+				chunk = next(chunks)
+			except StopIteration:
+				return
+			finally:
+				waited_s[0] += time.perf_counter() - started_s
+			yield chunk
+
+	# with_graph=True returns (router_ids, topology graph or None)
+	def get_router_ids(self, snapshot_suffix, with_graph=False):
+		config = self.config
+		metrics = self.metrics
+		if config.use_snapshot_cache and snapshot_suffix in self.lsdb_snapshot_cache:
+			self.log.debug(f"LSDB snapshot {snapshot_suffix} served from cache")
+			metrics.inc("snapshots_total", source="cache")
+			if with_graph:
+				return( self.lsdb_snapshot_cache[snapshot_suffix], self.topology_graphs.get(snapshot_suffix) )
+			return( self.lsdb_snapshot_cache[snapshot_suffix] )
+
+		routers_path  = ("areas", "0.0.0.0", "routers")
+		networks_path = ("areas", "0.0.0.0", "networks")
+		graph = None
+		router_ids = None
+
+		# a snapshot_dir is already local and has the whole LSDB, so it's only read from the archive otherwise
+		if self.archive is not None and config.snapshot_dir is None:
+			with metrics.timer("archive_read"):
+				router_ids = self.archive.get( get_snapshot_minute( snapshot_suffix ) )
+
+		from_archive = router_ids is not None
+		if from_archive:
+			self.log.debug(f"LSDB snapshot {snapshot_suffix} served from the archive")
+			metrics.inc("snapshots_total", source="archive")
+		elif config.use_streaming_lsdb_parser or config.snapshot_dir is not None:
+			metrics.inc("snapshots_total", source="bird" if config.snapshot_dir is None else "directory")
+			waited_s = [0.0]
+			started_s = time.perf_counter()
+			chunks = self.timed_chunks( self.iter_snapshot_chunks( snapshot_suffix ), waited_s )
+			if config.use_local_topology:
+				# each router's links get decoded, boiled down into the graph, and dropped as the snapshot streams in
+				graph = build_topology_graph( iter_object_members( chunks, [routers_path], True, [networks_path] ), config.topology_egress_prefix )
+				router_ids = list(graph["adjacency"])
+			else:
+				router_ids = list(iter_router_ids( chunks, "0.0.0.0" ))
+			metrics.add_stage_time("bird_fetch", waited_s[0])
+			metrics.add_stage_time("lsdb_parse", time.perf_counter() - started_s - waited_s[0])
+		else:
+			metrics.inc("snapshots_total", source="bird")
+			with metrics.timer("bird_fetch"):
+				response = self.session.get(config.BIRD_API_prefix + snapshot_suffix)
+			with metrics.timer("lsdb_parse"):
+				deserialized_json = response.json()
+
+				routers = deserialized_json['areas']['0.0.0.0']['routers']
+				router_ids = []
+				for ospf_node in routers:
+					router_ids.append(ospf_node)
+
+				if config.use_local_topology:
+					members = [(routers_path, router_id, routers[router_id]) for router_id in routers]
+					for network_id, network in deserialized_json['areas']['0.0.0.0'].get('networks', {}).items():
+						members.append((networks_path, network_id, network))
+					graph = build_topology_graph( members, config.topology_egress_prefix )
+
+		if self.archive is not None and not from_archive:
+			try:
+				with metrics.timer("archive_write"):
+					self.archive.put( get_snapshot_minute( snapshot_suffix ), router_ids )
+			except Exception as e:
+				# the snapshot itself is fine, it just won't be in the archive
+				self.log.warning(f"Couldn't archive LSDB snapshot {snapshot_suffix}", exc_info=e)
+
+		if config.use_snapshot_cache:
+			with self.lock:
+				self.lsdb_snapshot_cache[snapshot_suffix] = router_ids
+				# suffixes are "%Y/%m/%d/%H/%M.json" so they sort oldest to newest
+				for old_snapshot_suffix in sorted(self.lsdb_snapshot_cache)[:-config.snapshot_cache_qty]:
+					self.lsdb_snapshot_cache.pop(old_snapshot_suffix)
+
+		if graph is not None:
+			with self.lock:
+				self.topology_graphs[snapshot_suffix] = graph
+				for old_snapshot_suffix in sorted(self.topology_graphs)[:-config.snapshot_cache_qty]:
+					self.topology_graphs.pop(old_snapshot_suffix)
+
+		if with_graph:
+			return( router_ids, graph )
+		return( router_ids )
+
+	# (suffix, router IDs, graph) of the snapshot taken at `snapshot_minute`
+	def fetch(self, snapshot_minute):
+		snapshot_suffix = get_snapshot_suffix( snapshot_minute )
+		router_ids, graph = self.get_router_ids( snapshot_suffix, True )
+		return( snapshot_suffix, router_ids, graph )
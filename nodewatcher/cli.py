@@ -0,0 +1,125 @@
+import argparse, atexit, json, logging, logging.handlers, os, queue
+from .app import NodeWatcher
+from .bird import get_snapshot_minute
+from .config import make_config
+
+
+# `python3 node_watcher.py --replay <from> <to>` runs the detection logic over past snapshots as fast as it can,
+# and writes what it would have posted to a file instead of Slack - see NodeWatcher.replay()
+arg_parser = argparse.ArgumentParser(description="Node-Watcher")
+arg_parser.add_argument("--replay", nargs=2, metavar=("FROM", "TO"), help='replay the snapshots from one minute to another (UTC), e.g. 2024/01/31/00/00 2024/02/01/00/00')
+arg_parser.add_argument("--snapshots", metavar="DIR", help="replay from a directory laid out like the BIRD API (DIR/2024/01/31/00/00.json) instead of the API")
+arg_parser.add_argument("--archive", metavar="DIR", help="replay from (and add what's fetched to) a local snapshot archive, see snapshot_archive.py")
+arg_parser.add_argument("--output", metavar="FILE", default="./replay_alerts.jsonl", help="where a replay writes the Slack calls it would have made, one JSON object per line")
+arg_parser.add_argument("--db", metavar="FILE", default=":memory:", help="sqlite db for a replay - in memory unless one is given")
+arg_parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="override a tuneable for a replay, e.g. --set hub_down_node_qty=8 (VALUE is JSON)")
+
+
+# gonna split logging up between application and network so let's be fancy about it
+# log files roll over at `max_bytes`, or on the `rotate_when` schedule, keeping `backup_qty` old ones. With use_async
+# the logger just queues records up, and a listener thread does the formatting and the writing
+def setup_logger(name, log_file, log_level, max_bytes=0, rotate_when=None, backup_qty=0, use_async=False):
+	formatter = logging.Formatter('%(levelname)s %(message)s')
+	if rotate_when is not None:
+		handler = logging.handlers.TimedRotatingFileHandler(log_file, when=rotate_when, backupCount=backup_qty)
+	elif max_bytes:
+		handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_qty)
+	else:
+		handler = logging.FileHandler(log_file)
+	handler.setFormatter(formatter)
+	logger = logging.getLogger(name)
+	logger.setLevel(log_level)
+	if use_async:
+		log_queue = queue.SimpleQueue()
+		listener = logging.handlers.QueueListener(log_queue, handler)
+		listener.start()
+		atexit.register(listener.stop) # writes out whatever's still queued
+		logger.addHandler(UnformattedQueueHandler(log_queue))
+	else:
+		logger.addHandler(handler)
+	return logger
+
+
+# QueueHandler formats records before queueing them, to make them safe to send to another process. The listener's in
+# this process, so that's left to it
+class UnformattedQueueHandler(logging.handlers.QueueHandler):
+
+	def prepare(self, record):
+		return( record )
+
+
+def main( argv=None ):
+	args = arg_parser.parse_args(argv)
+	replay_mode = args.replay is not None
+	overrides = {}
+
+	# Node-Watcher is launched from node_watcher_launcher.sh, which provides the following environent variables
+	if replay_mode:
+		# a replay doesn't talk to Slack or Node Explorer, and only needs the BIRD API if there's no --snapshots
+		environment = os.environ.get('NODE_WATCHER_ENVIRONMENT', "prod")
+		overrides.update({
+			"channel":                  "replay",
+			"escalation_channel":       "replay-escalation",
+			"token":                    "",
+			"thread_URI_prefix":        "replay://",
+			"BIRD_API_prefix":          os.environ.get('BIRD_API_PREFIX', ""),
+			"Node_Explorer_API_prefix": "",
+		})
+	else:
+		try:
+			environment = os.environ['NODE_WATCHER_ENVIRONMENT'] # "dev" or "prod"
+			overrides.update({
+				"channel":                  os.environ['SLACK_CHANNEL'],
+				"escalation_channel":       os.environ['SLACK_ESCALATION_CHANNEL'],
+				"token":                    os.environ['NODE_WATCHER_TOKEN'], # pasted by user into launcher script
+				"thread_URI_prefix":        os.environ['SLACK_THREAD_URI_PREFIX'],
+				"BIRD_API_prefix":          os.environ['BIRD_API_PREFIX'],
+				"Node_Explorer_API_prefix": os.environ['NODE_EXPORER_API_PREFIX'],
+			})
+		except Exception as error:
+			print("problem with importing an environment variable, make sure you run this from node_watcher_launcher.sh or node_watcher_launcher_dev.sh", error)
+			exit(1)
+
+	# optional, for pointing Node-Watcher at something other than Slack, e.g. the stand-in in benchmarks/
+	if 'SLACK_API_PREFIX' in os.environ:
+		overrides["slack_API_prefix"] = os.environ['SLACK_API_PREFIX']
+
+	# a replay gets its own logs and db, and everything it needs to know is in the snapshots
+	if replay_mode:
+		overrides.update({
+			"replay_mode":              True,
+			"snapshot_dir":             args.snapshots,
+			"application_log_file":     './node_watcher_replay.log',
+			"node_changes_log_file":    './node_changes_replay.log',
+			"node_watcher_db":          args.db,
+			"use_database_persistence": False,
+			"use_reaction_snapshot":    False,
+			"use_snapshot_cache":       False,
+		})
+		if args.archive is not None:
+			overrides.update({
+				"use_snapshot_archive":  True,
+				"snapshot_archive_dir":  args.archive,
+				"snapshot_archive_days": None, # a replay through old history shouldn't clean out what it just archived
+			})
+		for override in args.set:
+			name, value = override.split("=", 1)
+			overrides[name] = json.loads(value)
+
+	try:
+		config = make_config( environment, overrides )
+	except ValueError as e:
+		arg_parser.error(str(e))
+
+	log_options = (config.log_max_bytes, config.log_rotate_when, config.log_backup_qty, config.use_async_logging)
+	application_log  = setup_logger('application_log', config.application_log_file, config.log_level, *log_options)
+	node_changes_log = setup_logger('node_changes_log', config.node_changes_log_file, config.log_level, *log_options)
+
+	if replay_mode:
+		node_watcher = NodeWatcher( config, open( args.output, "w" ), application_log, node_changes_log )
+		node_watcher.start()
+		node_watcher.replay( get_snapshot_minute( args.replay[0].rstrip("/") + ".json" ), get_snapshot_minute( args.replay[1].rstrip("/") + ".json" ) )
+	else:
+		node_watcher = NodeWatcher( config, None, application_log, node_changes_log )
+		node_watcher.start()
+		node_watcher.run()
@@ -0,0 +1,181 @@
+import copy, logging
+
+
+# Every tuneable, with its default. make_config() puts the environment's own values ("prod" or "dev") on top of
+# these, then whatever overrides it's given (a replay's --set, a benchmark's fake services...). Nothing here reads
+# the environment or touches the disk - cli.py does that
+
+
+class Config:
+
+	# where everything is - cli.py fills these in from the environment variables node_watcher_launcher.sh sets
+	environment              = "prod" # "dev" or "prod"
+	channel                  = None
+	escalation_channel       = None
+	token                    = ""     # pasted by user into launcher script
+	thread_URI_prefix        = ""
+	BIRD_API_prefix          = ""
+	Node_Explorer_API_prefix = ""
+	slack_API_prefix         = "https://slack.com/api/" # can be pointed elsewhere, e.g. the stand-in in benchmarks/
+	node_map_prefix          = "https://www.nycmesh.net/map/nodes/"
+
+	# a replay (see NodeWatcher.replay()) doesn't read reactions or ask Node Explorer, and can read snapshots from a directory
+	replay_mode              = False
+	snapshot_dir             = None   # laid out like the BIRD API, e.g. <dir>/2024/01/31/00/00.json
+
+	log_level                = logging.INFO
+	application_log_file     = './node_watcher.log' # application-level logs
+	node_changes_log_file    = './node_changes.log' # OSPF-level logs
+	log_max_bytes            = 10 * 1024 * 1024 # a log file rolls over at this size, 0 for never
+	log_rotate_when          = None   # or on a schedule instead, e.g. "midnight" - see logging.handlers.TimedRotatingFileHandler
+	log_backup_qty           = 5      # rolled over log files kept around
+	use_async_logging        = True   # log lines get formatted and written to disk by a thread of their own, not the main loop
+	log_tracker_changes      = True   # log what changed in the trackers each cycle, one line of JSON per change, instead of printing and logging all of them every cycle
+	node_watcher_db          = "./node-watcher.db"
+
+	alert_time_threshold_ms      = 300000 # how long a node is observed to be down before it goes into alerting state
+	hub_down_alert_time_ms       = 180000 # how long a hub is observed as down before alerting - in case we want to be more aggressive about hubs
+	hub_down_node_qty            = 5      # how many nodes need to go down at once for the event to be treated as 'hub-down'
+	hub_down_raise_qty           = 25     # how many nodes need to go down at once for the event to get raised into other systems e.g. send alerts to other channels
+	hub_down_report_interval_s   = 60     # if reporting has been enabled by user, for a hub-down event, how often reports (of what nodes are still down) go out
+
+	# different reactions can suppress alert message for different times - "suppress_duration_<slack's-name-of-reaction>_s"
+	suppress_duration_DATE_s = 86400
+	suppress_duration_STOPWATCH_s = 10800
+
+	# what hour/min the daily report goes out, 24h format, local time
+	reporting_hour = 9
+	reporting_minute = 0
+
+	# how long before a down node is considered abandoned, and so removed from alerting and reporting, until it shows back up in the LSDB
+	abandoned_threshold_ms = 86400 * 1000 * 14 # 2 weeks
+
+	# a node is considered to be flappy if it meets or exceeds `flap_time_window_qty` inside of `flap_time_window_hrs`.
+	# flaps are counted in memory (see flap_counter.py) and saved to flap_counters every cycle
+	flap_time_window_hrs = 24
+	flap_time_window_qty = 12  # any state change, up or down, counts as 1
+	flap_emoji = ":wackywavinginflatablearmman:"
+
+	# This functionality now happens via the 'x' reaction from within the app, but this will still work
+	excluded_from_monitoring = []
+
+	error_sleep_time_s           = 10     # how long the poller waits before trying a snapshot again if there's an error
+	snapshot_max_attempts        = 5      # tries per snapshot before the poller gives up on it and moves on to the next minute
+	snapshot_poll_delay_s        = 0      # seconds into the minute that snapshots get fetched, to stay out of the way of BIRD's cron job
+
+	# minutes that were missed (Node-Watcher was stopped, or couldn't get snapshots for a while) get fetched and worked through
+	# once it's back, so no state changes go missing. alerts for those minutes are held back and summed up in one message instead
+	catch_up_max_minutes         = 180    # a bigger gap than this is skipped over, and noted in the log
+	catch_up_after_minutes       = 3      # a smaller gap than this (e.g. one slow retry) is just processed and alerted on like normal
+	catch_up_workers             = 4      # snapshots fetched at once while catching up, or replaying
+	replay_batch_minutes         = 240    # how many snapshots a replay fetches ahead of itself at most
+	hub_watcher_mode             = True   # can be disabled for troubleshooting
+	root_cause_guesser_timeout_s = 10     # overall deadline for guessing a hub outage's root cause - whatever lookups are back by then get used, if none it'll send the alert without indicating root cause node
+	root_cause_guesser_request_timeout_s = 5 # connect/read timeout for each Node Explorer lookup
+	root_cause_guesser_workers   = 8      # how many Node Explorer lookups run at once
+	root_cause_guesser_sample_qty = None  # how many of the down nodes get looked up, None for all of them
+	root_cause_distance_weighted = False  # score upstream candidates by how close they are to each down node, rather than just how often they show up
+
+	# a graph of the mesh gets built from each snapshot's router links, and a hub outage's root cause can be worked out from
+	# the graph as it was right before the outage, instead of asking Node Explorer while the alert waits
+	use_local_topology             = True
+	root_cause_from_local_topology = True   # Node Explorer is still asked if there's no graph from before the outage, e.g. right after a restart
+	topology_egress_prefix         = "0.0.0.0/0" # routers advertising this as an external route are where exit paths end
+	use_database_persistence     = True   # persist app state in db - this used to be done by copy-pasting lines from the log into this py file. will probably make this permanent soon
+	time_rollback_s              = 0      # time machine - leave as 0 in prod
+
+	# each cycle diffs "a minute ago" against "two minutes ago", so last cycle's "a minute ago" is this cycle's "two minutes ago".
+	# keeping the router sets around means only one snapshot gets downloaded and parsed per cycle
+	use_snapshot_cache           = True
+	snapshot_cache_qty           = 3      # how many of the most recent snapshots' router sets are kept
+	persist_snapshot_cache       = True   # also keep the newest snapshot's routers in the db (needs use_database_persistence, not needed with use_snapshot_archive), so a restart doesn't download it again
+	use_streaming_lsdb_parser    = True   # pull router IDs out of the LSDB as it downloads, instead of json-decoding the whole thing
+	lsdb_stream_chunk_size       = 65536  # bytes read off the socket at a time when streaming
+
+	# every fetched snapshot's router set can also be kept on disk (see snapshot_archive.py), so catching up and replays
+	# can get minutes the BIRD API no longer has, without downloading them again. it only has router sets though, so a
+	# minute read from the archive has no topology graph - a hub outage right after it asks Node Explorer for the root cause
+	use_snapshot_archive         = False
+	snapshot_archive_dir         = "./lsdb_archive"
+	snapshot_archive_keyframe_minutes = 60 # a full snapshot is stored at least this often, with only what changed in between
+	snapshot_archive_days        = 30     # day files older than this get deleted, None keeps them all
+
+	# the db, see storage.py. WAL lets it be read (e.g. with sqlite3 on the command line) while the loop writes, and with it
+	# synchronous=NORMAL only syncs at checkpoints - a power cut can lose the last cycle or so, but can't corrupt anything
+	sqlite_pragmas               = {"journal_mode": "WAL", "synchronous": "NORMAL", "temp_store": "MEMORY"}
+	node_state_changes_keep_days = 90     # older node_state_changes get rolled up into daily counts per node (node_state_changes_daily), None to keep them all. never less than the flap window
+	db_maintenance_interval_hrs  = 24     # how often the rollup and ANALYZE run
+	db_vacuum_interval_days      = 7      # how often VACUUM runs after them, to give back the space the rollup freed up. None for never
+
+	# connections to Slack, BIRD and Node Explorer are pooled and kept alive per service, see http_sessions.py
+	http_connect_timeout_s       = 5
+	http_read_timeout_s          = 30     # a hung server fails the cycle (and it gets retried) instead of stalling the loop forever
+	http_retries                 = 3      # GETs get retried on connection errors, timeouts, 429s and 5xxs - POSTs only if they never connected
+	http_retry_backoff_s         = 0.5    # waits 0.5, 1, 2... seconds between retries, unless there's a Retry-After
+
+	# reactions on node threads and alert messages are read out of one paged conversations.history scan per cycle, instead of
+	# a reactions.get for each message every time a node is looked up. messages older than what the scan reaches fall back to reactions.get
+	use_reaction_snapshot        = True
+	reaction_snapshot_max_pages  = 10     # pages of conversations.history (200 messages each) scanned per cycle
+	silence_cache_refresh_interval_s = 300 # even when nothing gets looked up, scan the newest history page this often to pick up new silences
+
+	# Slack posts and deletes are queued up and made by a background thread (see slack_outbox.py), so a burst of alerts never holds up the cycle
+	slack_rate_limits_s          = {"chat.postMessage": 1.1, "chat.delete": 1.2} # minimum seconds between calls, per method and channel
+	slack_max_attempts           = 5      # per call - a 429 waits out its Retry-After, a failed connection backs off 2, 4, 8... seconds
+
+	# where the minute goes, see metrics.py. stage timings, API calls per service and tracker sizes
+	metrics_port                 = None   # serve them Prometheus-style on http://<metrics_address>:<port>/metrics, None to not
+	metrics_address              = "127.0.0.1"
+	log_cycle_stats              = True   # one line of JSON per cycle in the application log, with what it spent its time on
+
+	# holiday themes - no holidays, BAU
+	node_up_emoji = ":point_up:"
+	node_down_emoji = ":point_down:"
+
+	# # Halloween
+	# node_up_emoji = ":jack_o_lantern:"
+	# node_down_emoji = ":ghost:"
+
+	# # Thanksgiving
+	# node_up_emoji = ":turkey:"
+	# node_down_emoji = ":poultry_leg:"
+
+	# # Present time
+	# node_up_emoji = ":gift:"
+	# node_down_emoji = ":grinch:"
+
+
+# on top of the defaults above, per environment
+environment_overrides = {
+	"prod": {},
+	"dev": {
+		"log_level":              logging.DEBUG,
+		"application_log_file":   './node_watcher_dev.log',
+		"node_changes_log_file":  './node_changes_dev.log',
+		"node_watcher_db":        "./node-watcher-dev.db",
+		"hub_down_alert_time_ms": 120000, # in case we want to be more aggressive about hubs
+		"error_sleep_time_s":     60,
+		"hub_down_node_qty":      3,
+		"reporting_minute":       1,
+		"flap_time_window_qty":   6,
+	},
+}
+
+
+# a Config for `environment`, with `overrides` ({name: value}) on top. Raises ValueError for a name that isn't a tuneable
+def make_config( environment="prod", overrides=None ):
+	if environment not in environment_overrides:
+		raise ValueError(f"there's no environment called {environment}")
+
+	config = Config()
+	# the class's lists and dicts would otherwise be shared by every Config
+	for name in dir(Config):
+		if not name.startswith("_") and isinstance(getattr(Config, name), (list, dict, set)):
+			setattr(config, name, copy.deepcopy(getattr(Config, name)))
+
+	config.environment = environment
+	for name, value in list(environment_overrides[environment].items()) + list((overrides or {}).items()):
+		if name.startswith("_") or not hasattr(Config, name):
+			raise ValueError(f"there's no tuneable called {name}")
+		setattr(config, name, value)
+	return( config )
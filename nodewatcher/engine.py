@@ -0,0 +1,459 @@
+import heapq, logging
+import datetime as dt
+from .flap_counter import FlapCounter
+from .metrics import Metrics
+from .trackers import FlappyNode, NodeState, RemovedNode
+
+
+# The detection logic, with nothing attached: no Slack, no BIRD, no sqlite. An Engine is given what changed between
+# two LSDB snapshots (see bird.make_snapshot_item()) and keeps its trackers up to date, and returns what should be
+# alerted on as a list of events - it's up to whoever drives it (app.py, a replay, a benchmark) what to do with them.
+# Events are dicts with a "kind", one of:
+#   node_up          {router_id, down_ms, flappy}              a node that was alerted on is back
+#   node_down        {router_id, down_ms, flappy}              a node has been down long enough to alert on
+#   node_flappy      {router_id}                               a node has flapped too many times
+#   hub_nodes_up     {hub_down_group, router_ids, down_ms}     some nodes from a hub outage are back
+#   hub_all_up       {hub_down_group}                          ...and that was the last of them
+#   hub_down         {hub_down_group, router_ids, down_ms, graph, before_outage_s}
+#                                                              enough nodes went down at once to look like a hub outage. graph is
+#                                                              the topology from right before it (or None), before_outage_s is when to
+#                                                              ask Node Explorer about
+#   hub_still_down   {hub_down_group, router_ids}              time for a hub outage's periodic report, if anyone asked for one
+#   node_abandoned   {router_id, down_ms}                      down so long it's dropped from alerting
+#   daily_report     {down_qty, down_nodes, abandoned_nodes, mapped_nodes, flappy_nodes}
+#   catch_up_summary {minutes, first_suffix, last_suffix, down, up}
+# down_ms is how long the node (or the first node of a group) has been down, as of the snapshot
+
+
+# Whether a node is silenced is the one thing the engine has to ask about, since that's decided by reactions in Slack.
+# `silences` is anything with these methods - slack.Reactions is the real one. This one has nothing silenced
+class NoSilences:
+
+	# every node that might get asked about this cycle, before any of them are
+	def begin_cycle(self, router_ids):
+		pass
+
+	# as fresh as it gets
+	def is_silenced(self, router_id):
+		return False
+
+	# whatever's known without asking anyone, for when there's lots of nodes to ask about
+	def is_silenced_cached(self, router_id):
+		return False
+
+	def forget(self, router_id):
+		pass
+
+
+def get_downtime_humanized( down_ms, threshold_ms=None ):
+	down_time_m = int(down_ms / 60000)
+	# doing this to make things look cleaner from rounding, at the cost of a bit of accuracy
+	if threshold_ms is not None:
+		alert_threshold_m = round(threshold_ms / 60000)
+		if down_time_m in [alert_threshold_m - 1, alert_threshold_m, alert_threshold_m + 1]:
+			downtime_humanized = str(alert_threshold_m) + " min"
+			return ( downtime_humanized )
+	if down_time_m < 60:
+		downtime_humanized = str(down_time_m) + " min"
+	elif 60 <= down_time_m < 2880:
+		down_time_h = round((down_time_m / 60), 1)
+		downtime_humanized = str(down_time_h) + " hours"
+	elif 2880 <= down_time_m:
+		down_time_d = round((down_time_m / 1440), 1)
+		downtime_humanized = str(down_time_d) + " days"
+	return ( downtime_humanized )
+
+
+class Engine:
+
+	def __init__(self, config, silences=None, log=None, node_changes_log=None, metrics=None):
+		self.config           = config
+		self.silences         = silences or NoSilences()
+		self.log              = log or logging.getLogger("application_log")
+		self.node_changes_log = node_changes_log or logging.getLogger("node_changes_log")
+		self.metrics          = metrics or Metrics()
+
+		# removed nodes and their timers are tracked here, see trackers.py
+		# structure: {<router_id>: RemovedNode}
+		self.removed_nodes_tracker = {}
+		self.flappy_nodes_tracker  = {} # {<router_id>: FlappyNode}
+		self.hub_down_tracker      = {} # {<hub down group>: {"alerting": True}}
+
+		# which removed nodes are in each hub down group, kept up to date by add_removed_node()/pop_removed_node() so the
+		# tracker never has to be scanned for them. dicts rather than sets so members stay in the order they went down
+		# structure: {<hub down group>: {<router_id>: None, ...}}
+		self.hub_down_members = {}
+
+		# Removed nodes that aren't alerting yet, by when they're due to be: the alert threshold after they went down, or
+		# the hub down one if they're in a group. Only nodes that are past it get looked at each cycle (see take_overdue()).
+		# entries go stale when a node comes back up, alerts or leaves its group, and are skipped when they come up
+		self.alert_deadlines = []  # heap of (deadline ms, seq, router_id)
+		self.overdue         = {}  # router_id -> None, past their deadline but not alerting, e.g. silenced
+		self.next_seq        = 0
+
+		# the topology graph from right before each hub-down group went down, for the root cause guesser
+		self.hub_down_topology = {}
+
+		# what happened in the minutes being caught up on, for the summary that goes out once it's caught up
+		self.catch_up_summary = {"minutes": 0, "first_suffix": None, "last_suffix": None, "down": set(), "up": set()}
+
+		self.flap_counter = FlapCounter(config.flap_time_window_hrs * 3600000, config.flap_time_window_qty)
+
+		# the snapshot being (or last) processed, which is the engine's clock
+		self.current_timestamp_ms = None
+
+
+	def ok_to_monitor(self, router_id):
+		if self.config.environment == "dev":
+			return True
+		if router_id not in self.config.excluded_from_monitoring \
+		and router_id.startswith("10.69") \
+		and int(router_id.split('.')[2]) < 80:
+			return True
+		else:
+			return False
+
+
+	def get_down_ms(self, router_id):
+		return( self.current_timestamp_ms - self.removed_nodes_tracker[router_id].timestamp_ms )
+
+
+	def get_hub_down_group_members(self, hub_down_group):
+		return( list(self.hub_down_members.get(hub_down_group, ())) )
+
+
+	# everything that adds nodes to removed_nodes_tracker, takes them out of it, or takes them out of their hub down
+	# group goes through these, to keep hub_down_members and the alert deadlines in step
+	def add_removed_node(self, router_id, record):
+		self.pop_removed_node( router_id )
+		self.next_seq += 1
+		record.seq = self.next_seq
+		self.removed_nodes_tracker[router_id] = record
+		if record.hub_down_group is not None:
+			self.hub_down_members.setdefault(record.hub_down_group, {})[router_id] = None
+		self.schedule_alert( router_id, record )
+
+	# returns the node's record, or None if it wasn't being tracked
+	def pop_removed_node(self, router_id):
+		record = self.removed_nodes_tracker.pop(router_id, None)
+		if record is not None and record.hub_down_group is not None:
+			self.leave_hub_down_group( router_id, record.hub_down_group )
+		return( record )
+
+	# a hub down group that turned out too small - its nodes go on to alert on their own
+	def ungroup_removed_node(self, router_id):
+		record = self.removed_nodes_tracker[router_id]
+		self.leave_hub_down_group( router_id, record.hub_down_group )
+		record.hub_down_group = None
+		record.state = NodeState.PENDING
+		self.schedule_alert( router_id, record )
+
+	def leave_hub_down_group(self, router_id, hub_down_group):
+		members = self.hub_down_members.get(hub_down_group)
+		if members is not None:
+			members.pop(router_id, None)
+			if not members:
+				self.hub_down_members.pop(hub_down_group)
+
+	# after removed_nodes_tracker was filled in some other way, e.g. loaded from the db
+	def index_removed_nodes(self):
+		removed_nodes_tracker = dict(self.removed_nodes_tracker)
+		self.removed_nodes_tracker.clear()
+		self.hub_down_members = {}
+		self.alert_deadlines = []
+		self.overdue = {}
+		for router_id, record in removed_nodes_tracker.items():
+			self.add_removed_node( router_id, record )
+
+	# when a node that isn't alerting yet should be looked at, None for one that is
+	def get_alert_deadline(self, record):
+		if record.state is NodeState.PENDING:
+			return( record.timestamp_ms + self.config.alert_time_threshold_ms )
+		if record.state is NodeState.HUB_GROUPED:
+			return( record.timestamp_ms + self.config.hub_down_alert_time_ms )
+		return( None )
+
+	def schedule_alert(self, router_id, record):
+		deadline_ms = self.get_alert_deadline( record )
+		if deadline_ms is not None:
+			heapq.heappush(self.alert_deadlines, (deadline_ms, record.seq, router_id))
+
+	# the nodes past their alert deadline as of `now_ms`, in the order they went down
+	def take_overdue(self, now_ms):
+		removed_nodes_tracker = self.removed_nodes_tracker
+		alert_deadlines = self.alert_deadlines
+		while alert_deadlines and alert_deadlines[0][0] < now_ms:
+			deadline_ms, seq, router_id = heapq.heappop(alert_deadlines)
+			record = removed_nodes_tracker.get(router_id)
+			if record is not None and record.seq == seq and self.get_alert_deadline( record ) == deadline_ms:
+				self.overdue[router_id] = None
+
+		overdue = []
+		for router_id in list(self.overdue):
+			record = removed_nodes_tracker.get(router_id)
+			deadline_ms = self.get_alert_deadline( record ) if record is not None else None
+			# back up, alerting, or pushed back by leaving its group (which scheduled it again)
+			if deadline_ms is None or deadline_ms >= now_ms:
+				self.overdue.pop(router_id)
+			else:
+				overdue.append(router_id)
+		overdue.sort(key=lambda router_id: removed_nodes_tracker[router_id].seq)
+		return( overdue )
+
+
+	def take_catch_up_summary(self):
+		catch_up_summary = self.catch_up_summary
+		event = {"kind": "catch_up_summary", "minutes": catch_up_summary["minutes"], "first_suffix": catch_up_summary["first_suffix"],
+		         "last_suffix": catch_up_summary["last_suffix"], "down": sorted(catch_up_summary["down"]), "up": sorted(catch_up_summary["up"])}
+		catch_up_summary.update({"minutes": 0, "first_suffix": None, "last_suffix": None, "down": set(), "up": set()})
+		return( event )
+
+
+	# `snapshot` is what's queued up by the poller, see bird.make_snapshot_item()
+	def process_snapshot(self, snapshot):
+		config = self.config
+		silences = self.silences
+		removed_nodes_tracker = self.removed_nodes_tracker
+		flappy_nodes_tracker = self.flappy_nodes_tracker
+		hub_down_tracker = self.hub_down_tracker
+		catch_up_summary = self.catch_up_summary
+		events = []
+
+		# while catching up, state changes and trackers are kept up to date but nothing gets alerted on - see catch_up_summary
+		catching_up = snapshot.get("catching_up", False)
+
+		recently_added_nodes = snapshot["added"]
+		recently_removed_nodes = snapshot["removed"]
+
+		self.current_timestamp_ms = current_timestamp_ms = snapshot["timestamp_ms"]
+
+		if catching_up:
+			catch_up_summary["minutes"] += 1
+			catch_up_summary["first_suffix"] = catch_up_summary["first_suffix"] or snapshot["suffix"]
+			catch_up_summary["last_suffix"] = snapshot["suffix"]
+		elif catch_up_summary["minutes"]:
+			events.append(self.take_catch_up_summary())
+
+		with self.metrics.timer("flap_query"):
+			flappy_nodes = self.flap_counter.flappy_nodes( current_timestamp_ms )
+
+		# everything that may have its reactions looked up this cycle
+		silences.begin_cycle( set(recently_added_nodes) | set(removed_nodes_tracker) | set(flappy_nodes) | set(hub_down_tracker) )
+
+		if recently_added_nodes:
+
+			self.node_changes_log.info(f"{current_timestamp_ms} Added: {recently_added_nodes}\n")
+			for router_id in recently_added_nodes:
+				self.flap_counter.record(router_id, current_timestamp_ms)
+
+			# In case many nodes in a hub-down event come back up right away,
+			# they should all get batched into one post in the hub-down thread, otherwise there may be
+			# rate-limiting issues. `hub_down_added_nodes` tracks that info across for-loops
+			# structure: {<hub down group ID_1>:[list-of-returned-nodes], <hub down group ID_2>:[list-of-returned-nodes], etc}
+			hub_down_added_nodes = {}
+
+			for router_id in recently_added_nodes:
+
+				if catching_up:
+					if self.pop_removed_node( router_id ) is not None:
+						catch_up_summary["up"].add(router_id)
+
+				elif router_id in removed_nodes_tracker and removed_nodes_tracker[router_id].alerting == False:
+					self.pop_removed_node( router_id )
+
+				elif router_id in removed_nodes_tracker and removed_nodes_tracker[router_id].alerting == True \
+				and removed_nodes_tracker[router_id].hub_down_group is None \
+				and silences.is_silenced( router_id ) == False:
+
+					self.log.info(f"{router_id} downtime: {get_downtime_humanized( self.get_down_ms( router_id ))}")
+					if router_id in flappy_nodes:
+						flappy_nodes_tracker[router_id] = FlappyNode( current_timestamp_ms )
+					events.append({"kind": "node_up", "router_id": router_id, "down_ms": self.get_down_ms( router_id ), "flappy": router_id in flappy_nodes})
+					self.pop_removed_node( router_id )
+
+				elif router_id in removed_nodes_tracker and removed_nodes_tracker[router_id].alerting == True \
+				and silences.is_silenced( router_id ) == True:
+					self.pop_removed_node( router_id )
+
+				elif router_id in removed_nodes_tracker and removed_nodes_tracker[router_id].alerting == True \
+				and removed_nodes_tracker[router_id].hub_down_group is not None \
+				and not silences.is_silenced_cached( router_id ):
+
+					hub_down_group = removed_nodes_tracker[router_id].hub_down_group
+					if not hub_down_group in hub_down_added_nodes:
+						hub_down_added_nodes[hub_down_group] = []
+
+					hub_down_added_nodes[hub_down_group].append(router_id)
+
+			if hub_down_added_nodes:
+
+				self.log.info(f"hub_down_added_nodes: {hub_down_added_nodes}")
+
+				for hub_down_group in hub_down_added_nodes:
+
+					router_ids = hub_down_added_nodes[hub_down_group]
+					events.append({"kind": "hub_nodes_up", "hub_down_group": hub_down_group, "router_ids": router_ids, "down_ms": self.get_down_ms( router_ids[0] )})
+
+					for router_id in router_ids:
+						self.pop_removed_node( router_id )
+
+					if hub_down_group not in self.hub_down_members:
+						events.append({"kind": "hub_all_up", "hub_down_group": hub_down_group})
+						hub_down_tracker.pop(hub_down_group, None)
+
+			# hub-down events that ended while catching up still get closed out in their threads
+			if catching_up:
+				for hub_down_group in list(hub_down_tracker):
+					if hub_down_group not in self.hub_down_members:
+						events.append({"kind": "hub_all_up", "hub_down_group": hub_down_group})
+						hub_down_tracker.pop(hub_down_group)
+
+
+		if recently_removed_nodes:
+
+			self.node_changes_log.info(f"Removed: {str( current_timestamp_ms )} {str( recently_removed_nodes )} \n")
+			for router_id in recently_removed_nodes:
+				self.flap_counter.record(router_id, current_timestamp_ms)
+
+			# Need this to decide if this may be a hub-down event
+			unsuppressed_qty = 0
+			for router_id in recently_removed_nodes:
+				if not silences.is_silenced_cached( router_id ):
+					self.log.debug(f"{str(router_id)} not in silence_cache")
+					unsuppressed_qty += 1
+				else:
+					self.log.debug(f"{str(router_id)} _IS_ in silence_cache")
+
+			if config.hub_watcher_mode and unsuppressed_qty >= config.hub_down_node_qty:
+				# keep the graph from before these nodes went missing for the root cause guesser, and let go of old ones
+				for old_hub_down_group in list(self.hub_down_topology):
+					if current_timestamp_ms - old_hub_down_group > config.hub_down_alert_time_ms + 600000:
+						self.hub_down_topology.pop(old_hub_down_group)
+				if snapshot.get("previous_graph") is not None:
+					self.hub_down_topology[current_timestamp_ms] = snapshot["previous_graph"]
+
+				for router_id in recently_removed_nodes:
+					# Here we check against the cache in case there are _many_ lookups
+					if not silences.is_silenced_cached( router_id ):
+						self.add_removed_node( router_id, RemovedNode( current_timestamp_ms, NodeState.HUB_GROUPED, current_timestamp_ms ) )
+			else:
+				for router_id in recently_removed_nodes:
+					if self.ok_to_monitor( router_id ):
+						self.add_removed_node( router_id, RemovedNode( current_timestamp_ms ) )
+
+			if catching_up:
+				catch_up_summary["down"].update(router_id for router_id in recently_removed_nodes if router_id in removed_nodes_tracker)
+
+
+		if removed_nodes_tracker and not catching_up:
+
+			hub_down_nodes_current = []
+			# only the nodes past their alert time that haven't alerted yet, rather than every node that's down
+			for router_id in self.take_overdue( current_timestamp_ms ):
+				record = removed_nodes_tracker[router_id]
+
+				if record.state is NodeState.PENDING \
+				and silences.is_silenced( router_id ) == False:
+					if router_id in flappy_nodes:
+						flappy_nodes_tracker[router_id] = FlappyNode( current_timestamp_ms )
+					events.append({"kind": "node_down", "router_id": router_id, "down_ms": self.get_down_ms( router_id ), "flappy": router_id in flappy_nodes})
+					record.state = NodeState.ALERTING
+
+				if record.state is NodeState.HUB_GROUPED \
+				and not silences.is_silenced_cached( router_id ): # Using cache instead of Slack API call in case there are _many_ lookups
+					hub_down_nodes_current.append( router_id )
+
+			self.log.info(f"hub_down_nodes_current: {hub_down_nodes_current}")
+			if hub_down_nodes_current and len(hub_down_nodes_current) >= config.hub_down_node_qty: # need to do this check again in case any nodes have come back up
+				hub_down_group = removed_nodes_tracker[hub_down_nodes_current[0]].timestamp_ms
+				for router_id in hub_down_nodes_current:
+					removed_nodes_tracker[router_id].state = NodeState.ALERTING
+				hub_down_tracker.update({hub_down_group: {"alerting" : True}})
+				events.append({"kind": "hub_down", "hub_down_group": hub_down_group, "router_ids": hub_down_nodes_current,
+				               "down_ms": self.get_down_ms( hub_down_nodes_current[0] ), "graph": self.hub_down_topology.pop(hub_down_group, None),
+				               "before_outage_s": round(hub_down_group / 1000) - 120})
+
+			if hub_down_nodes_current and len(hub_down_nodes_current) < config.hub_down_node_qty:
+				# in the case that a hub-down event was triggered, but some nodes have come up before time and qty threshhold
+				# then don't make a hub event - just remove the hub down group and they'll alert as independant nodes
+				for router_id in hub_down_nodes_current:
+					self.hub_down_topology.pop(removed_nodes_tracker[router_id].hub_down_group, None)
+					self.ungroup_removed_node( router_id )
+
+			if hub_down_tracker:
+				self.log.info(f"hub_down_tracker: {hub_down_tracker}")
+				for hub_down_group in hub_down_tracker: # in case many hub-down events occur at once :|
+					if hub_down_tracker[hub_down_group]["alerting"] == True and int(((current_timestamp_ms / 1000) % config.hub_down_report_interval_s) / 60) == 0:
+						events.append({"kind": "hub_still_down", "hub_down_group": hub_down_group, "router_ids": self.get_hub_down_group_members( hub_down_group )})
+
+
+		if flappy_nodes and not catching_up:
+			for router_id in flappy_nodes:
+				if silences.is_silenced( router_id ) == False \
+				and router_id not in flappy_nodes_tracker \
+				and (router_id not in removed_nodes_tracker \
+				or (router_id in removed_nodes_tracker \
+				and removed_nodes_tracker[router_id].alerting == False)):
+					events.append({"kind": "node_flappy", "router_id": router_id})
+					flappy_nodes_tracker[router_id] = FlappyNode( current_timestamp_ms )
+
+
+		if self.is_report_time( current_timestamp_ms ) and not catching_up:
+			events.extend(self.make_daily_report( flappy_nodes ))
+
+		return( events )
+
+
+	# goes by the snapshot's time rather than the clock, so a backlog being worked through can't skip or repeat it
+	def is_report_time(self, timestamp_ms):
+		config = self.config
+		report_time = dt.datetime.fromtimestamp( timestamp_ms / 1000 + config.time_rollback_s )
+		return( report_time.hour == config.reporting_hour and report_time.minute == config.reporting_minute )
+
+
+	# the abandoned nodes' events, then the report itself. abandoned nodes are dropped from the trackers
+	def make_daily_report(self, flappy_nodes):
+		config = self.config
+		removed_nodes_tracker = self.removed_nodes_tracker
+		flappy_nodes_tracker = self.flappy_nodes_tracker
+		current_timestamp_ms = self.current_timestamp_ms
+		events = []
+
+		abandoned_nodes = []
+		for router_id in removed_nodes_tracker:
+			if current_timestamp_ms - removed_nodes_tracker[router_id].timestamp_ms > config.abandoned_threshold_ms:
+				abandoned_nodes.append( router_id )
+				events.append({"kind": "node_abandoned", "router_id": router_id, "down_ms": self.get_down_ms( router_id )})
+
+		report = {"kind": "daily_report", "down_qty": len(removed_nodes_tracker) - len(abandoned_nodes),
+		          "down_nodes": None, "abandoned_nodes": [], "mapped_nodes": [], "flappy_nodes": []}
+
+		if removed_nodes_tracker:
+			for router_id in removed_nodes_tracker:
+				if removed_nodes_tracker[router_id].alerting == True and not self.silences.is_silenced( router_id ):
+					report["mapped_nodes"].append( router_id )
+
+			report["down_nodes"] = []
+			for router_id in removed_nodes_tracker:
+				if router_id not in abandoned_nodes:
+					report["down_nodes"].append({"router_id": router_id, "down_ms": self.get_down_ms( router_id ), "silenced": self.silences.is_silenced( router_id )})
+
+			for router_id in abandoned_nodes:
+				report["abandoned_nodes"].append({"router_id": router_id, "down_ms": self.get_down_ms( router_id )})
+				self.log.info(f"{router_id} abandoned: {removed_nodes_tracker[router_id]}")
+				self.pop_removed_node( router_id )
+				self.silences.forget( router_id )
+
+			for router_id in flappy_nodes:
+				report["flappy_nodes"].append(( router_id, self.flap_counter.count( router_id, current_timestamp_ms )))
+
+			if flappy_nodes_tracker:
+				abandoned_flappy_nodes = []
+				for router_id in flappy_nodes_tracker:
+					if current_timestamp_ms - flappy_nodes_tracker[router_id].timestamp_ms > config.abandoned_threshold_ms:
+						abandoned_flappy_nodes.append( router_id )
+				for router_id in abandoned_flappy_nodes:
+					flappy_nodes_tracker.pop( router_id )
+
+		events.append(report)
+		return( events )
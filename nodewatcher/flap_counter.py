@@ -0,0 +1,134 @@
+import sys
+from array import array
+
+
+# In-memory flap counting, so the main loop doesn't have to ask sqlite about the whole flap window every minute.
+# Each router gets a ring buffer of its state-change timestamps inside the window. Timestamps that fall out of
+# the window are only dropped when that router is next looked at, and everything gets swept once an hour
+
+
+class TimestampRing:
+
+	__slots__ = ("timestamps", "head", "size")
+
+	def __init__(self, capacity=16):
+		self.timestamps = array('q', bytes(8 * capacity))
+		self.head       = 0
+		self.size       = 0
+
+	def __len__(self):
+		return( self.size )
+
+	def ordered(self):
+		capacity = len(self.timestamps)
+		end = self.head + self.size
+		if end <= capacity:
+			return( self.timestamps[self.head:end] )
+		return( self.timestamps[self.head:] + self.timestamps[:end - capacity] )
+
+	def resize(self, capacity):
+		timestamps = self.ordered()
+		timestamps.extend(array('q', bytes(8 * (capacity - self.size))))
+		self.timestamps = timestamps
+		self.head = 0
+
+	# timestamps are expected to come in oldest to newest
+	def append(self, timestamp_ms):
+		capacity = len(self.timestamps)
+		if self.size == capacity:
+			self.resize(capacity * 2)
+			capacity *= 2
+		self.timestamps[(self.head + self.size) % capacity] = timestamp_ms
+		self.size += 1
+
+	# drops everything older than `cutoff_ms`, returns how many were dropped
+	def evict_before(self, cutoff_ms):
+		capacity = len(self.timestamps)
+		evicted = 0
+		while self.size and self.timestamps[self.head] < cutoff_ms:
+			self.head = (self.head + 1) % capacity
+			self.size -= 1
+			evicted += 1
+		# give memory back after a burst of flapping has aged out
+		if evicted and capacity > 16 and self.size < capacity // 4:
+			self.resize(max(16, capacity // 2))
+		return( evicted )
+
+	# little-endian int64s, oldest first - this is what gets stored in sqlite
+	def to_bytes(self):
+		timestamps = self.ordered()
+		if sys.byteorder == "big":
+			timestamps.byteswap()
+		return( timestamps.tobytes() )
+
+	@classmethod
+	def from_bytes(cls, data):
+		timestamps = array('q')
+		timestamps.frombytes(data)
+		if sys.byteorder == "big":
+			timestamps.byteswap()
+		ring = cls(max(16, len(timestamps)))
+		for timestamp_ms in timestamps:
+			ring.append(timestamp_ms)
+		return( ring )
+
+
+class FlapCounter:
+
+	def __init__(self, window_ms, flap_qty):
+		self.window_ms = window_ms
+		self.flap_qty  = flap_qty
+		self.rings     = {}    # router_id -> TimestampRing
+		self.flappy    = set() # routers that were at or over flap_qty when last looked at
+		self.dirty     = set() # routers whose ring changed since the last take_dirty()
+		self.swept_ms  = 0
+
+	def record(self, router_id, timestamp_ms):
+		ring = self.rings.get(router_id)
+		if ring is None:
+			ring = self.rings[router_id] = TimestampRing()
+		ring.evict_before(timestamp_ms - self.window_ms)
+		ring.append(timestamp_ms)
+		self.dirty.add(router_id)
+		if len(ring) >= self.flap_qty:
+			self.flappy.add(router_id)
+
+	# state changes of `router_id` in the window ending at `now_ms`, same as counting node_state_changes BETWEEN the two
+	def count(self, router_id, now_ms):
+		ring = self.rings.get(router_id)
+		if ring is None:
+			return( 0 )
+		if ring.evict_before(now_ms - self.window_ms):
+			self.dirty.add(router_id)
+		if len(ring) < self.flap_qty:
+			self.flappy.discard(router_id)
+		if not len(ring):
+			self.rings.pop(router_id)
+		return( len(ring) )
+
+	def flappy_nodes(self, now_ms):
+		if now_ms - self.swept_ms >= 3600000:
+			self.sweep(now_ms)
+		for router_id in list(self.flappy):
+			self.count(router_id, now_ms)
+		return( sorted(self.flappy) )
+
+	def sweep(self, now_ms):
+		for router_id in list(self.rings):
+			self.count(router_id, now_ms)
+		self.swept_ms = now_ms
+
+	# routers whose rings need saving, with their ring (None if it's empty and the saved copy should go)
+	def take_dirty(self):
+		dirty = {}
+		for router_id in self.dirty:
+			dirty[router_id] = self.rings.get(router_id)
+		self.dirty = set()
+		return( dirty )
+
+	def load(self, router_id, data):
+		ring = TimestampRing.from_bytes(data)
+		if len(ring):
+			self.rings[router_id] = ring
+			if len(ring) >= self.flap_qty:
+				self.flappy.add(router_id)
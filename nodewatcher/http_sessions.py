@@ -0,0 +1,68 @@
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# One requests.Session per service, so connections (and their TLS handshakes) get reused across calls
+# instead of a fresh one for every requests.get()/requests.post()
+
+
+# requests has no session-wide timeout, so this fills one in for any request that doesn't bring its own.
+# With `metrics` (see metrics.py) every request is counted and timed under `service`, along with the ones that
+# failed and the ones that got rate limited. Retries happen inside urllib3, so they're counted from its retry history
+class TimeoutHTTPAdapter(HTTPAdapter):
+
+	def __init__(self, *args, timeout=None, metrics=None, service=None, **kwargs):
+		self.timeout = timeout
+		self.metrics = metrics
+		self.service = service
+		super().__init__(*args, **kwargs)
+
+	def send(self, request, **kwargs):
+		if kwargs.get("timeout") is None:
+			kwargs["timeout"] = self.timeout
+		if self.metrics is None:
+			return( super().send(request, **kwargs) )
+
+		started_s = time.perf_counter()
+		try:
+			response = super().send(request, **kwargs)
+		except Exception:
+			self.metrics.inc("api_errors_total", service=self.service)
+			raise
+		finally:
+			self.metrics.inc("api_requests_total", service=self.service)
+			self.metrics.observe("api_request_seconds", time.perf_counter() - started_s, service=self.service)
+		retries = getattr(response.raw, "retries", None)
+		for retry in (retries.history if retries else ()):
+			self.metrics.inc("api_retries_total", service=self.service)
+			if retry.status == 429:
+				self.metrics.inc("api_rate_limited_total", service=self.service)
+		if response.status_code == 429:
+			self.metrics.inc("api_rate_limited_total", service=self.service)
+		elif response.status_code >= 400:
+			self.metrics.inc("api_errors_total", service=self.service)
+		return( response )
+
+
+# `timeout` is (connect, read) seconds. Connection failures are retried for any method, since nothing was sent yet,
+# but only GETs are retried after a read timeout or a 429/5xx - a POST that may have gone through is never resent.
+# Waits between retries are backoff_factor * 1, 2, 4... seconds, or whatever a Retry-After header says
+def make_session( headers=None, timeout=(5, 30), retries=3, backoff_factor=0.5, pool_maxsize=10, metrics=None, service=None ):
+	retry = Retry(
+		total=retries,
+		backoff_factor=backoff_factor,
+		status_forcelist=(429, 500, 502, 503, 504),
+		allowed_methods=frozenset(["GET"]),
+		respect_retry_after_header=True,
+		raise_on_status=False,
+	)
+	adapter = TimeoutHTTPAdapter(timeout=timeout, max_retries=retry, pool_maxsize=pool_maxsize, metrics=metrics, service=service)
+
+	session = requests.Session()
+	session.mount("https://", adapter)
+	session.mount("http://", adapter)
+	if headers:
+		session.headers.update(headers)
+	return( session )
@@ -0,0 +1,143 @@
+import codecs, json, re
+
+
+# The BIRD API hands us the whole OSPF LSDB as one JSON document, but most of the time all we want from it
+# is the keys of ['areas']['0.0.0.0']['routers']. Rather than json.loads()-ing every link, cost and neighbor
+# into dicts, this walks the document as it comes off the wire: objects along the way to the wanted path are
+# walked structurally, and everything else is skipped one member at a time, so memory use is bounded by the
+# size of a single router entry instead of the whole LSDB
+
+
+_decoder     = json.JSONDecoder()
+_whitespace  = re.compile(r'[ \t\n\r]*')
+_json_string = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+
+
+class _ChunkReader:
+
+	def __init__(self, chunks):
+		self.chunks  = iter(chunks)
+		self.decoder = codecs.getincrementaldecoder('utf-8')()
+		self.buf     = ""
+		self.pos     = 0
+		self.eof     = False
+
+	# pulls chunks until at least `min_chars` new characters are buffered (or there's nothing left)
+	def fill(self, min_chars=1):
+		if self.pos > 65536:
+			self.buf = self.buf[self.pos:]
+			self.pos = 0
+		added = 0
+		while added < min_chars and not self.eof:
+			try:
+				chunk = next(self.chunks)
+			except StopIteration:
+				self.eof = True
+				chunk = self.decoder.decode(b"", final=True)
+			else:
+				if isinstance(chunk, bytes):
+					chunk = self.decoder.decode(chunk)
+			self.buf += chunk
+			added += len(chunk)
+		return( added > 0 )
+
+	def peek(self):
+		while True:
+			self.pos = _whitespace.match(self.buf, self.pos).end()
+			if self.pos < len(self.buf):
+				return( self.buf[self.pos] )
+			if not self.fill():
+				raise ValueError("LSDB snapshot ended unexpectedly")
+
+	def expect(self, chars):
+		char = self.peek()
+		if char not in chars:
+			raise ValueError(f"LSDB snapshot: expected one of {chars!r} at offset {self.pos}, got {char!r}")
+		self.pos += 1
+		return( char )
+
+	def read_string(self):
+		self.peek()
+		while True:
+			match = _json_string.match(self.buf, self.pos)
+			if match:
+				break
+			if not self.fill(len(self.buf) - self.pos):
+				raise ValueError("LSDB snapshot ended in the middle of a string")
+		self.pos = match.end()
+		raw = match.group()
+		if '\\' in raw:
+			return( json.loads(raw) )
+		return( raw[1:-1] )
+
+	# decodes the next value in C via raw_decode(). a value that fails to parse, or that runs right up to the
+	# end of the buffer (a number could be cut in half), may just be incomplete, so buffer more and retry
+	def read_value(self):
+		self.peek()
+		while True:
+			try:
+				value, end = _decoder.raw_decode(self.buf, self.pos)
+				if end < len(self.buf) or self.eof:
+					break
+			except json.JSONDecodeError:
+				if self.eof:
+					raise
+			self.fill(len(self.buf) - self.pos)
+		self.pos = end
+		return( value )
+
+
+# Yields (path, key, value) for every member of the objects at `paths`, e.g. paths=[("areas", "0.0.0.0", "routers")]
+# yields one tuple per router. `value` is only decoded when decode_values is True, otherwise it's None.
+# Raises KeyError if one of the paths isn't in the document at all, so a truncated or malformed snapshot
+# can't be mistaken for "every node went down". `optional_paths` are walked the same way but may be missing
+def iter_object_members( chunks, paths, decode_values=False, optional_paths=() ):
+	required  = set(tuple(path) for path in paths)
+	paths     = required | set(tuple(path) for path in optional_paths)
+	max_depth = max(len(path) for path in paths)
+	found     = set()
+	reader    = _ChunkReader(chunks)
+
+	reader.expect('{')
+	# each frame is [path of the object, whether the next thing is a key (or the end) rather than a comma (or the end)]
+	stack = [[(), True]]
+	while stack:
+		frame = stack[-1]
+		path, expecting_key = frame
+		char = reader.expect('"}' if expecting_key else ',}')
+		if char == '}':
+			stack.pop()
+			continue
+		if char == ',':
+			frame[1] = True
+			continue
+
+		reader.pos -= 1
+		key = reader.read_string()
+		reader.expect(':')
+		frame[1] = False
+
+		if path in paths:
+			if decode_values:
+				yield( path, key, reader.read_value() )
+			else:
+				reader.read_value()
+				yield( path, key, None )
+		elif len(path) < max_depth and reader.peek() == '{':
+			# anything this shallow is walked into rather than decoded, so e.g. a second area's routers
+			# get skipped one router at a time instead of all at once
+			reader.pos += 1
+			if path + (key,) in paths:
+				found.add(path + (key,))
+			stack.append([path + (key,), True])
+		else:
+			reader.read_value()
+
+	missing = required - found
+	if missing:
+		raise KeyError(f"LSDB snapshot is missing {sorted(missing)}")
+
+
+def iter_router_ids( chunks, area="0.0.0.0" ):
+	for path, router_id, value in iter_object_members( chunks, [("areas", area, "routers")] ):
+		yield( router_id )
@@ -0,0 +1,131 @@
+import threading, time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Where the minute goes. Stages of the loop get timed (timer()), calls to each service get counted, and tracker sizes
+# and backlogs are kept as gauges. All of it can be scraped in Prometheus' text format from a local HTTP endpoint
+# (MetricsServer, see metrics_port in config.py), and the main loop logs a line per cycle from take_cycle().
+# Everything here can be touched from any thread - the poller, the Slack outbox and the Node Explorer lookups all count
+
+
+class Metrics:
+
+	def __init__(self, prefix="node_watcher_"):
+		self.prefix   = prefix
+		self.lock     = threading.Lock()
+		self.counters = {} # (name, labels) -> value, labels being a sorted tuple of (label, value)
+		self.gauges   = {} # (name, labels) -> value
+		self.timings  = {} # (name, labels) -> [count, total seconds, max seconds]
+		self.cycle    = {} # stage -> seconds spent in it since the last take_cycle()
+		self.cycle_counts = {} # "<name>.<label values>" -> how much the counter went up since the last take_cycle()
+
+	def inc(self, name, value=1, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		cycle_key = ".".join([name] + [str(label_value) for label, label_value in key[1]])
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+			self.cycle_counts[cycle_key] = self.cycle_counts.get(cycle_key, 0) + value
+
+	def set(self, name, value, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.gauges[key] = value
+
+	def observe(self, name, seconds, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			timing = self.timings.get(key)
+			if timing is None:
+				timing = self.timings[key] = [0, 0.0, 0.0]
+			timing[0] += 1
+			timing[1] += seconds
+			timing[2] = max(timing[2], seconds)
+
+	# times a stage of the loop. stages can be inside each other (reaction lookups happen inside the engine), so
+	# they're each how long that stage took, and don't add up to the cycle
+	@contextmanager
+	def timer(self, stage):
+		started_s = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add_stage_time(stage, time.perf_counter() - started_s)
+
+	def add_stage_time(self, stage, seconds):
+		self.observe("stage_seconds", seconds, stage=stage)
+		with self.lock:
+			self.cycle[stage] = self.cycle.get(stage, 0) + seconds
+
+	# ({stage: ms}, {counter: increase}) since last time, for the cycle's log line
+	def take_cycle(self):
+		with self.lock:
+			cycle, cycle_counts = self.cycle, self.cycle_counts
+			self.cycle, self.cycle_counts = {}, {}
+		return( {stage: round(seconds * 1000, 1) for stage, seconds in sorted(cycle.items())}, dict(sorted(cycle_counts.items())) )
+
+	def get_gauges(self):
+		with self.lock:
+			return( {".".join([name] + [str(value) for label, value in labels]): value for (name, labels), value in sorted(self.gauges.items())} )
+
+	def render(self):
+		lines = []
+		with self.lock:
+			for kind, values in [("counter", self.counters), ("gauge", self.gauges)]:
+				for name in sorted({name for name, labels in values}):
+					lines.append(f"# TYPE {self.prefix}{name} {kind}")
+					for (value_name, labels), value in sorted(values.items()):
+						if value_name == name:
+							lines.append(f"{self.prefix}{name}{format_labels(labels)} {value}")
+			for name in sorted({name for name, labels in self.timings}):
+				timings = [(labels, timing) for (timing_name, labels), timing in sorted(self.timings.items()) if timing_name == name]
+				lines.append(f"# TYPE {self.prefix}{name} summary")
+				for labels, (count, total_s, max_s) in timings:
+					lines.append(f"{self.prefix}{name}_count{format_labels(labels)} {count}")
+					lines.append(f"{self.prefix}{name}_sum{format_labels(labels)} {total_s:.6f}")
+				lines.append(f"# TYPE {self.prefix}{name}_max gauge")
+				for labels, (count, total_s, max_s) in timings:
+					lines.append(f"{self.prefix}{name}_max{format_labels(labels)} {max_s:.6f}")
+		return( "\n".join(lines) + "\n" )
+
+
+def format_labels( labels ):
+	if not labels:
+		return( "" )
+	return( "{" + ",".join(f'{label}="{str(value)}"' for label, value in labels) + "}" )
+
+
+# Serves Metrics.render() at http://<address>:<port>/metrics from a thread of its own
+class MetricsServer:
+
+	def __init__(self, metrics, address="127.0.0.1", port=9469):
+		handler = type("MetricsHandler", (MetricsHandler,), {"metrics": metrics})
+		self.server = ThreadingHTTPServer((address, port), handler)
+		self.server.daemon_threads = True
+		self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+
+	def start(self):
+		self.thread.start()
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+	metrics = None
+
+	def log_message(self, format, *args):
+		pass
+
+	def do_GET(self):
+		if self.path.split("?")[0] != "/metrics":
+			self.send_error(404)
+			return
+		data = self.metrics.render().encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
@@ -0,0 +1,510 @@
+import time
+from .engine import get_downtime_humanized
+from .metrics import Metrics
+from .topology import get_exit_path
+from .upstream_guesser import get_closest_common_upstream, vote_closest_common_upstream
+
+
+# Everything Node-Watcher reads from and says to Slack. Reactions reads the reactions users leave on node threads and
+# alert messages (and is what tells the engine which nodes are silenced), and Alerter turns the engine's events into
+# messages for the Slack outbox (see slack_outbox.py)
+
+
+#############################################
+###  Reaction-Controlled Functionalities  ###
+#############################################
+
+
+class Reactions:
+
+	def __init__(self, config, session, storage, log, metrics=None):
+		self.config  = config
+		self.session = session # reads only, posts go through the outbox
+		self.storage = storage # for which messages are whose (see Storage.get_message_ts()), and subscriptions
+		self.log     = log
+		self.metrics = metrics or Metrics()
+
+		self.get_reactions_URI         = config.slack_API_prefix + "reactions.get"
+		self.conversations_history_URI = config.slack_API_prefix + "conversations.history"
+
+		# Reactions are looked up a lot - is_silenced() alone gets called several times for the same node in the same minute -
+		# so once per cycle begin_cycle() is given every node/hub group that might get looked up, and the first
+		# get_reactions() of the cycle pulls all of their messages' reactions out of the channel history in one go
+		self.reaction_snapshot         = {}    # message ts -> that message's reactions, for this cycle only
+		self.reaction_snapshot_wanted  = set() # message ts that lookups this cycle are expected to ask for
+		self.reaction_snapshot_loaded  = False
+		self.reaction_snapshot_since_s = None  # every channel message posted since then is in the snapshot, so a missing one has been deleted
+		# how far back the last scan that used up all reaction_snapshot_max_pages got. messages older than that (like the
+		# threads of nodes that went down long ago) aren't scanned for, they go straight to reactions.get
+		self.reaction_snapshot_reach_s = None
+		self.silence_cache_refreshed_s = 0
+
+		# this is mostly used during hub-down events, to prevent _many_ API calls (to get emojis).
+		# it's kept up to date by is_silenced() and by every reaction snapshot, and time-boxed silences
+		# expire on their own - see is_silenced_cached()
+		self.silence_cache = {}
+
+
+	def begin_cycle(self, router_ids):
+		self.begin_reaction_snapshot( router_ids )
+		if self.config.use_reaction_snapshot and time.time() - self.silence_cache_refreshed_s >= self.config.silence_cache_refresh_interval_s:
+			with self.metrics.timer("reaction_lookups"):
+				self.load_reaction_snapshot()
+
+	def begin_reaction_snapshot(self, router_ids):
+		self.reaction_snapshot.clear()
+		self.reaction_snapshot_wanted.clear()
+		self.reaction_snapshot_loaded = False
+		self.reaction_snapshot_since_s = None
+
+		reach_s = self.reaction_snapshot_reach_s
+		for router_id in router_ids:
+			for message_ts in self.storage.get_message_ts( router_id ):
+				if reach_s is None or float(message_ts) >= reach_s:
+					self.reaction_snapshot_wanted.add(message_ts)
+
+	def load_reaction_snapshot(self):
+		self.reaction_snapshot_loaded = True
+
+		# with nothing wanted this is just a silence cache refresh, and the newest page is where fresh reactions show up
+		params = {"channel": self.config.channel, "limit": 200}
+		max_pages = 1
+		if self.reaction_snapshot_wanted:
+			params["oldest"] = min(self.reaction_snapshot_wanted, key=float)
+			params["inclusive"] = "true"
+			max_pages = self.config.reaction_snapshot_max_pages
+
+		for page in range(max_pages):
+			response = self.session.get(self.conversations_history_URI, params=params)
+			json_data = response.json()
+			if not json_data.get("ok"):
+				# most likely the app is missing the channels:history scope - reactions.get still works, just slower
+				self.log.error(f"conversations.history failed ({json_data.get('error')}), falling back to reactions.get")
+				return
+
+			for message in json_data["messages"]:
+				self.reaction_snapshot[message["ts"]] = message.get("reactions", [])
+
+			next_cursor = json_data.get("response_metadata", {}).get("next_cursor")
+			if not next_cursor:
+				self.reaction_snapshot_since_s = float(params.get("oldest", 0))
+				break
+			if self.reaction_snapshot_wanted <= self.reaction_snapshot.keys():
+				break
+			params["cursor"] = next_cursor
+		else:
+			# ran out of pages before getting back to the oldest wanted message, so next time don't try to
+			if max_pages > 1 and self.reaction_snapshot:
+				self.reaction_snapshot_reach_s = min(float(message_ts) for message_ts in self.reaction_snapshot)
+
+		# history comes newest-first, so everything between the oldest message seen and now has been seen
+		if self.reaction_snapshot_since_s is None and self.reaction_snapshot:
+			self.reaction_snapshot_since_s = min(float(message_ts) for message_ts in self.reaction_snapshot)
+
+		self.log.debug(f"reaction snapshot: {len(self.reaction_snapshot)} messages from {page + 1} history page(s), {len(self.reaction_snapshot_wanted)} wanted")
+		self.refresh_silence_cache()
+		self.silence_cache_refreshed_s = time.time()
+
+	def get_reactions(self, message_ts):
+		if self.config.replay_mode:
+			return( [] ) # nobody reacts to a replay
+		with self.metrics.timer("reaction_lookups"):
+			return( self.lookup_reactions( message_ts ))
+
+	def lookup_reactions(self, message_ts):
+		if self.config.use_reaction_snapshot:
+			if not self.reaction_snapshot_loaded:
+				self.load_reaction_snapshot()
+			if message_ts in self.reaction_snapshot:
+				return( self.reaction_snapshot[message_ts] )
+			if self.reaction_snapshot_since_s is not None and float(message_ts) >= self.reaction_snapshot_since_s:
+				return( [] )
+
+		response = self.session.get(self.get_reactions_URI, params={	"channel": self.config.channel, "timestamp": message_ts})
+		json_data = response.json()
+		message_reactions = json_data["message"].get("reactions", [])
+		if self.config.use_reaction_snapshot:
+			self.reaction_snapshot[message_ts] = message_reactions
+		return( message_reactions )
+
+	# reactions on the hub-down group's thread, or None if it hasn't got one (yet - it may still be in the Slack outbox)
+	def get_thread_reactions(self, key):
+		thread_ts = self.storage.slack_threads.get(str(key))
+		return( self.get_reactions( thread_ts ) if thread_ts is not None else None )
+
+
+	# The silence cache is how hub-down events (and anything else that can't afford API calls) decide whether a node is silenced.
+	# structure: {<router_id>: {"kind": "x" | "date" | "stopwatch", "expires_s": <unix time, or None for :x:>}}
+	# :x: lasts until the reaction is removed, :date:/:stopwatch: run from when the reacted-to message was posted
+	def get_message_silence(self, message_reactions, message_ts):
+		reactions = []
+		for reaction in message_reactions:
+			reactions.append(reaction["name"])
+		if "x" in reactions:
+			return( {"kind": "x", "expires_s": None} )
+		silence = None
+		if any(reaction in reactions for reaction in ["date", "calendar"]):
+			silence = {"kind": "date", "expires_s": float(message_ts) + self.config.suppress_duration_DATE_s}
+		if "stopwatch" in reactions:
+			stopwatch_silence = {"kind": "stopwatch", "expires_s": float(message_ts) + self.config.suppress_duration_STOPWATCH_s}
+			silence = strongest_silence( silence, stopwatch_silence )
+		return( silence )
+
+	# returns whether the node ends up silenced
+	def update_silence_cache(self, router_id, silence, now_s):
+		if silence is not None and (silence["expires_s"] is None or silence["expires_s"] > now_s):
+			self.silence_cache[router_id] = silence
+			return True
+		self.silence_cache.pop(router_id, None)
+		return False
+
+	# API-free, and only as fresh as the last is_silenced()/reaction snapshot that covered the node
+	def is_silenced_cached(self, router_id):
+		silence = self.silence_cache.get(router_id)
+		if silence is None:
+			return False
+		if silence["expires_s"] is not None and silence["expires_s"] <= time.time():
+			self.silence_cache.pop(router_id)
+			return False
+		return True
+
+	def forget(self, router_id):
+		self.silence_cache.pop(router_id, None)
+
+	# Every thread parent or alert message that turned up in the history scan gets its node's silence updated,
+	# whether or not that node was looked up this cycle. If only some of a node's messages were covered by the scan,
+	# the node can gain a silence here but not lose one - that's left to is_silenced()
+	def refresh_silence_cache(self):
+		now_s = time.time()
+		message_keys = self.storage.message_keys
+		router_ids = {message_keys[message_ts] for message_ts in self.reaction_snapshot if message_ts in message_keys}
+
+		for router_id in router_ids:
+			silence = None
+			covered = True
+			for message_ts in self.storage.get_message_ts( router_id ):
+				if message_ts in self.reaction_snapshot:
+					silence = strongest_silence( silence, self.get_message_silence( self.reaction_snapshot[message_ts], message_ts ))
+				elif self.reaction_snapshot_since_s is None or float(message_ts) < self.reaction_snapshot_since_s:
+					covered = False
+			if not covered:
+				silence = strongest_silence( silence, self.silence_cache.get(router_id) )
+			self.update_silence_cache( router_id, silence, now_s )
+
+	def is_silenced(self, router_id):
+
+		# First we check the node's thread (in case a user has put reaction there)
+		# Then after this we check the (ephemeral) alert message in the main channel
+		# Two places that a user could've put a reaction, and both are checked so the cache gets the longest-lasting silence
+		silence = None
+		for message_ts in self.storage.get_message_ts( router_id ):
+			silence = strongest_silence( silence, self.get_message_silence( self.get_reactions( message_ts ), message_ts ))
+
+		return( self.update_silence_cache( router_id, silence, time.time() ))
+
+
+	def get_subscribed_users(self, router_id):
+		subscribed_users = []
+		# First we check the node's thread (in case a user has put reaction there)
+		# Then after this we check the (ephemeral) alert message in the main channel
+		# Two places that a user could've put a reaction
+		# (the thread might still be sitting in the Slack outbox, in which case nobody has reacted to it yet)
+		for messages in [self.storage.slack_threads, self.storage.alert_messages]:
+			message_ts = messages.get(router_id)
+			if message_ts is None:
+				continue
+
+			for reaction in self.get_reactions( message_ts ):
+
+				# "eyes" is a one-shot subscription so no need to check db
+				if reaction["name"] == "eyes":
+					for user in reaction["users"]:
+						subscribed_users.append( user )
+
+				# Let's first update the subscriptions to reflect all users' wishes
+				if reaction["name"] in ["heart", "hearts"]:
+					self.storage.add_subscribers( router_id, reaction["users"] )
+
+				if reaction["name"] == "broken_heart":
+					self.storage.remove_subscribers( router_id, reaction["users"] )
+
+		# now that the subscriptions should reflect all users' current wishes, we report them
+		for subbed_user in sorted(self.storage.get_subscribers( router_id )):
+			subscribed_users.append( subbed_user )
+
+		return( subscribed_users )
+
+
+def strongest_silence( silence, other_silence ):
+	if silence is None or other_silence is None:
+		return( silence or other_silence )
+	if silence["expires_s"] is None or other_silence["expires_s"] is None:
+		return( {"kind": "x", "expires_s": None} )
+	if other_silence["expires_s"] > silence["expires_s"]:
+		return( other_silence )
+	return( silence )
+
+
+
+##################
+###  Alerting  ###
+##################
+
+
+def IP_to_NN( IP ):
+	NN = None
+	if IP.startswith("10.69"):
+		if len( IP.split('.')[3] ) == 3:
+			NN = int(IP.split('.')[2]) * 100 + int(IP.split('.')[3][1:])
+		else:
+			NN = int(IP.split('.')[2]) * 100 + int(IP.split('.')[3])
+	return ( NN )
+
+
+# Turns the engine's events (see engine.py) into posts for the Slack outbox, one alert_<kind>() for each kind
+class Alerter:
+
+	def __init__(self, config, outbox, reactions, node_explorer_session, log):
+		self.config                = config
+		self.outbox                = outbox
+		self.reactions             = reactions
+		self.node_explorer_session = node_explorer_session
+		self.log                   = log
+
+	def handle(self, events):
+		for event in events:
+			getattr(self, "alert_" + event["kind"])(event)
+
+	def get_node_webmap_URI(self, nodes_to_be_mapped):
+		node_map_URI = self.config.node_map_prefix
+		for node in nodes_to_be_mapped:
+			if node != nodes_to_be_mapped[-1]:
+				node_map_URI += str(node) + "-"
+			else:
+				node_map_URI += str(node)
+		return( node_map_URI )
+
+
+	####  ROOT CAUSE  ####
+
+	# Answered from a topology graph in memory - no API calls. Returns None if none of the nodes has a way out in the graph
+	def get_closest_common_upstream_local(self, node_list, graph):
+		outage_exit_paths = []
+		for router_id in node_list:
+			exit_path = get_exit_path( graph, router_id )
+			self.log.debug(f"get_closest_common_upstream_local: node: {router_id} exit path: {exit_path}")
+			if exit_path:
+				outage_exit_paths.append(exit_path)
+		if not outage_exit_paths:
+			return( None )
+		return( vote_closest_common_upstream( outage_exit_paths, self.config.root_cause_distance_weighted ))
+
+	def guess_root_cause(self, event):
+		config = self.config
+		hub_down_nodes_current = event["router_ids"]
+		try:
+			suspected_problem_node = None
+			if config.root_cause_from_local_topology and event["graph"] is not None:
+				suspected_problem_node = self.get_closest_common_upstream_local( hub_down_nodes_current, event["graph"] )
+			if suspected_problem_node is None and config.replay_mode:
+				suspected_problem_node = "not sure lol" # Node Explorer only knows about now, not the past being replayed
+			if suspected_problem_node is None:
+				# the lookups run in parallel, so every down node can be sampled (see root_cause_guesser_sample_qty)
+				node_list = hub_down_nodes_current
+				if config.root_cause_guesser_sample_qty:
+					node_list = node_list[:config.root_cause_guesser_sample_qty]
+				suspected_problem_node = get_closest_common_upstream( node_list, event["before_outage_s"], config.root_cause_distance_weighted,
+				                                                      self.node_explorer_session, config.Node_Explorer_API_prefix,
+				                                                      config.root_cause_guesser_timeout_s, config.root_cause_guesser_workers, self.log )
+		except Exception as e:
+			self.log.error('Error', exc_info=e)
+			suspected_problem_node = "not sure lol"
+		return( suspected_problem_node )
+
+
+	####  ONE FOR EACH KIND OF EVENT  ####
+
+	def alert_node_up(self, event):
+		config = self.config
+		router_id = event["router_id"]
+		downtime_humanized = get_downtime_humanized( event["down_ms"] )
+
+		# Get reactions and update subscribed users, before the previous alert message is deleted
+		subscribed_users = self.reactions.get_subscribed_users( router_id )
+		self.log.info(f"subscribed users: {str(subscribed_users)}" )
+
+		# Post to the node's existing thread, then swap the previous alert message in the channel for this one
+		# No need to check if thread exists because it is coming out of alerting
+		thread_body = (":point_up: ")
+		if event["flappy"]:
+			thread_body += config.flap_emoji + " "
+		thread_body += router_id + " is up! Downtime " + downtime_humanized
+
+		body = config.node_up_emoji + " "
+		if event["flappy"]:
+			body += config.flap_emoji + " "
+		body += router_id + " is up! Downtime " + downtime_humanized
+		self.log.debug(f"node up body: {body}")
+		self.outbox.node_update( router_id, thread_body, body, subscribed_users )
+
+	def alert_node_down(self, event):
+		config = self.config
+		router_id = event["router_id"]
+		downtime_humanized = get_downtime_humanized( event["down_ms"], config.alert_time_threshold_ms )
+
+		# Get reactions and update subscribed users before the last alert message is deleted
+		subscribed_users = self.reactions.get_subscribed_users( router_id )
+		self.log.info(f"subscribed users: {str(subscribed_users)}")
+
+		# Post to the node's history thread, then swap the previous alert message in the channel for this one.
+		# If the node doesn't have a thread yet, the outbox starts one with new_thread_body instead
+		thread_body = (":point_down: ")
+		if event["flappy"]:
+			thread_body += config.flap_emoji + " "
+		thread_body += router_id + " has been down " + downtime_humanized
+
+		body = config.node_down_emoji + " "
+		if event["flappy"]:
+			body += " " + config.flap_emoji
+		body += router_id + " has been down " + downtime_humanized
+
+		new_thread_body = (":thread: *" + router_id + "* has been down " + downtime_humanized)
+		self.outbox.node_update( router_id, thread_body, body, subscribed_users, new_thread_body )
+
+	def alert_node_flappy(self, event):
+		config = self.config
+		router_id = event["router_id"]
+
+		# Get reactions and update subscribed users before the last alert message is deleted
+		subscribed_users = self.reactions.get_subscribed_users( router_id )
+		self.log.info(f"subscribed users: {str(subscribed_users)}")
+
+		# Post to the node's history thread and swap the previous alert message in the channel for this one,
+		# or start the node's thread if it doesn't have one yet
+		body = (config.flap_emoji + " " + router_id + " has flapped " + str(config.flap_time_window_qty) + " times over the course of " + str(config.flap_time_window_hrs) + " hours")
+		new_thread_body = (":thread: *" + router_id + "* has flapped " + str(config.flap_time_window_qty) + " times over the course of " + str(config.flap_time_window_hrs) + " hours")
+		self.outbox.node_update( router_id, body, body, subscribed_users, new_thread_body )
+
+	# (this all goes in the hub down group's thread)
+	def alert_hub_nodes_up(self, event):
+		router_ids = event["router_ids"]
+		if len(router_ids) == 1:
+			body = (":point_up: " + router_ids[0] + " is up! Downtime " + get_downtime_humanized( event["down_ms"] ) )
+		else:
+			body = (":point_up: *These nodes are back up. Their downtime is " + get_downtime_humanized( event["down_ms"] )) + ":*\n"
+			for router_id in router_ids:
+				body += router_id + "  "
+		self.outbox.thread_post( event["hub_down_group"], body )
+
+	def alert_hub_all_up(self, event):
+		body = (":sunglasses: all nodes are up" )
+		self.outbox.thread_post( event["hub_down_group"], body )
+
+	def alert_hub_down(self, event):
+		config = self.config
+		hub_down_nodes_current = event["router_ids"]
+		suspected_problem_node = self.guess_root_cause( event )
+
+		parent_body = ""
+		for i in range( round(len(hub_down_nodes_current)/ 5)):
+			parent_body += ":fire:"
+		parent_body += (" *" + str(len(hub_down_nodes_current)) + "* nodes down at once, looking like a hub went down " + get_downtime_humanized( event["down_ms"], config.hub_down_alert_time_ms) + " ago. ")
+		parent_body += ("Suspected root cause node: *" + suspected_problem_node + "*. ")
+		parent_body += ("Details and tracking in this here thread :thread:")
+
+		body = ""
+		if len(hub_down_nodes_current) >= config.hub_down_raise_qty:
+			body += ("*Note: this hub-down event has been escalated*\n")
+		nodes_to_be_mapped = []
+		body += "*Nodes that are down from this hub outage:*\n"
+		for router_id in hub_down_nodes_current:
+			body += router_id + "  "
+			nodes_to_be_mapped.append(IP_to_NN( router_id ))
+
+		body += "\n<" + self.get_node_webmap_URI(nodes_to_be_mapped) + "|Map of down nodes in this outage>"
+
+
+		######################
+		###   ESCALATION   ###
+		######################
+
+		escalation_body = None
+		if len(hub_down_nodes_current) >= config.hub_down_raise_qty:
+			escalation_body = ""
+			for i in range( round(len(hub_down_nodes_current)/ 5)):
+				escalation_body += ":fire:"
+			escalation_body += (" *" + str(len(hub_down_nodes_current)) + "* nodes down at once, looking like a hub went down " + get_downtime_humanized( event["down_ms"] ) + " ago. ")
+			escalation_body += ("Suspected root cause node: *" + suspected_problem_node + "*. ")
+			escalation_body += ("All tracking for this event, including when it is resolved, is kept " ) # the outbox links the thread on the end
+			self.log.debug(f"hub-down escalation body: {escalation_body}")
+
+		# the thread, the list of down nodes in it, and the escalation all go out in that order
+		self.outbox.hub_down( event["hub_down_group"], parent_body, body, escalation_body )
+
+	def alert_hub_still_down(self, event):
+		# (no thread yet means it's still in the Slack outbox, so there's nothing to react to)
+		message_reactions = self.reactions.get_thread_reactions( event["hub_down_group"] )
+		if message_reactions:
+			for reaction in message_reactions:
+			# eyes 'turns on' reporting
+				if reaction["name"] == "eyes":
+					body = (":cry: *Nodes that are still down from this hub outage (enabled by leaving :eyes: reaction on parent):*\n")
+					nodes_to_be_mapped = []
+					for router_id in event["router_ids"]:
+						body += router_id + " "
+						nodes_to_be_mapped.append(IP_to_NN( router_id ))
+					body += "\n<" + self.get_node_webmap_URI(nodes_to_be_mapped) + "|Map of nodes that are still down in this outage>"
+					self.outbox.thread_post( event["hub_down_group"], body, unfurl_links=False )
+
+	def alert_node_abandoned(self, event):
+		router_id = event["router_id"]
+		body = (":skull_and_crossbones: " + router_id + " has been down for "  + get_downtime_humanized( event["down_ms"] ) + " and is now removed from alerting until it shows back up in LSDB ")
+		self.outbox.thread_post( router_id, body )
+
+	def alert_daily_report(self, event):
+		config = self.config
+		down_report_summary = ":bar_chart:  Down node report: " + str(event["down_qty"]) + " nodes"
+		if event["down_nodes"] is None:
+			down_report_summary += " :tada:"
+		down_report = None # goes in the summary's thread
+
+		if event["down_nodes"] is not None:
+			nodes_to_be_mapped = [IP_to_NN( router_id ) for router_id in event["mapped_nodes"]]
+
+			down_report = "*Down Nodes*:\n"
+			down_report += "```NODE            DOWNTIME        SUPPRESSED \n"
+			for down_node in event["down_nodes"]:
+				downtime_humanized = get_downtime_humanized( down_node["down_ms"] )
+				down_report += down_node["router_id"].ljust(16, " ") + downtime_humanized.ljust(16, " ") + str( down_node["silenced"] ) + "\n"
+			if event["abandoned_nodes"]:
+				down_report += "\nNodes that have exceeded time limit and are no longer monitored\n(until they show back up in LSDB):\n"
+				for abandoned_node in event["abandoned_nodes"]:
+					downtime_humanized = get_downtime_humanized( abandoned_node["down_ms"] )
+					down_report += abandoned_node["router_id"].ljust(16, " ") + downtime_humanized + "\n"
+
+			down_report += "```"
+			if nodes_to_be_mapped:
+				down_report += "\n<" + self.get_node_webmap_URI(nodes_to_be_mapped) + "|Map of down nodes>"
+
+			if event["flappy_nodes"]:
+				down_report += "\n\n*Flappy Nodes*: \n"
+				down_report += "```NODE            FLAPS IN THE LAST " + str(config.flap_time_window_hrs) + " HOURS\n"
+				for router_id, flap_qty in event["flappy_nodes"]:
+					down_report += router_id.ljust(16, " ") + str(flap_qty) + "\n"
+				down_report += "```"
+
+		self.outbox.channel_post( down_report_summary, down_report )
+
+	# one message for everything that happened in the minutes that were caught up on
+	def alert_catch_up_summary(self, event):
+		went_down = event["down"]
+		came_up = event["up"]
+		body = (":rewind: Caught up on " + str(event["minutes"]) + " minutes of LSDB snapshots that were missed ("
+		        + event["first_suffix"][:-5] + " to " + event["last_suffix"][:-5] + " UTC): "
+		        + str(len(went_down)) + " nodes went down, " + str(len(came_up)) + " came back up. "
+		        + "Alerts for those minutes were held back, anything still down gets alerted on as usual")
+		details = None
+		if went_down or came_up:
+			details = "*Went down:*\n" + "  ".join(went_down) + "\n*Came back up:*\n" + "  ".join(came_up)
+		self.outbox.channel_post( body, details )
+		self.log.info(body)
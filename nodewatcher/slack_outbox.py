@@ -0,0 +1,291 @@
+import json, queue, threading, time
+import requests
+import urllib3
+from collections import deque
+from time import sleep
+
+
+# Every Slack write goes through here, so the main loop only ever queues up what it wants said and moves on.
+# A background thread posts the queued jobs in order, keeping to Slack's rate limits (and waiting out a 429's
+# Retry-After), and a node that gets several updates before its turn comes up gets them all in one go.
+# The worker keeps its own copy of which thread and alert message belongs to which node, since it's the one
+# creating them. Whatever it creates or deletes goes back to the main loop through take_results(), and the main
+# loop writes it to sqlite, so the db is only ever touched from one thread
+
+
+class SlackOutbox:
+
+	def __init__(self, session, channel, escalation_channel, thread_URI_prefix, threads, alert_messages, log,
+	             rate_limits_s=None, max_attempts=5, API_prefix="https://slack.com/api/", metrics=None):
+		self.session            = session
+		self.channel            = channel
+		self.escalation_channel = escalation_channel
+		self.thread_URI_prefix  = thread_URI_prefix
+		self.log                = log
+		self.rate_limits_s      = rate_limits_s or {} # method -> minimum seconds between calls, per channel
+		self.max_attempts       = max_attempts
+		self.API_prefix         = API_prefix
+		self.metrics            = metrics # see metrics.py, or None
+
+		# structure: {<node or hub down group, as str>: <ts>} - seeded from slack_threads / alert_messages
+		self.threads        = dict(threads)
+		self.alert_messages = dict(alert_messages)
+
+		self.jobs       = deque()
+		self.pending    = {} # coalesce key -> job that hasn't been started yet
+		self.condition  = threading.Condition()
+		self.results    = queue.SimpleQueue()
+		self.last_call_s = {} # (method, channel) -> time.monotonic() of the last call
+		self.busy       = False # a job has been taken off the queue and isn't done yet
+		self.worker     = threading.Thread(target=self.run, name="slack-outbox", daemon=True)
+
+	def start(self):
+		self.worker.start()
+
+	def __len__(self):
+		return( len(self.jobs) )
+
+	# (table, key, ts) for every thread created and every alert message posted (ts) or deleted (None) since last time
+	def take_results(self):
+		results = []
+		while True:
+			try:
+				results.append(self.results.get_nowait())
+			except queue.Empty:
+				return( results )
+
+	def has_thread(self, key):
+		return( str(key) in self.threads )
+
+	# waits for everything queued so far to be sent (or dropped). returns False if that took longer than `timeout_s`
+	def join(self, timeout_s=None):
+		with self.condition:
+			return( self.condition.wait_for(lambda: not self.jobs and not self.busy, timeout_s) )
+
+
+	####  PRODUCERS  ####
+
+	# An alert about a node: `thread_text` goes in the node's thread, then the node's last alert message in the channel
+	# is swapped for `channel_text` with a link to that post and @-mentions of `mentions`.
+	# If the node has no thread yet, one gets started with `new_thread_text` instead (nothing happens if that's None)
+	def node_update(self, key, thread_text, channel_text, mentions=(), new_thread_text=None):
+		job = {"kind": "node_update", "key": str(key), "thread_texts": [thread_text], "channel_text": channel_text,
+		       "mentions": list(mentions), "new_thread_text": new_thread_text}
+		self.enqueue(job, ("node_update", str(key)))
+
+	# a reply in the thread of a node or a hub down group
+	def thread_post(self, key, text, unfurl_links=True):
+		job = {"kind": "thread_post", "key": str(key), "text": text, "unfurl_links": unfurl_links}
+		self.enqueue(job, ("thread_post", str(key), unfurl_links))
+
+	# Starts a hub down group's thread with `parent_text` and replies with `reply_text`. If there's an `escalation_text`,
+	# it goes to the escalation channel with a link to the reply tacked on the end
+	def hub_down(self, key, parent_text, reply_text, escalation_text=None):
+		job = {"kind": "hub_down", "key": str(key), "parent_text": parent_text, "reply_text": reply_text,
+		       "escalation_text": escalation_text}
+		self.enqueue(job)
+
+	# a message in the channel, optionally with one reply in its thread
+	def channel_post(self, text, reply_text=None):
+		self.enqueue({"kind": "channel_post", "text": text, "reply_text": reply_text})
+
+	def enqueue(self, job, coalesce_key=None):
+		with self.condition:
+			pending = self.pending.get(coalesce_key) if coalesce_key is not None else None
+			if pending is not None:
+				self.merge(pending, job)
+				return
+			if coalesce_key is not None:
+				job["coalesce_key"] = coalesce_key
+				self.pending[coalesce_key] = job
+			self.jobs.append(job)
+			# notify_all since join() waits on the same condition as the worker
+			self.condition.notify_all()
+
+	# folds `job` into a queued job for the same node/thread. thread posts get joined into one post, and since each
+	# alert message replaces the last one anyway, only the newest channel text gets posted
+	def merge(self, pending, job):
+		if job["kind"] == "node_update":
+			pending["thread_texts"].extend(job["thread_texts"])
+			pending["channel_text"] = job["channel_text"]
+			for user_id in job["mentions"]:
+				if user_id not in pending["mentions"]:
+					pending["mentions"].append(user_id)
+			if pending["new_thread_text"] is None:
+				pending["new_thread_text"] = job["new_thread_text"]
+		elif job["kind"] == "thread_post":
+			pending["text"] += "\n" + job["text"]
+
+
+	####  WORKER  ####
+
+	def run(self):
+		while True:
+			with self.condition:
+				while not self.jobs:
+					self.condition.wait()
+				job = self.jobs.popleft()
+				if "coalesce_key" in job:
+					self.pending.pop(job["coalesce_key"], None)
+				self.busy = True
+			try:
+				getattr(self, "send_" + job["kind"])(job)
+			except Exception as e:
+				self.log.error(f"Slack outbox dropped a {job['kind']} job: {job}", exc_info=e)
+			with self.condition:
+				self.busy = False
+				self.condition.notify_all()
+
+	def send_node_update(self, job):
+		key = job["key"]
+		thread_texts = job["thread_texts"]
+		thread_ts = self.threads.get(key)
+
+		if thread_ts is None:
+			if job["new_thread_text"] is None:
+				self.log.error(f"Slack outbox: {key} has no thread to post in, dropping {job}")
+				return
+			json_data = self.post_message(job["new_thread_text"], self.channel)
+			thread_ts = self.record_thread(key, json_data["ts"])
+			# anything coalesced after the first update still goes out as a normal update
+			thread_texts = thread_texts[1:]
+			if not thread_texts:
+				return
+
+		# the main loop reads the old alert's reactions (subscriptions) before queueing this, so it's safe to delete
+		alert_ts = self.alert_messages.pop(key, None)
+		if alert_ts is not None:
+			self.call("chat.delete", {"channel": self.channel, "ts": alert_ts})
+			self.results.put(("alert_messages", key, None))
+
+		json_data = self.post_message("\n".join(thread_texts), self.channel, thread_ts)
+		body = job["channel_text"] + " <" + self.get_message_URI(json_data) + "|node history>"
+		for user_id in job["mentions"]:
+			body += " <@" + user_id + "> "
+		json_data = self.post_message(body, self.channel, unfurl_links=False)
+		self.alert_messages[key] = json_data["ts"]
+		self.results.put(("alert_messages", key, json_data["ts"]))
+
+	def send_thread_post(self, job):
+		thread_ts = self.threads.get(job["key"])
+		if thread_ts is None:
+			self.log.error(f"Slack outbox: {job['key']} has no thread to post in, dropping {job}")
+			return
+		self.post_message(job["text"], self.channel, thread_ts, job["unfurl_links"])
+
+	def send_hub_down(self, job):
+		json_data = self.post_message(job["parent_text"], self.channel)
+		thread_ts = self.record_thread(job["key"], json_data["ts"])
+		json_data = self.post_message(job["reply_text"], self.channel, thread_ts, unfurl_links=False)
+		if job["escalation_text"]:
+			body = job["escalation_text"] + "<" + self.get_message_URI(json_data) + "|in this thread> "
+			self.post_message(body, self.escalation_channel, unfurl_links=False)
+
+	def send_channel_post(self, job):
+		json_data = self.post_message(job["text"], self.channel)
+		if job["reply_text"]:
+			self.post_message(job["reply_text"], self.channel, json_data["ts"], unfurl_links=False)
+
+	def record_thread(self, key, thread_ts):
+		self.threads[key] = thread_ts
+		self.results.put(("slack_threads", key, thread_ts))
+		return( thread_ts )
+
+	# link to a message posted in a thread, from its chat.postMessage response
+	def get_message_URI(self, json_data):
+		message_ts = json_data["message"]["ts"]
+		thread_ts = json_data["message"].get("thread_ts", message_ts)
+		channel = self.channel
+		return( self.thread_URI_prefix + channel + "/p" + message_ts.replace('.', '') + "?thread_ts=" + thread_ts + "&cid=" + channel )
+
+	def post_message(self, text, channel, thread_ts=None, unfurl_links=True):
+		payload = {"text": text, "channel": channel}
+		if thread_ts is not None:
+			payload["thread_ts"] = thread_ts
+		if not unfurl_links:
+			payload["unfurl_links"] = False
+		return( self.call("chat.postMessage", payload) )
+
+	# One Web API call, spaced out from the last call to the same method and channel, and retried after a 429
+	# (for as long as Retry-After says) or a connection that couldn't be made (see was_never_sent()). Anything that
+	# may have reached Slack, like a read timeout or a connection dropped mid-request, isn't resent - that'd be a
+	# duplicate post - so the job gets dropped instead. Slack errors other than rate limits come back as-is
+	def call(self, method, payload):
+		rate_key = (method, payload.get("channel"))
+		for attempt in range(1, self.max_attempts + 1):
+			wait_s = self.last_call_s.get(rate_key, 0) + self.rate_limits_s.get(method, 0) - time.monotonic()
+			if wait_s > 0:
+				sleep(wait_s)
+			self.last_call_s[rate_key] = time.monotonic()
+
+			try:
+				started_s = time.perf_counter()
+				response = self.session.post(self.API_prefix + method, data=json.dumps(payload))
+			except requests.exceptions.RequestException as e:
+				if not was_never_sent( e ):
+					self.log.warning(f"Slack {method} failed and may have gone through, not resending: {e!r}")
+					raise
+				if attempt == self.max_attempts:
+					raise
+				self.log.warning(f"Slack {method} failed, attempt {attempt} of {self.max_attempts}", exc_info=e)
+				sleep(2 ** attempt)
+				continue
+
+			if response.status_code == 429:
+				retry_after_s = float(response.headers.get("Retry-After", 1))
+				self.log.warning(f"Slack {method} rate limited, retrying in {retry_after_s}s")
+				# nothing else on this method and channel is going anywhere until then either
+				self.last_call_s[rate_key] = time.monotonic() + retry_after_s
+				continue
+
+			json_data = response.json()
+			if self.metrics is not None:
+				self.metrics.add_stage_time("slack_post", time.perf_counter() - started_s)
+			if not json_data.get("ok"):
+				self.log.warning(f"Slack {method} returned {json_data.get('error')}: {payload}")
+				if self.metrics is not None:
+					self.metrics.inc("slack_errors_total", method=method)
+			return( json_data )
+
+		raise Exception(f"Slack {method} still rate limited after {self.max_attempts} attempts")
+
+
+# True if a request failed before a connection was made, so nothing can have reached Slack. requests raises
+# ConnectionError for a connection dropped after the request went out too, so it's only that if urllib3 couldn't connect
+def was_never_sent( e ):
+	if isinstance(e, requests.exceptions.ConnectTimeout):
+		return( True )
+	if not isinstance(e, requests.exceptions.ConnectionError) or not e.args:
+		return( False )
+	reason = e.args[0]
+	if isinstance(reason, urllib3.exceptions.MaxRetryError):
+		reason = reason.reason
+	return( isinstance(reason, urllib3.exceptions.NewConnectionError) )
+
+
+# Stands in for SlackOutbox in a replay (see NodeWatcher.replay() in app.py). Jobs run right away on the caller's thread,
+# and rather than going to Slack every call is written to `output` as a line of JSON, stamped with the replay's
+# clock - `clock` returns the current (virtual) time in ms. Threads and alert messages get made-up timestamps
+class ReplayOutbox(SlackOutbox):
+
+	def __init__(self, output, clock, channel, escalation_channel, thread_URI_prefix, threads, alert_messages, log):
+		super().__init__(None, channel, escalation_channel, thread_URI_prefix, threads, alert_messages, log)
+		self.output     = output
+		self.clock      = clock
+		self.call_count = 0
+
+	def start(self):
+		pass
+
+	def enqueue(self, job, coalesce_key=None):
+		try:
+			getattr(self, "send_" + job["kind"])(job)
+		except Exception as e:
+			self.log.error(f"Replay outbox dropped a {job['kind']} job: {job}", exc_info=e)
+
+	def call(self, method, payload):
+		self.call_count += 1
+		timestamp_ms = self.clock()
+		self.output.write(json.dumps({"timestamp_ms": timestamp_ms, "method": method, **payload}) + "\n")
+		ts = f"{timestamp_ms // 1000}.{self.call_count:06d}"
+		return( {"ok": True, "ts": ts, "channel": payload.get("channel"), "message": {"ts": ts, "thread_ts": payload.get("thread_ts", ts)}} )
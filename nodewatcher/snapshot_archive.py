@@ -0,0 +1,219 @@
+import mmap, os, socket, struct, sys, threading, zlib
+import datetime as dt
+from array import array
+from itertools import accumulate
+
+
+# A local copy of every LSDB snapshot's router set, so replays, debugging and catching up don't depend on the BIRD
+# history API still having that minute. There's one file per UTC day: an index with an entry for each minute of the
+# day, followed by the snapshots in whatever order they got stored. Router IDs are stored as sorted uint32s, with
+# only the gaps between them written out, and zlib'd. Every so often a snapshot is stored whole (a keyframe), and
+# in between only what was added and removed since the snapshot before it, so a day of a big mesh is a few MB.
+# Reads go through an mmap of the day file, and rebuild a minute from its keyframe and the deltas after it
+
+
+MAGIC = b"NWA1"
+MINUTES_PER_DAY = 1440
+# offset of the snapshot in the file (0 if the minute isn't stored), its length, and the minute of the day it's a delta
+# against (-1 for a keyframe)
+INDEX_ENTRY = struct.Struct("<IIh")
+HEADER_SIZE = len(MAGIC) + INDEX_ENTRY.size * MINUTES_PER_DAY
+
+
+# dotted quads <-> uint32s, a whole snapshot at a time through one big-endian buffer
+def router_ids_to_ints(router_ids):
+	values = array('I', b"".join(map(socket.inet_aton, router_ids)))
+	if sys.byteorder == "little":
+		values.byteswap()
+	return( values )
+
+
+def ints_to_router_ids(values):
+	values = array('I', values)
+	if sys.byteorder == "little":
+		values.byteswap()
+	data = values.tobytes()
+	return( list(map(socket.inet_ntoa, [data[i:i + 4] for i in range(0, len(data), 4)])) )
+
+
+# sorted values -> little-endian uint32 gaps between them, the first one as-is
+def pack_gaps(values):
+	gaps = array('I', sorted(values))
+	for i in range(len(gaps) - 1, 0, -1):
+		gaps[i] -= gaps[i - 1]
+	if sys.byteorder == "big":
+		gaps.byteswap()
+	return( gaps.tobytes() )
+
+
+def unpack_gaps(data):
+	gaps = array('I')
+	gaps.frombytes(data)
+	if sys.byteorder == "big":
+		gaps.byteswap()
+	return( accumulate(gaps) )
+
+
+class SnapshotArchive:
+
+	def __init__(self, directory, keyframe_minutes=60, keep_days=None, open_day_qty=3):
+		self.directory        = directory
+		self.keyframe_minutes = keyframe_minutes # most deltas between keyframes, i.e. the most that get applied for one read
+		self.keep_days        = keep_days        # day files older than this get deleted, None keeps everything
+		self.open_day_qty     = open_day_qty     # day files kept open (and mapped) at once
+		self.lock             = threading.Lock() # snapshots get stored and read from several fetcher threads at once
+		self.days             = {}               # "YYYY-MM-DD" -> {"fd": <fd>, "mmap": <mmap or None>}
+		self.last_stored      = None             # (day, minute of day, set of ints) so a delta doesn't have to read back its base
+		os.makedirs(directory, exist_ok=True)
+
+	def get_path(self, day):
+		return( os.path.join(self.directory, day + ".lsdb") )
+
+	# `minute` is a UTC datetime, like the poller's snapshot minutes
+	def has(self, minute):
+		day, minute_of_day = self.split(minute)
+		with self.lock:
+			day_file = self.open_day(day)
+			return( day_file is not None and self.read_entry(day_file, minute_of_day)[0] != 0 )
+
+	# the router IDs stored for `minute`, sorted, or None if that minute isn't in the archive
+	def get(self, minute):
+		day, minute_of_day = self.split(minute)
+		with self.lock:
+			day_file = self.open_day(day)
+			if day_file is None:
+				return( None )
+			values = self.rebuild(day_file, minute_of_day)
+		if values is None:
+			return( None )
+		return( ints_to_router_ids(sorted(values)) )
+
+	# stores `minute`'s router IDs, unless that minute is already stored. Returns the number of bytes written
+	def put(self, minute, router_ids):
+		day, minute_of_day = self.split(minute)
+		values = set(router_ids_to_ints(router_ids))
+		with self.lock:
+			day_file = self.open_day(day, True)
+			if self.read_entry(day_file, minute_of_day)[0] != 0:
+				return( 0 )
+
+			# deltas go against the closest stored minute before this one, until there'd be too many to apply in a row
+			base = None
+			for previous_minute in range(minute_of_day - 1, -1, -1):
+				if self.read_entry(day_file, previous_minute)[0] != 0:
+					base = previous_minute
+					break
+			if base is not None and self.get_chain_length(day_file, base) >= self.keyframe_minutes:
+				base = None
+
+			if base is None:
+				payload = zlib.compress(pack_gaps(values))
+			else:
+				if self.last_stored is not None and self.last_stored[:2] == (day, base):
+					base_values = self.last_stored[2]
+				else:
+					base_values = self.rebuild(day_file, base)
+				added = values - base_values
+				removed = base_values - values
+				payload = zlib.compress(struct.pack("<I", len(added)) + pack_gaps(added) + pack_gaps(removed))
+
+			# the snapshot goes in before the index entry that points at it, so a crash in between just loses the minute
+			offset = os.fstat(day_file["fd"]).st_size
+			os.pwrite(day_file["fd"], payload, offset)
+			os.pwrite(day_file["fd"], INDEX_ENTRY.pack(offset, len(payload), -1 if base is None else base),
+			          len(MAGIC) + INDEX_ENTRY.size * minute_of_day)
+			self.last_stored = (day, minute_of_day, values)
+			return( len(payload) )
+
+	def close(self):
+		with self.lock:
+			for day in list(self.days):
+				self.close_day(day)
+
+
+	####  INTERNALS - callers hold self.lock  ####
+
+	def split(self, minute):
+		minute = minute.astimezone(dt.timezone.utc)
+		return( minute.strftime("%Y-%m-%d"), minute.hour * 60 + minute.minute )
+
+	def open_day(self, day, create=False):
+		day_file = self.days.get(day)
+		if day_file is not None:
+			return( day_file )
+
+		path = self.get_path(day)
+		if not os.path.exists(path):
+			if not create:
+				return( None )
+			with open(path, "wb") as new_file:
+				new_file.write(MAGIC + bytes(INDEX_ENTRY.size * MINUTES_PER_DAY))
+			self.prune(day)
+
+		fd = os.open(path, os.O_RDWR)
+		if os.pread(fd, len(MAGIC), 0) != MAGIC:
+			os.close(fd)
+			raise ValueError(f"{path} isn't a snapshot archive file")
+		day_file = self.days[day] = {"fd": fd, "mmap": None}
+		while len(self.days) > self.open_day_qty:
+			self.close_day(next(iter(self.days)))
+		return( day_file )
+
+	def close_day(self, day):
+		day_file = self.days.pop(day)
+		if day_file["mmap"] is not None:
+			day_file["mmap"].close()
+		os.close(day_file["fd"])
+
+	# the day file's mmap, remapped if the file has grown past it since
+	def get_view(self, day_file, end):
+		view = day_file["mmap"]
+		if view is None or len(view) < end:
+			if view is not None:
+				view.close()
+			view = day_file["mmap"] = mmap.mmap(day_file["fd"], 0, access=mmap.ACCESS_READ)
+		return( view )
+
+	def read_entry(self, day_file, minute_of_day):
+		position = len(MAGIC) + INDEX_ENTRY.size * minute_of_day
+		return( INDEX_ENTRY.unpack_from(self.get_view(day_file, HEADER_SIZE), position) )
+
+	def get_chain_length(self, day_file, minute_of_day):
+		length = 0
+		base = self.read_entry(day_file, minute_of_day)[2]
+		while base != -1:
+			length += 1
+			base = self.read_entry(day_file, base)[2]
+		return( length )
+
+	# set of ints for a stored minute: its keyframe, with each delta from there on applied in turn
+	def rebuild(self, day_file, minute_of_day):
+		chain = []
+		while minute_of_day != -1:
+			offset, length, base = self.read_entry(day_file, minute_of_day)
+			if offset == 0:
+				return( None )
+			chain.append((offset, length))
+			minute_of_day = base
+
+		offset, length = chain.pop()
+		view = self.get_view(day_file, offset + length)
+		values = set(unpack_gaps(zlib.decompress(view[offset:offset + length])))
+		for offset, length in reversed(chain):
+			view = self.get_view(day_file, offset + length)
+			data = zlib.decompress(view[offset:offset + length])
+			added_qty = struct.unpack_from("<I", data)[0]
+			split_at = 4 + 4 * added_qty
+			values.update(unpack_gaps(data[4:split_at]))
+			values.difference_update(unpack_gaps(data[split_at:]))
+		return( values )
+
+	# deletes day files older than keep_days before `today`, when a new day's file gets started
+	def prune(self, today):
+		if self.keep_days is None:
+			return
+		cutoff = (dt.date.fromisoformat(today) - dt.timedelta(days=self.keep_days)).isoformat()
+		for file_name in os.listdir(self.directory):
+			day, extension = os.path.splitext(file_name)
+			if extension == ".lsdb" and day < cutoff and day not in self.days:
+				os.remove(os.path.join(self.directory, file_name))
@@ -0,0 +1,336 @@
+import sqlite3, time
+from .trackers import FlappyNode, RemovedNode
+
+
+# Everything that goes in node-watcher.db. Only ever used from the main loop's thread - the Slack outbox hands what it
+# created back through take_results() so it can be written down here
+
+
+class Storage:
+
+	def __init__(self, config, log):
+		self.config = config
+		self.log    = log
+
+		self.conn = sqlite3.connect( config.node_watcher_db )
+		self.db_conn = self.conn.cursor()
+
+		db_conn = self.db_conn
+		for pragma, value in config.sqlite_pragmas.items():
+			db_conn.execute(f'PRAGMA {pragma} = {value}')
+		db_conn.execute('CREATE TABLE IF NOT EXISTS slack_threads(node_ip TEXT, thread_ts TEXT)')
+		db_conn.execute('CREATE TABLE IF NOT EXISTS alert_messages(node_ip TEXT, thread_ts TEXT)')
+		for table in ["slack_threads", "alert_messages"]:
+			self.make_node_ip_unique( table )
+		db_conn.execute('CREATE TABLE IF NOT EXISTS subscriptions(node_ip TEXT, user_id TEXT, PRIMARY KEY (node_ip, user_id)) WITHOUT ROWID')
+		self.migrate_subscriptions()
+		db_conn.execute('CREATE TABLE IF NOT EXISTS node_state_changes(timestamp_ms INTEGER, router_id TEXT, state TEXT)')
+		db_conn.execute('CREATE INDEX IF NOT EXISTS node_state_changes_index ON node_state_changes(timestamp_ms)')
+		db_conn.execute('CREATE INDEX IF NOT EXISTS node_state_changes_router_index ON node_state_changes(router_id, timestamp_ms)')
+		db_conn.execute('CREATE TABLE IF NOT EXISTS node_state_changes_daily(day TEXT, router_id TEXT, state TEXT, qty INTEGER, PRIMARY KEY (day, router_id, state)) WITHOUT ROWID')
+		db_conn.execute('CREATE TABLE IF NOT EXISTS persistence(variable_name TEXT PRIMARY KEY, value TEXT)')
+		db_conn.execute('CREATE TABLE IF NOT EXISTS removed_nodes(router_id TEXT PRIMARY KEY, timestamp_ms INTEGER NOT NULL, alerting INTEGER NOT NULL, hub_down_group INTEGER, state TEXT)')
+		# rows from before there were states (see trackers.py) have none, and get one from alerting and hub_down_group
+		if "state" not in [row[1] for row in db_conn.execute('PRAGMA table_info(removed_nodes)').fetchall()]:
+			db_conn.execute('ALTER TABLE removed_nodes ADD COLUMN state TEXT')
+		db_conn.execute('CREATE TABLE IF NOT EXISTS flappy_nodes(router_id TEXT PRIMARY KEY, timestamp_ms INTEGER NOT NULL, alerting INTEGER NOT NULL)')
+		db_conn.execute('CREATE TABLE IF NOT EXISTS hub_down_events(hub_down_group INTEGER PRIMARY KEY, alerting INTEGER NOT NULL)')
+		db_conn.execute('CREATE TABLE IF NOT EXISTS silences(router_id TEXT PRIMARY KEY, kind TEXT NOT NULL, expires_s REAL)')
+		db_conn.execute('CREATE TABLE IF NOT EXISTS flap_counters(router_id TEXT PRIMARY KEY, timestamps BLOB)')
+		db_conn.execute('CREATE TABLE IF NOT EXISTS lsdb_snapshot(router_id TEXT PRIMARY KEY) WITHOUT ROWID')
+		self.conn.commit()
+
+		# Write-through copies of slack_threads and alert_messages, so finding a node's messages never touches the db -
+		# they only change through apply_slack_outbox_results().
+		# structure: {<node or hub down group, as str>: <ts>}
+		self.slack_threads  = dict(db_conn.execute('SELECT node_ip, thread_ts FROM slack_threads').fetchall())
+		self.alert_messages = dict(db_conn.execute('SELECT node_ip, thread_ts FROM alert_messages').fetchall())
+		self.message_keys   = {} # ts of every thread parent and alert message -> its node or hub down group
+		for messages in [self.slack_threads, self.alert_messages]:
+			for key, ts in messages.items():
+				self.message_keys[ts] = key
+
+		# when run_maintenance() last ran, and last vacuumed (ms, by the snapshots' clock)
+		self.maintained_ms = int(self.load_variable("db_maintained_ms") or 0)
+		self.vacuumed_ms   = int(self.load_variable("db_vacuumed_ms") or 0)
+
+		# which snapshot's router IDs are in lsdb_snapshot, see save_lsdb_snapshot()
+		self.lsdb_snapshot_suffix = self.load_variable("lsdb_snapshot_suffix")
+
+		# who's subscribed to which nodes (see Reactions.get_subscribed_users()), also written through
+		# structure: {<router_id>: {<user_id>, ...}}
+		self.subscriptions = {}
+		for router_id, user_id in db_conn.execute('SELECT node_ip, user_id FROM subscriptions').fetchall():
+			self.subscriptions.setdefault(router_id, set()).add(user_id)
+
+	# there used to be nothing stopping a node from having two threads (or alert messages), in which case whichever
+	# row the db came up with got used. the oldest is kept, which is what that usually was
+	def make_node_ip_unique(self, table):
+		db_conn = self.db_conn
+		if db_conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (table + "_node_ip", )).fetchall():
+			return
+		db_conn.execute(f'DELETE FROM {table} WHERE rowid NOT IN (SELECT MIN(rowid) FROM {table} GROUP BY node_ip)')
+		if db_conn.rowcount > 0:
+			self.log.warning(f"removed {db_conn.rowcount} duplicate rows from {table}")
+		db_conn.execute(f'DROP INDEX IF EXISTS {table}_index')
+		db_conn.execute(f'CREATE UNIQUE INDEX {table}_node_ip ON {table}(node_ip)')
+
+	# subscriptions used to be one row per node, with its subscribers in a JSON array
+	def migrate_subscriptions(self):
+		db_conn = self.db_conn
+		columns = [row[1] for row in db_conn.execute('PRAGMA table_info(subscriptions)').fetchall()]
+		if "subscribers" not in columns:
+			return
+		db_conn.execute('ALTER TABLE subscriptions RENAME TO subscriptions_json')
+		db_conn.execute('CREATE TABLE subscriptions(node_ip TEXT, user_id TEXT, PRIMARY KEY (node_ip, user_id)) WITHOUT ROWID')
+		db_conn.execute('INSERT or IGNORE into subscriptions(node_ip, user_id) SELECT node_ip, value FROM subscriptions_json, json_each(subscribers)')
+		db_conn.execute('DROP TABLE subscriptions_json')
+		self.log.info("moved subscriptions out of JSON arrays into one row per subscriber")
+
+	def commit(self):
+		self.conn.commit()
+
+
+	####  MAINTENANCE  ####
+
+	# by the snapshots' clock, like everything else. a brand-new db is due on its first check, after a restart it carries on
+	# from db_maintained_ms
+	def maintenance_due(self, now_ms):
+		return( now_ms - self.maintained_ms >= self.config.db_maintenance_interval_hrs * 3600000 )
+
+	# Raw node_state_changes older than node_state_changes_keep_days (but never inside the flap window, which a flap
+	# counter rebuild reads) are rolled up into per-node, per-day counts a whole UTC day at a time. Then the query
+	# planner's statistics get refreshed, and every db_vacuum_interval_days the file gets compacted
+	def run_maintenance(self, now_ms):
+		config = self.config
+		db_conn = self.db_conn
+		started_s = time.time()
+		self.conn.commit()
+
+		rolled_up_qty = 0
+		if config.node_state_changes_keep_days is not None:
+			keep_ms = max(config.node_state_changes_keep_days * 86400000, config.flap_time_window_hrs * 3600000)
+			cutoff_ms = (now_ms - keep_ms) // 86400000 * 86400000
+			query = """INSERT into node_state_changes_daily(day, router_id, state, qty)
+			           SELECT date(timestamp_ms / 1000, 'unixepoch') AS day, router_id, state, COUNT(*) FROM node_state_changes
+			           WHERE timestamp_ms < ? GROUP BY day, router_id, state
+			           ON CONFLICT(day, router_id, state) DO UPDATE SET qty = qty + excluded.qty"""
+			db_conn.execute(query, (cutoff_ms, ))
+			db_conn.execute('DELETE FROM node_state_changes WHERE timestamp_ms < ?', (cutoff_ms, ))
+			rolled_up_qty = db_conn.rowcount
+		db_conn.execute('ANALYZE')
+		self.maintained_ms = now_ms
+		self.save_variable("db_maintained_ms", now_ms)
+		self.conn.commit()
+
+		vacuumed = False
+		if config.db_vacuum_interval_days is not None and now_ms - self.vacuumed_ms >= config.db_vacuum_interval_days * 86400000:
+			db_conn.execute('VACUUM')
+			self.vacuumed_ms = now_ms
+			self.save_variable("db_vacuumed_ms", now_ms)
+			self.conn.commit()
+			vacuumed = True
+
+		self.log.info(f"db maintenance: {rolled_up_qty} node state changes rolled up into daily counts{', vacuumed' if vacuumed else ''}, took {time.time() - started_s:.1f}s")
+
+	# the ts of a node's (or hub down group's) thread parent and alert message, whichever it has
+	def get_message_ts(self, key):
+		key = str(key)
+		return( [messages[key] for messages in [self.slack_threads, self.alert_messages] if key in messages] )
+
+
+	####  PERSISTENCE - app state, one row per variable  ####
+
+	# the saved value as it was saved (most are JSON), or None if there isn't one
+	def load_variable(self, variable_name):
+		query = 'SELECT value FROM persistence WHERE variable_name = ?'
+		row = self.db_conn.execute(query, (variable_name, ))
+		row = row.fetchall()
+		if row:
+			return( row[0][0] )
+		return( None )
+
+	def save_variable(self, variable_name, value):
+		# ('CREATE TABLE IF NOT EXISTS persistence(variable_name TEXT, value TEXT)')
+		query = 'INSERT or REPLACE into persistence(variable_name, value) VALUES(?,?)'
+		self.db_conn.execute(query, (variable_name, value,))
+
+	def delete_variable(self, variable_name):
+		self.db_conn.execute('DELETE FROM persistence WHERE variable_name = ?', (variable_name, ))
+
+
+	####  PERSISTENCE - the trackers, one row per entry  ####
+
+	# the engine's trackers and the silence cache, as they were saved. see Engine and Reactions for what's in them
+	def load_trackers(self):
+		db_conn = self.db_conn
+		removed_nodes_tracker = {}
+		for router_id, timestamp_ms, alerting, hub_down_group, state in db_conn.execute('SELECT router_id, timestamp_ms, alerting, hub_down_group, state FROM removed_nodes'):
+			entry = {"timestamp": timestamp_ms, "alerting": bool(alerting)}
+			if state is not None:
+				entry["state"] = state
+			if hub_down_group is not None:
+				entry["hub_down_group"] = hub_down_group
+			removed_nodes_tracker[router_id] = RemovedNode.from_dict( entry )
+		flappy_nodes_tracker = {}
+		for router_id, timestamp_ms in db_conn.execute('SELECT router_id, timestamp_ms FROM flappy_nodes'):
+			flappy_nodes_tracker[router_id] = FlappyNode.from_dict({"timestamp": timestamp_ms})
+		hub_down_tracker = {}
+		for hub_down_group, alerting in db_conn.execute('SELECT hub_down_group, alerting FROM hub_down_events'):
+			hub_down_tracker[hub_down_group] = {"alerting": bool(alerting)}
+		silence_cache = {}
+		for router_id, kind, expires_s in db_conn.execute('SELECT router_id, kind, expires_s FROM silences'):
+			silence_cache[router_id] = {"kind": kind, "expires_s": expires_s}
+		return( {
+			"removed_nodes_tracker": removed_nodes_tracker,
+			"flappy_nodes_tracker":  flappy_nodes_tracker,
+			"hub_down_tracker":      hub_down_tracker,
+			"silence_cache":         silence_cache,
+		} )
+
+	# `changes` is [(tracker, key, entry or None if it's gone), ...] as from NodeWatcher.take_tracker_changes(), so
+	# only what changed this cycle gets written
+	def save_tracker_changes(self, changes):
+		rows = {tracker_name: ([], []) for tracker_name in tracker_queries} # tracker -> (rows to write, keys to delete)
+		for tracker_name, key, entry in changes:
+			saved, deleted = rows[tracker_name]
+			if entry is None:
+				deleted.append((key, ))
+			elif tracker_name == "removed_nodes_tracker":
+				row = entry.to_dict()
+				saved.append((key, row["timestamp"], entry.alerting, row.get("hub_down_group"), row["state"]))
+			elif tracker_name == "flappy_nodes_tracker":
+				saved.append((key, entry.to_dict()["timestamp"], entry.alerting))
+			elif tracker_name == "hub_down_tracker":
+				saved.append((key, entry["alerting"]))
+			elif tracker_name == "silence_cache":
+				saved.append((key, entry["kind"], entry["expires_s"]))
+		for tracker_name, (saved, deleted) in rows.items():
+			save_query, delete_query = tracker_queries[tracker_name]
+			if saved:
+				self.db_conn.executemany(save_query, saved)
+			if deleted:
+				self.db_conn.executemany(delete_query, deleted)
+
+
+	####  PERSISTENCE - the newest LSDB snapshot, one row per router  ####
+
+	# (suffix, router IDs) of the snapshot last saved, or None
+	def load_lsdb_snapshot(self):
+		if self.lsdb_snapshot_suffix is None:
+			return( None )
+		router_ids = [router_id for router_id, in self.db_conn.execute('SELECT router_id FROM lsdb_snapshot')]
+		return( self.lsdb_snapshot_suffix, router_ids )
+
+	# The router IDs of `snapshot` (a bird.make_snapshot_item()), so after a restart the next snapshot can be diffed
+	# against it without downloading it again. When the one saved last was its previous snapshot, only the routers that
+	# were added or removed get written. Otherwise they're written from `router_ids` - if that's None (it's no longer
+	# in the snapshot cache), nothing's saved and a restart downloads it
+	def save_lsdb_snapshot(self, snapshot, router_ids=None):
+		db_conn = self.db_conn
+		if self.lsdb_snapshot_suffix == snapshot["suffix"]:
+			return
+		if self.lsdb_snapshot_suffix is not None and self.lsdb_snapshot_suffix == snapshot["previous_suffix"]:
+			db_conn.executemany('INSERT or IGNORE into lsdb_snapshot(router_id) VALUES(?)', [(router_id, ) for router_id in snapshot["added"]])
+			db_conn.executemany('DELETE FROM lsdb_snapshot WHERE router_id = ?', [(router_id, ) for router_id in snapshot["removed"]])
+		else:
+			db_conn.execute('DELETE FROM lsdb_snapshot')
+			if router_ids is None:
+				self.lsdb_snapshot_suffix = None
+				self.delete_variable("lsdb_snapshot_suffix")
+				return
+			db_conn.executemany('INSERT or IGNORE into lsdb_snapshot(router_id) VALUES(?)', [(router_id, ) for router_id in router_ids])
+		self.lsdb_snapshot_suffix = snapshot["suffix"]
+		self.save_variable("lsdb_snapshot_suffix", snapshot["suffix"])
+
+
+	####  SUBSCRIPTIONS  ####
+
+	def get_subscribers(self, router_id):
+		return( self.subscriptions.get(router_id, set()) )
+
+	def add_subscribers(self, router_id, user_ids):
+		subscribers = self.subscriptions.setdefault(router_id, set())
+		added = set(user_ids) - subscribers
+		if added:
+			subscribers.update(added)
+			query = 'INSERT or IGNORE into subscriptions(node_ip, user_id) VALUES(?,?)'
+			self.db_conn.executemany(query, [(router_id, user_id) for user_id in added])
+
+	def remove_subscribers(self, router_id, user_ids):
+		subscribers = self.subscriptions.get(router_id, set())
+		removed = subscribers & set(user_ids)
+		if removed:
+			subscribers.difference_update(removed)
+			query = 'DELETE FROM subscriptions WHERE node_ip = ? AND user_id = ?'
+			self.db_conn.executemany(query, [(router_id, user_id) for user_id in removed])
+
+
+	####  NODE STATE CHANGES AND FLAP COUNTERS  ####
+
+	def record_state_changes(self, timestamp_ms, added, removed):
+		query = 'INSERT into node_state_changes(timestamp_ms, router_id, state) VALUES(?,?,?)'
+		rows = [(timestamp_ms, router_id, "up") for router_id in added] + [(timestamp_ms, router_id, "down") for router_id in removed]
+		self.db_conn.executemany(query, rows)
+
+	# Flap counts live in memory and each cycle's changed routers get written to flap_counters, so a restart can pick
+	# them straight back up. If there's no snapshot yet, or it was taken with a different flap window, it gets rebuilt
+	# with one pass over node_state_changes
+	def load_flap_counter(self, flap_counter):
+		db_conn = self.db_conn
+		window_ms = self.load_variable("flap_counters_window_ms")
+		if window_ms is not None and int(window_ms) == flap_counter.window_ms:
+			for router_id, timestamps in db_conn.execute('SELECT router_id, timestamps FROM flap_counters').fetchall():
+				flap_counter.load(router_id, timestamps)
+		else:
+			self.log.info("rebuilding flap counters from node_state_changes")
+			beginning_of_window = int( time.time() * 1000 ) - int( self.config.time_rollback_s * 1000 ) - flap_counter.window_ms
+			query = 'SELECT router_id, timestamp_ms FROM node_state_changes WHERE timestamp_ms >= ? ORDER BY timestamp_ms'
+			for router_id, timestamp_ms in db_conn.execute(query, (beginning_of_window, )).fetchall():
+				flap_counter.record(router_id, timestamp_ms)
+			db_conn.execute('DELETE FROM flap_counters')
+			self.save_flap_counter( flap_counter )
+			self.save_variable("flap_counters_window_ms", flap_counter.window_ms)
+			self.conn.commit()
+
+		self.log.info(f"flap counters loaded for {len(flap_counter.rings)} routers")
+
+	# only the routers whose flap counts changed since last time
+	def save_flap_counter(self, flap_counter):
+		dirty_rings = flap_counter.take_dirty()
+		query = 'INSERT or REPLACE into flap_counters(router_id, timestamps) VALUES(?,?)'
+		self.db_conn.executemany(query, [(router_id, ring.to_bytes()) for router_id, ring in dirty_rings.items() if ring is not None])
+		query = 'DELETE FROM flap_counters WHERE router_id = ?'
+		self.db_conn.executemany(query, [(router_id, ) for router_id, ring in dirty_rings.items() if ring is None])
+
+
+	####  SLACK  ####
+
+	# writes down the threads and alert messages the Slack outbox has created or deleted, from its take_results()
+	def apply_slack_outbox_results(self, results):
+		for table, key, ts in results:
+			messages = self.slack_threads if table == "slack_threads" else self.alert_messages
+			old_ts = messages.pop(key, None)
+			if old_ts is not None:
+				self.message_keys.pop(old_ts, None)
+			if ts is None:
+				query = f'DELETE FROM {table} WHERE node_ip = ?'
+				self.db_conn.execute(query, (key, ))
+			else:
+				query = f'INSERT or REPLACE into {table}(node_ip, thread_ts) VALUES(?,?)'
+				self.db_conn.execute(query, (key, ts, ))
+				messages[key] = ts
+				self.message_keys[ts] = key
+
+
+# tracker -> (query that writes an entry, query that deletes one)
+tracker_queries = {
+	"removed_nodes_tracker": ('INSERT or REPLACE into removed_nodes(router_id, timestamp_ms, alerting, hub_down_group, state) VALUES(?,?,?,?,?)',
+	                          'DELETE FROM removed_nodes WHERE router_id = ?'),
+	"flappy_nodes_tracker":  ('INSERT or REPLACE into flappy_nodes(router_id, timestamp_ms, alerting) VALUES(?,?,?)',
+	                          'DELETE FROM flappy_nodes WHERE router_id = ?'),
+	"hub_down_tracker":      ('INSERT or REPLACE into hub_down_events(hub_down_group, alerting) VALUES(?,?)',
+	                          'DELETE FROM hub_down_events WHERE hub_down_group = ?'),
+	"silence_cache":         ('INSERT or REPLACE into silences(router_id, kind, expires_s) VALUES(?,?,?)',
+	                          'DELETE FROM silences WHERE router_id = ?'),
+}
@@ -0,0 +1,84 @@
+import heapq
+
+
+# A graph of the mesh as seen in one LSDB snapshot, so a down router's way out to the internet can be worked out
+# locally instead of asking Node Explorer.
+# structure: {"adjacency": {<router_id>: {<neighbor_id>: <OSPF cost>}}, "egress": {<router_id>, ...}, "next_hop": None}
+# "next_hop" gets filled in the first time an exit path is asked for
+
+
+def add_link( neighbors, neighbor_id, cost ):
+	if neighbor_id not in neighbors or cost < neighbors[neighbor_id]:
+		neighbors[neighbor_id] = cost
+
+
+# `members` are (path, key, value) as yielded by lsdb_parser.iter_object_members(..., decode_values=True) over an
+# area's "routers" and "networks". Routers on a transit network get a link to every other router on it, at the cost
+# of their own link to the network. Anything advertising `egress_prefix` as an external route is an egress
+def build_topology_graph( members, egress_prefix="0.0.0.0/0" ):
+	adjacency     = {}
+	egress        = set()
+	network_links = {}
+	networks      = {}
+
+	for path, key, value in members:
+		if path[-1] == "routers":
+			links = value.get("links", {})
+			neighbors = adjacency.setdefault(key, {})
+			for link in links.get("router", []):
+				add_link( neighbors, link["id"], link.get("metric", 0) )
+			for link in links.get("network", []):
+				network_links.setdefault(key, []).append((link["id"], link.get("metric", 0)))
+			for link in links.get("external", []):
+				if link.get("id") == egress_prefix:
+					egress.add(key)
+		elif path[-1] == "networks":
+			networks[key] = value.get("routers", [])
+
+	for router_id, links in network_links.items():
+		for network_id, cost in links:
+			for neighbor_id in networks.get(network_id, []):
+				if neighbor_id != router_id:
+					add_link( adjacency[router_id], neighbor_id, cost )
+
+	return( {"adjacency": adjacency, "egress": egress, "next_hop": None} )
+
+
+# One Dijkstra outwards from every egress at once, over the links reversed, gives every router its cheapest way out.
+# Like OSPF, the cost from a router to its neighbor is what that router advertises for the link
+def compute_next_hops( graph ):
+	reverse = {}
+	for router_id, neighbors in graph["adjacency"].items():
+		for neighbor_id, cost in neighbors.items():
+			reverse.setdefault(neighbor_id, []).append((router_id, cost))
+
+	# egresses have no next hop, but are pushed with "" rather than None - a cost and router ID can both tie (an egress
+	# with a 0 cost link to another, say), and then the hops get compared
+	next_hop = {}
+	heap = [(0, router_id, "") for router_id in sorted(graph["egress"])]
+	while heap:
+		cost, router_id, hop = heapq.heappop(heap)
+		if router_id in next_hop:
+			continue
+		next_hop[router_id] = hop or None
+		for upstream_id, link_cost in reverse.get(router_id, []):
+			if upstream_id not in next_hop:
+				heapq.heappush(heap, (cost + link_cost, upstream_id, router_id))
+
+	graph["next_hop"] = next_hop
+	return( next_hop )
+
+
+# The routers between `router_id` and its egress, closest first and ending with the egress itself -
+# the same shape as Node Explorer's exit paths. Empty if the router is an egress or has no way out
+def get_exit_path( graph, router_id ):
+	next_hop = graph["next_hop"]
+	if next_hop is None:
+		next_hop = compute_next_hops( graph )
+
+	exit_path = []
+	hop = next_hop.get(router_id)
+	while hop is not None:
+		exit_path.append(hop)
+		hop = next_hop[hop]
+	return( exit_path )
@@ -0,0 +1,94 @@
+import enum
+
+
+# What the engine keeps about each node in removed_nodes_tracker and flappy_nodes_tracker. A big mesh can have thousands
+# of nodes coming and going, so they're slotted records rather than a dict apiece, with the node's state spelled out.
+# to_dict() is what they look like in the log and the db, and from_dict() reads that back (or the dicts they used to be saved as)
+
+
+class NodeState(enum.Enum):
+	PENDING     = "pending"     # down, but not for long enough to alert on yet - or it's silenced
+	HUB_GROUPED = "hub_grouped" # went down with enough others to maybe be a hub outage, waiting on hub_down_alert_time_ms to tell
+	ALERTING    = "alerting"    # alerted on, on its own or as part of a hub outage if it still has a hub_down_group
+
+
+class RemovedNode:
+
+	__slots__ = ("timestamp_ms", "state", "hub_down_group", "seq")
+
+	def __init__(self, timestamp_ms, state=NodeState.PENDING, hub_down_group=None):
+		self.timestamp_ms   = timestamp_ms   # when it went down
+		self.state          = state
+		self.hub_down_group = hub_down_group # ms the group went down, if it's in one
+		self.seq            = 0              # the order nodes were added to the tracker in, see Engine.add_removed_node()
+
+	@property
+	def alerting(self):
+		return( self.state is NodeState.ALERTING )
+
+	def copy(self):
+		record = RemovedNode(self.timestamp_ms, self.state, self.hub_down_group)
+		record.seq = self.seq
+		return( record )
+
+	# seq is the engine's business, not part of what's saved
+	def __eq__(self, other):
+		if not isinstance(other, RemovedNode):
+			return NotImplemented
+		return( self.timestamp_ms == other.timestamp_ms and self.state is other.state and self.hub_down_group == other.hub_down_group )
+
+	def __repr__(self):
+		return( repr(self.to_dict()) )
+
+	def to_dict(self):
+		entry = {"timestamp": self.timestamp_ms, "state": self.state.value}
+		if self.hub_down_group is not None:
+			entry["hub_down_group"] = self.hub_down_group
+		return( entry )
+
+	# what to_dict() gives, or what was saved before there were states:
+	# {"timestamp": <ms>, "alerting": <bool>, "hub_down_group": <ms, if it's in one>}
+	@classmethod
+	def from_dict(cls, entry):
+		hub_down_group = entry.get("hub_down_group")
+		if "state" in entry:
+			state = NodeState(entry["state"])
+		elif entry["alerting"]:
+			state = NodeState.ALERTING
+		elif hub_down_group is not None:
+			state = NodeState.HUB_GROUPED
+		else:
+			state = NodeState.PENDING
+		return( cls(entry["timestamp"], state, hub_down_group) )
+
+
+# nodes only go in flappy_nodes_tracker once they've been alerted on as flappy
+class FlappyNode:
+
+	__slots__ = ("timestamp_ms", )
+
+	def __init__(self, timestamp_ms):
+		self.timestamp_ms = timestamp_ms
+
+	@property
+	def alerting(self):
+		return True
+
+	def copy(self):
+		return( FlappyNode(self.timestamp_ms) )
+
+	def __eq__(self, other):
+		if not isinstance(other, FlappyNode):
+			return NotImplemented
+		return( self.timestamp_ms == other.timestamp_ms )
+
+	def __repr__(self):
+		return( repr(self.to_dict()) )
+
+	def to_dict(self):
+		return( {"timestamp": self.timestamp_ms} )
+
+	# what to_dict() gives, or {"timestamp": <ms>, "alerting": True} from before
+	@classmethod
+	def from_dict(cls, entry):
+		return( cls(entry["timestamp"]) )
@@ -0,0 +1,119 @@
+import logging, threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from .http_sessions import make_session
+
+
+Node_Explorer_API_prefix = "https://node-explorer.andrew.mesh.nycmesh.net/api/"
+
+# for callers that don't bring their own session (NodeWatcher does), made on first use so importing this doesn't open an HTTP session
+node_explorer_session = None
+node_explorer_session_lock = threading.Lock()
+
+def get_node_explorer_session():
+	global node_explorer_session
+	with node_explorer_session_lock:
+		if node_explorer_session is None:
+			node_explorer_session = make_session()
+		return( node_explorer_session )
+
+
+
+# Gets the most frequent element in a list. If there's a tie, then the
+# element that is earliest will be chosen. Very helpful to find the closest
+# common upstream node, as node-explorer lists them in order of distance.
+# If `weights` is given, each element scores its weight instead of 1.
+def most_frequent_and_closest( node_list, weights=None ):
+	scores = {}
+	for index, node in enumerate(node_list):
+		if weights is None:
+			scores[node] = scores.get(node, 0) + 1
+		else:
+			scores[node] = scores.get(node, 0) + weights[index]
+	if not scores:
+		raise ValueError("no upstream nodes to choose from")
+
+	# dicts keep the order nodes were first seen in, and max() keeps the first of equal scores
+	return( max(scores, key=scores.get) )
+
+
+# Votes across the exit paths of all down nodes (one list of hops per node, closest hop first).
+# With distance_weighted a hop scores 1/(its position in the path), so a router right next to many
+# down nodes beats one that's merely on the way to the internet for all of them
+def vote_closest_common_upstream( exit_paths, distance_weighted=False ):
+	node_list = []
+	weights = []
+	for exit_path in exit_paths:
+		for hop, node in enumerate(exit_path):
+			node_list.append(node)
+			weights.append(1 / (hop + 1))
+	if distance_weighted:
+		return( most_frequent_and_closest( node_list, weights ))
+	return( most_frequent_and_closest( node_list ))
+
+
+
+def get_exit_path_nodes( router_id, timestamp_s, session=None, API_prefix=None, log=None ):
+	session = session or get_node_explorer_session()
+	log = log or logging.getLogger("application_log")
+	Node_Explorer_URI = (API_prefix or Node_Explorer_API_prefix) + "neighbors/" + router_id
+	params = {}
+	params["searchDistance"] = "0"
+	params["includeEgress"] = "true"
+	if timestamp_s:
+		params["timestamp"] = str(timestamp_s)
+	log.info(Node_Explorer_URI)
+	log.debug(f"Node explorer params: {params}")
+	response = session.get(Node_Explorer_URI, params=params)
+	json_data = response.json()
+
+	exit_path_nodes = []
+	for node in json_data["nodes"]:
+		if node["id"] == router_id:
+			for exit_path_node in node["exit_paths"]["outbound"]:
+				exit_path_nodes.append(exit_path_node[0])
+
+			log.debug(f"get_closest_common_upstream: node: {router_id} exit path: {exit_path_nodes}")
+
+	return( exit_path_nodes )
+
+
+# Lookups all go out at once, and whatever has come back by `timeout_s` gets used.
+# Results are put back together in node_list order, since ties in the vote go to whichever came first
+def get_closest_common_upstream( node_list, timestamp_s, distance_weighted=False, session=None, API_prefix=None, timeout_s=None, workers=8, log=None ):
+	session = session or get_node_explorer_session()
+	log = log or logging.getLogger("application_log")
+	executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(node_list))))
+	lookups = {}
+	for router_id in node_list:
+		lookups[router_id] = executor.submit(get_exit_path_nodes, router_id, timestamp_s, session, API_prefix, log)
+	done, not_done = wait(lookups.values(), timeout=timeout_s)
+	# stragglers are left to finish (or hit their own timeout) in the background
+	executor.shutdown(wait=False, cancel_futures=True)
+	if not_done:
+		log.error(f"{len(not_done)} of {len(node_list)} Node Explorer requests didn't finish within {timeout_s} seconds, going with the rest")
+
+	outage_exit_paths = []
+	for router_id, lookup in lookups.items():
+		if lookup in done:
+			try:
+				outage_exit_paths.append(lookup.result())
+			except Exception as e:
+				log.error(f"get_closest_common_upstream: Error with {router_id}: {e}")
+
+	return( vote_closest_common_upstream( outage_exit_paths, distance_weighted ))
+
+
+
+# python3 -m nodewatcher.upstream_guesser
+if __name__ == "__main__":
+
+	node = None
+	down_nodes = []
+	timestamp_s = input("enter unix timestamp in seconds (defaults to now):\n")
+	while node != "":
+		node = input("enter node IP address, <enter> twice to do calculation\n")
+		down_nodes.append(node)
+
+	down_nodes = down_nodes[:-1]
+	print("\ncommon upstream node: " + get_closest_common_upstream( down_nodes, timestamp_s, timeout_s=30 ))
+
@@ -0,0 +1,89 @@
+import random
+from nodewatcher import Engine, make_config
+from nodewatcher.trackers import NodeState, RemovedNode
+
+
+# The engine used to check every node in removed_nodes_tracker each minute. take_overdue() should come up with the
+# same nodes, in the same order, however nodes get added, come back up, leave their hub down group or alert
+
+ALERT_MS = 300000
+HUB_MS   = 180000
+
+
+def make_engine():
+	return( Engine(make_config("dev", {"alert_time_threshold_ms": ALERT_MS, "hub_down_alert_time_ms": HUB_MS, "hub_down_node_qty": 3})) )
+
+
+# what the main loop's scan of the whole tracker picked out
+def scan_overdue( engine, now_ms ):
+	overdue = []
+	for router_id, record in engine.removed_nodes_tracker.items():
+		if record.state is NodeState.PENDING and now_ms - record.timestamp_ms > ALERT_MS:
+			overdue.append(router_id)
+		elif record.state is NodeState.HUB_GROUPED and now_ms - record.timestamp_ms > HUB_MS:
+			overdue.append(router_id)
+	return( overdue )
+
+
+def test_take_overdue_matches_a_full_scan():
+	rng = random.Random(5)
+	engine = make_engine()
+	routers = ["10.69.%d.%d" % (i // 20, i % 20) for i in range(120)]
+	now_ms = 1706659320000
+
+	for minute in range(600):
+		now_ms += 60000
+		tracked = list(engine.removed_nodes_tracker)
+
+		# back up
+		for router_id in rng.sample(tracked, min(len(tracked), rng.randint(0, 3))):
+			engine.pop_removed_node( router_id )
+		# down, on their own or as a group - some of them again, which reschedules them
+		if rng.random() < 0.1:
+			for router_id in rng.sample(routers, 4):
+				engine.add_removed_node( router_id, RemovedNode(now_ms, NodeState.HUB_GROUPED, now_ms) )
+		for router_id in rng.sample(routers, rng.randint(0, 3)):
+			engine.add_removed_node( router_id, RemovedNode(now_ms) )
+		# groups that turned out too small
+		for router_id, record in list(engine.removed_nodes_tracker.items()):
+			if record.state is NodeState.HUB_GROUPED and rng.random() < 0.05:
+				engine.ungroup_removed_node( router_id )
+
+		expected = scan_overdue( engine, now_ms )
+		assert engine.take_overdue( now_ms ) == expected, minute
+
+		# most of them alert, the rest stay overdue like silenced nodes do
+		for router_id in expected:
+			if rng.random() < 0.7:
+				engine.removed_nodes_tracker[router_id].state = NodeState.ALERTING
+
+
+def test_index_removed_nodes_schedules_loaded_nodes():
+	engine = make_engine()
+	now_ms = 1706659320000
+	engine.removed_nodes_tracker.update({
+		"10.69.1.1": RemovedNode(now_ms - ALERT_MS - 60000),
+		"10.69.1.2": RemovedNode(now_ms - HUB_MS - 60000, NodeState.HUB_GROUPED, now_ms - HUB_MS - 60000),
+		"10.69.1.3": RemovedNode(now_ms - ALERT_MS - 60000, NodeState.ALERTING),
+		"10.69.1.4": RemovedNode(now_ms),
+	})
+	engine.index_removed_nodes()
+	assert engine.take_overdue( now_ms ) == ["10.69.1.1", "10.69.1.2"]
+	assert engine.hub_down_members == {now_ms - HUB_MS - 60000: {"10.69.1.2": None}}
+
+
+def test_too_small_hub_group_alerts_node_by_node():
+	engine = make_engine()
+	now_ms = 1706659320000
+	routers = ["10.69.2.1", "10.69.2.2", "10.69.2.3"]
+	events = []
+	for minute in range(8):
+		now_ms += 60000
+		removed = routers if minute == 0 else []
+		added = routers[:1] if minute == 1 else []
+		events += [(minute, event["kind"]) for event in engine.process_snapshot({"suffix": str(minute), "timestamp_ms": now_ms, "added": added, "removed": removed})]
+
+	# the group went down together, but with one back up it's only two by the time it'd have been a hub outage
+	assert [kind for minute, kind in events].count("hub_down") == 0
+	assert events == [(6, "node_down"), (6, "node_down")]
+	assert all(record.state is NodeState.ALERTING and record.hub_down_group is None for record in engine.removed_nodes_tracker.values())
@@ -0,0 +1,66 @@
+import random, sqlite3
+from nodewatcher.flap_counter import FlapCounter, TimestampRing
+
+
+# The flap counter stands in for what used to be asked of node_state_changes every cycle, so it's checked against
+# those same queries, minute by minute, for long enough that the window rolls over a few times
+
+WINDOW_MS = 30 * 60000
+FLAP_QTY  = 4
+
+
+def make_db():
+	db_conn = sqlite3.connect(":memory:")
+	db_conn.execute('CREATE TABLE node_state_changes(timestamp_ms INTEGER, router_id TEXT, state TEXT)')
+	return( db_conn )
+
+
+# get_flappy_nodes() and get_flap_qty() from before there was a flap counter
+def query_flappy_nodes( db_conn, now_ms ):
+	query = '''SELECT router_id FROM node_state_changes WHERE timestamp_ms BETWEEN ? AND ?
+				GROUP BY router_id HAVING COUNT(router_id) >= ?'''
+	return( sorted(row[0] for row in db_conn.execute(query, (now_ms - WINDOW_MS, now_ms, FLAP_QTY))) )
+
+
+def query_flap_qty( db_conn, router_id, now_ms ):
+	query = 'SELECT COUNT(router_id) from node_state_changes WHERE router_id = ? AND timestamp_ms BETWEEN ? AND ?'
+	return( db_conn.execute(query, (router_id, now_ms - WINDOW_MS, now_ms)).fetchone()[0] )
+
+
+def test_matches_the_window_queries():
+	rng = random.Random(9)
+	db_conn = make_db()
+	flap_counter = FlapCounter(WINDOW_MS, FLAP_QTY)
+	routers = ["10.69.0.%d" % i for i in range(40)]
+	now_ms = 1706659320000
+
+	# 4 hours, with bursts of flapping on a few routers and quiet stretches so rings empty out
+	for minute in range(240):
+		now_ms += 60000
+		quiet = (minute // 45) % 2 == 1
+		changed = rng.sample(routers, 0 if quiet else rng.randint(0, 6))
+		if not quiet and minute % 7 == 0:
+			changed += routers[:3]
+		for router_id in set(changed):
+			db_conn.execute('INSERT into node_state_changes VALUES(?,?,?)', (now_ms, router_id, "up"))
+			flap_counter.record(router_id, now_ms)
+
+		assert flap_counter.flappy_nodes(now_ms) == query_flappy_nodes(db_conn, now_ms), minute
+		for router_id in rng.sample(routers, 5):
+			assert flap_counter.count(router_id, now_ms) == query_flap_qty(db_conn, router_id, now_ms), (minute, router_id)
+
+
+def test_saved_rings_load_back():
+	flap_counter = FlapCounter(WINDOW_MS, FLAP_QTY)
+	now_ms = 1706659320000
+	for i in range(40): # enough to grow the ring past its starting size
+		flap_counter.record("10.69.0.1", now_ms + i * 1000)
+	flap_counter.record("10.69.0.2", now_ms)
+
+	loaded = FlapCounter(WINDOW_MS, FLAP_QTY)
+	for router_id, ring in flap_counter.take_dirty().items():
+		loaded.load(router_id, ring.to_bytes())
+	assert loaded.flappy_nodes(now_ms + 40000) == ["10.69.0.1"]
+	assert loaded.count("10.69.0.1", now_ms + 40000) == 40
+	assert loaded.count("10.69.0.2", now_ms + 40000) == 1
+	assert list(TimestampRing.from_bytes(b"").ordered()) == []
@@ -0,0 +1,68 @@
+import logging
+from nodewatcher import make_config
+from nodewatcher.slack import Reactions
+
+
+# A channel too long for reaction_snapshot_max_pages to get through: nodes whose threads are older than a scan can
+# reach shouldn't have every history page walked for them each cycle, only to end up at reactions.get anyway
+
+MESSAGE_QTY = 5000 # 25 pages of 200
+OLD_TS      = "1000000000.000100"
+NEW_TS      = "1000004990.000100"
+
+
+class FakeResponse:
+
+	def __init__(self, json_data):
+		self.json_data = json_data
+
+	def json(self):
+		return( self.json_data )
+
+
+class FakeSlack:
+
+	def __init__(self):
+		# newest first, like conversations.history
+		self.messages = [{"ts": "%d.000100" % (1000000000 + i), "reactions": []} for i in range(MESSAGE_QTY - 1, -1, -1)]
+		self.calls = {"conversations.history": 0, "reactions.get": 0}
+
+	def get(self, URI, params):
+		method = URI.rsplit("/", 1)[1]
+		self.calls[method] += 1
+		if method == "reactions.get":
+			return( FakeResponse({"ok": True, "message": {"reactions": [{"name": "x"}] if params["timestamp"] == OLD_TS else []}}) )
+		start = int(params.get("cursor", 0))
+		messages = [message for message in self.messages if float(message["ts"]) >= float(params.get("oldest", 0))]
+		page = messages[start:start + params["limit"]]
+		next_cursor = str(start + params["limit"]) if start + params["limit"] < len(messages) else ""
+		return( FakeResponse({"ok": True, "messages": page, "response_metadata": {"next_cursor": next_cursor}}) )
+
+
+class FakeStorage:
+
+	def __init__(self, threads):
+		self.slack_threads = threads
+		self.message_keys  = {ts: key for key, ts in threads.items()}
+
+	def get_message_ts(self, key):
+		return( [self.slack_threads[key]] if key in self.slack_threads else [] )
+
+
+def test_old_threads_skip_the_history_scan():
+	config = make_config("dev", {"slack_API_prefix": "https://slack.invalid/api/", "reaction_snapshot_max_pages": 10})
+	slack = FakeSlack()
+	reactions = Reactions(config, slack, FakeStorage({"10.69.1.1": OLD_TS, "10.69.1.2": NEW_TS}), logging.getLogger("test"))
+
+	calls_per_cycle = []
+	for cycle in range(4):
+		slack.calls = dict.fromkeys(slack.calls, 0)
+		reactions.begin_cycle(["10.69.1.1", "10.69.1.2"])
+		assert reactions.is_silenced("10.69.1.1")
+		assert not reactions.is_silenced("10.69.1.2")
+		calls_per_cycle.append(dict(slack.calls))
+
+	# the first cycle finds out how far back 10 pages go, after that the old thread is asked about directly
+	assert calls_per_cycle[0] == {"conversations.history": 10, "reactions.get": 1}
+	for calls in calls_per_cycle[1:]:
+		assert calls == {"conversations.history": 1, "reactions.get": 1}
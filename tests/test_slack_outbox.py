@@ -0,0 +1,81 @@
+import logging, socket, threading
+import pytest
+import requests
+from nodewatcher import slack_outbox
+from nodewatcher.http_sessions import make_session
+from nodewatcher.slack_outbox import SlackOutbox
+
+
+# A post that might have reached Slack must never be sent again, or an outage turns into duplicate alerts. Only a
+# connection that was never made gets retried
+
+
+class CountingSession(requests.Session):
+
+	def __init__(self, session):
+		super().__init__()
+		self.session = session
+		self.posts = 0
+
+	def post(self, *args, **kwargs):
+		self.posts += 1
+		return( self.session.post(*args, **kwargs) )
+
+
+# reads whatever request comes in, then hangs up without answering
+def serve_and_hang_up( server, received ):
+	while True:
+		try:
+			connection, address = server.accept()
+		except OSError:
+			return
+		with connection:
+			received.append(connection.recv(65536))
+
+
+def make_outbox( session ):
+	return( SlackOutbox(session, "C1", "C2", "https://slack.invalid/archives/", {}, {}, logging.getLogger("test"), max_attempts=3,
+	                    API_prefix="http://127.0.0.1:%d/" % session.port) )
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+	monkeypatch.setattr(slack_outbox, "sleep", lambda seconds: None)
+
+
+def test_dropped_connection_is_not_resent():
+	server = socket.create_server(("127.0.0.1", 0))
+	received = []
+	threading.Thread(target=serve_and_hang_up, args=(server, received), daemon=True).start()
+
+	session = CountingSession(make_session( timeout=(2, 2), retries=3 ))
+	session.port = server.getsockname()[1]
+	with pytest.raises(requests.exceptions.ConnectionError):
+		make_outbox( session ).post_message("node down", "C1")
+	server.close()
+	assert session.posts == 1
+	assert len(received) == 1
+
+
+def test_refused_connection_is_retried():
+	# a port nothing's listening on
+	server = socket.create_server(("127.0.0.1", 0))
+	port = server.getsockname()[1]
+	server.close()
+
+	session = CountingSession(make_session( timeout=(2, 2), retries=0 ))
+	session.port = port
+	with pytest.raises(requests.exceptions.ConnectionError):
+		make_outbox( session ).post_message("node down", "C1")
+	assert session.posts == 3
+
+
+def test_read_timeout_is_not_resent():
+	server = socket.create_server(("127.0.0.1", 0))
+	session = CountingSession(make_session( timeout=(2, 0.2), retries=3 ))
+	session.port = server.getsockname()[1]
+	# the connection gets made (the backlog takes it) but nothing ever answers
+	with pytest.raises(requests.exceptions.ReadTimeout):
+		make_outbox( session ).post_message("node down", "C1")
+	server.close()
+	assert session.posts == 1
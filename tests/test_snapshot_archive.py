@@ -0,0 +1,73 @@
+import random
+import datetime as dt
+from nodewatcher.snapshot_archive import SnapshotArchive
+
+
+# Every minute that goes into the archive should come back out the same, whether it was stored as a keyframe or as a
+# delta, from the archive that wrote it or from a fresh one reading the files back
+
+KEYFRAME_MINUTES = 5
+
+
+def make_snapshots( start_minute, minute_qty, seed=3 ):
+	rng = random.Random(seed)
+	routers = set("10.69.%d.%d" % (rng.randint(0, 255), rng.randint(1, 254)) for i in range(300))
+	snapshots = {}
+	for i in range(minute_qty):
+		# some minutes never make it in, like when BIRD couldn't be reached
+		if rng.random() < 0.1:
+			continue
+		for router_id in rng.sample(sorted(routers), 5):
+			routers.remove(router_id)
+		routers.update("10.70.%d.%d" % (rng.randint(0, 255), rng.randint(1, 254)) for i in range(5))
+		snapshots[start_minute + dt.timedelta(minutes=i)] = sorted(routers, key=lambda router_id: tuple(map(int, router_id.split("."))))
+	return( snapshots )
+
+
+def test_round_trip_across_keyframes_and_days(tmp_path):
+	# an hour either side of midnight, so there's a new day file partway through
+	start_minute = dt.datetime(2024, 1, 31, 23, 0, tzinfo=dt.timezone.utc)
+	snapshots = make_snapshots( start_minute, 120 )
+	archive = SnapshotArchive(str(tmp_path), KEYFRAME_MINUTES)
+	for minute, router_ids in snapshots.items():
+		assert archive.put(minute, router_ids) > 0
+	assert sorted(path.name for path in tmp_path.iterdir()) == ["2024-01-31.lsdb", "2024-02-01.lsdb"]
+
+	for minute, router_ids in snapshots.items():
+		assert archive.get(minute) == router_ids, minute
+	archive.close()
+
+	# and from disk, with nothing left over from writing
+	archive = SnapshotArchive(str(tmp_path), KEYFRAME_MINUTES)
+	for i in range(120):
+		minute = start_minute + dt.timedelta(minutes=i)
+		assert archive.get(minute) == snapshots.get(minute), minute
+		assert archive.has(minute) == (minute in snapshots)
+	archive.close()
+
+
+def test_keyframes_bound_the_deltas(tmp_path):
+	start_minute = dt.datetime(2024, 1, 31, 0, 0, tzinfo=dt.timezone.utc)
+	snapshots = make_snapshots( start_minute, 60 )
+	archive = SnapshotArchive(str(tmp_path), KEYFRAME_MINUTES)
+	for minute, router_ids in snapshots.items():
+		archive.put(minute, router_ids)
+
+	day_file = archive.open_day("2024-01-31")
+	chain_lengths = [archive.get_chain_length(day_file, minute.hour * 60 + minute.minute) for minute in snapshots]
+	assert max(chain_lengths) == KEYFRAME_MINUTES
+	assert chain_lengths.count(0) >= len(snapshots) // (KEYFRAME_MINUTES + 1)
+	# a minute that's already stored is left alone
+	first_minute = min(snapshots)
+	assert archive.put(first_minute, ["10.0.0.1"]) == 0
+	assert archive.get(first_minute) == snapshots[first_minute]
+	archive.close()
+
+
+def test_old_days_are_pruned(tmp_path):
+	# day files that are still open don't get pruned, so only the one being written to is kept open
+	archive = SnapshotArchive(str(tmp_path), KEYFRAME_MINUTES, keep_days=2, open_day_qty=1)
+	for day in range(1, 6):
+		archive.put(dt.datetime(2024, 1, day, 12, 0, tzinfo=dt.timezone.utc), ["10.69.1.1"])
+	archive.close()
+	assert sorted(path.name for path in tmp_path.iterdir()) == ["2024-01-03.lsdb", "2024-01-04.lsdb", "2024-01-05.lsdb"]
@@ -0,0 +1,30 @@
+from nodewatcher.topology import get_exit_path
+
+
+def make_graph( adjacency, egress ):
+	return( {"adjacency": adjacency, "egress": set(egress), "next_hop": None} )
+
+
+def test_cheapest_way_out():
+	graph = make_graph({
+		"10.0.0.1": {"10.0.0.2": 10},
+		"10.0.0.2": {"10.0.0.1": 10, "10.0.0.3": 10},
+		"10.0.0.3": {"10.0.0.2": 10, "10.0.0.4": 5},
+		"10.0.0.4": {"10.0.0.3": 5, "10.0.0.9": 100},
+		"10.0.0.9": {"10.0.0.4": 100},
+	}, ["10.0.0.1", "10.0.0.9"])
+	assert get_exit_path( graph, "10.0.0.4" ) == ["10.0.0.3", "10.0.0.2", "10.0.0.1"]
+	assert get_exit_path( graph, "10.0.0.1" ) == []
+	assert get_exit_path( graph, "10.0.0.5" ) == []
+
+
+# two egresses linked at cost 0 (or with no metric, which comes out as 0) tie on cost and router ID in the heap
+def test_egresses_linked_at_cost_0():
+	graph = make_graph({
+		"10.0.0.1": {"10.0.0.2": 0},
+		"10.0.0.2": {"10.0.0.1": 0},
+		"10.0.0.3": {"10.0.0.2": 10},
+	}, ["10.0.0.1", "10.0.0.2"])
+	assert get_exit_path( graph, "10.0.0.1" ) == []
+	assert get_exit_path( graph, "10.0.0.2" ) == []
+	assert get_exit_path( graph, "10.0.0.3" ) == ["10.0.0.2"]